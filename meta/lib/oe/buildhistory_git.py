@@ -0,0 +1,511 @@
+"""
+Commits of the buildhistory repository written without "git add" and
+"git commit".
+
+Finding the changes of a build with "git status", staging them with
+"git add -A" and committing them with one "git commit" per top level
+directory scans the whole work tree several times, which gets slow as the
+repository grows. Instead the functions writing buildhistory record the
+directories they (re)write in a journal, and only those are compared with
+the index here, using the stat data of the index entries to avoid reading
+files which didn't change. Blobs, trees and commits are written to the
+object database directly, the branch is moved with "git update-ref" and
+the index is rewritten to match the last commit, with a complete
+cache-tree so that the trees of unchanged directories are reused by the
+next commit without being rebuilt.
+
+The commits are the same as with the shell implementation: one per top
+level directory with changes, in sorted order, the first one also holding
+metadata-revs, or a single "No changes" commit if nothing else changed.
+.gitignore files are not taken into account.
+"""
+
+import binascii
+import bisect
+import collections
+import hashlib
+import os
+import stat
+import struct
+import subprocess
+import time
+import zlib
+
+METADATA_REVS = b"metadata-revs"
+
+# Journal line asking for the whole work tree to be scanned
+FULL_SCAN = "*"
+
+IndexEntry = collections.namedtuple("IndexEntry", "ctime_s ctime_ns mtime_s mtime_ns dev ino mode uid gid size sha")
+
+def record_change(journal, path):
+    """Record in journal that the buildhistory at path was (re)written"""
+    with open(journal, "a") as f:
+        f.write(path + "\n")
+
+def request_full_scan(journal):
+    """Make the next commit compare the whole work tree with the index"""
+    with open(journal, "w") as f:
+        f.write(FULL_SCAN + "\n")
+
+def read_journal(journal, repodir):
+    """
+    Return the paths (relative to repodir, as bytes) recorded in journal,
+    without those inside another recorded path, or None if the whole work
+    tree needs to be scanned.
+    """
+    try:
+        with open(journal) as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return None
+    paths = set()
+    for line in lines:
+        if line == FULL_SCAN:
+            return None
+        if not line:
+            continue
+        rel = os.path.relpath(line, repodir)
+        if rel == os.curdir:
+            return None
+        if rel != os.pardir and not rel.startswith(os.pardir + os.sep):
+            paths.add(os.fsencode(rel))
+    result = []
+    for path in sorted(paths):
+        if not result or not path.startswith(result[-1] + b"/"):
+            result.append(path)
+    return result
+
+def _mask(value):
+    return value & 0xffffffff
+
+def stat_entry(st, mode, sha):
+    """Return the index entry of a file with lstat() result st"""
+    return IndexEntry(_mask(st.st_ctime_ns // 1000000000), st.st_ctime_ns % 1000000000,
+                      _mask(st.st_mtime_ns // 1000000000), st.st_mtime_ns % 1000000000,
+                      _mask(st.st_dev), _mask(st.st_ino), mode,
+                      _mask(st.st_uid), _mask(st.st_gid), _mask(st.st_size), sha)
+
+def _git_mode(st):
+    if stat.S_ISLNK(st.st_mode):
+        return 0o120000
+    if st.st_mode & stat.S_IXUSR:
+        return 0o100755
+    return 0o100644
+
+def _read_cache_tree(data, trees):
+    pos = 0
+
+    def node(parent):
+        nonlocal pos
+        end = data.index(b"\n", pos)
+        name, counts = data[pos:end].split(b"\0", 1)
+        entries, subtrees = counts.split(b" ")
+        pos = end + 1
+        path = parent + b"/" + name if parent else name
+        if int(entries) >= 0:
+            trees[path] = data[pos:pos + 20]
+            pos += 20
+        for i in range(int(subtrees)):
+            node(path)
+
+    node(b"")
+
+def read_index(path):
+    """
+    Return the entries of the git index at path, as a dictionary mapping
+    paths to IndexEntry, and its cache-tree, as a dictionary mapping
+    directories to the ids of their trees (for the valid ones), or None if
+    there is no index. Raises ValueError for indexes which can't be used
+    here: corrupt ones, versions other than 2 and 3, unmerged entries and
+    required extensions such as split indexes.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < 32 or data[:4] != b"DIRC" or hashlib.sha1(data[:-20]).digest() != data[-20:]:
+        raise ValueError("Invalid git index %s" % path)
+    version, count = struct.unpack_from(">II", data, 4)
+    if version not in (2, 3):
+        raise ValueError("Unsupported git index version %d" % version)
+
+    entries = {}
+    pos = 12
+    for i in range(count):
+        fields = struct.unpack_from(">10I20sH", data, pos)
+        flags = fields[11]
+        if flags & 0x4000:
+            raise ValueError("Unsupported extended entry in git index %s" % path)
+        if flags & 0x3000:
+            raise ValueError("Unmerged entry in git index %s" % path)
+        end = data.index(b"\0", pos + 62)
+        entries[data[pos + 62:end]] = IndexEntry(*fields[:11])
+        pos += (end - pos + 8) & ~7
+
+    trees = {}
+    while pos < len(data) - 20:
+        sig, size = struct.unpack_from(">4sI", data, pos)
+        pos += 8
+        if sig == b"TREE":
+            _read_cache_tree(data[pos:pos + size], trees)
+        elif not sig[:1].isupper():
+            raise ValueError("Unsupported extension %s in git index %s" % (sig.decode("latin-1"), path))
+        pos += size
+    return entries, trees
+
+def write_index(path, entries, cache_tree=None):
+    """
+    Write the git index at path (version 2) with entries, a dictionary
+    mapping paths to IndexEntry, and the TREE extension cache_tree. The
+    index is locked and replaced the way git does it. Entries modified in
+    the current second are "smudged" like git does, so that they are
+    checked again even if the file changes without its size and
+    modification time changing.
+    """
+    now = int(time.time())
+    data = [struct.pack(">4sII", b"DIRC", 2, len(entries))]
+    for name in sorted(entries):
+        e = entries[name]
+        size = 0 if e.mtime_s >= now else e.size
+        entry = struct.pack(">10I20sH", e.ctime_s, e.ctime_ns, e.mtime_s, e.mtime_ns, e.dev, e.ino,
+                            e.mode, e.uid, e.gid, size, e.sha, min(len(name), 0xfff)) + name
+        data.append(entry + b"\0" * (8 - len(entry) % 8))
+    if cache_tree is not None:
+        data.append(b"TREE" + struct.pack(">I", len(cache_tree)) + cache_tree)
+    data = b"".join(data)
+    data += hashlib.sha1(data).digest()
+
+    lockfile = path + ".lock"
+    fd = os.open(lockfile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.rename(lockfile, path)
+    except:
+        os.unlink(lockfile)
+        raise
+
+def _cleanup_message(message):
+    # What "git commit -F" does to messages with the default cleanup mode
+    lines = [line.rstrip() for line in message.splitlines()]
+    cleaned = []
+    for line in lines:
+        if line or (cleaned and cleaned[-1]):
+            cleaned.append(line)
+    while cleaned and not cleaned[-1]:
+        cleaned.pop()
+    return "\n".join(cleaned) + "\n"
+
+class Repo(object):
+    """The git repository with its work tree at path"""
+
+    def __init__(self, path):
+        self.path = path
+        self.gitdir = os.path.join(path, ".git")
+        self.objdir = os.path.join(self.gitdir, "objects")
+
+    def git(self, *args, **kwargs):
+        """Run git with args in the work tree and return its output"""
+        return subprocess.check_output(("git",) + args, cwd=self.path, **kwargs)
+
+    def head(self):
+        """Return the id of the HEAD commit and of its tree, or None"""
+        try:
+            commit, tree = self.git("rev-parse", "HEAD", "HEAD^{tree}",
+                                    stderr=subprocess.DEVNULL).decode().split()
+        except subprocess.CalledProcessError:
+            return None
+        return commit, bytes.fromhex(tree)
+
+    def set_default_identity(self, name, email):
+        """Configure the committer identity in the repository if there is none"""
+        for key, value in (("user.email", email), ("user.name", name)):
+            if subprocess.call(["git", "config", key], cwd=self.path, stdout=subprocess.DEVNULL) != 0:
+                self.git("config", "--local", key, value)
+
+    def exclude(self, name):
+        """Add name to the patterns in .git/info/exclude if missing"""
+        excludefile = os.path.join(self.gitdir, "info", "exclude")
+        try:
+            with open(excludefile) as f:
+                if "/" + name in f.read().splitlines():
+                    return
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(excludefile), exist_ok=True)
+        with open(excludefile, "a") as f:
+            f.write("/%s\n" % name)
+
+    def write_object(self, kind, data):
+        """
+        Write a loose object of type kind (b"blob", b"tree" or b"commit")
+        unless it already exists as a loose object, and return its id
+        """
+        header = kind + (" %d\0" % len(data)).encode()
+        sha = hashlib.sha1(header)
+        sha.update(data)
+        hexsha = sha.hexdigest()
+        fn = os.path.join(self.objdir, hexsha[:2], hexsha[2:])
+        if not os.path.exists(fn):
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            tmpfn = "%s.tmp.%d" % (fn, os.getpid())
+            with open(tmpfn, "wb") as f:
+                f.write(zlib.compress(header + data))
+            os.chmod(tmpfn, 0o444)
+            os.rename(tmpfn, fn)
+        return sha.digest()
+
+    def tree_entries(self, commit):
+        """Return the files of commit as index entries without stat data"""
+        entries = {}
+        for item in self.git("ls-tree", "-r", "-z", "--full-tree", commit).split(b"\0"):
+            if item:
+                info, path = item.split(b"\t", 1)
+                mode, kind, sha = info.split()
+                entries[path] = IndexEntry(0, 0, 0, 0, 0, 0, int(mode, 8), 0, 0, 0, bytes.fromhex(sha.decode()))
+        return entries
+
+    def commit(self, tree, parent, author, message):
+        """
+        Write a commit of tree with the given parent (None for a root
+        commit), author ("Name <email>") and message, move HEAD to it and
+        return its id
+        """
+        ident = self.git("var", "GIT_COMMITTER_IDENT").decode().strip()
+        date = ident.rsplit(" ", 2)[1:]
+        message = _cleanup_message(message)
+        lines = ["tree %s" % binascii.hexlify(tree).decode()]
+        if parent:
+            lines.append("parent %s" % parent)
+        lines.append("author %s %s %s" % (author, date[0], date[1]))
+        lines.append("committer %s" % ident)
+        commit = self.write_object(b"commit", ("\n".join(lines) + "\n\n" + message).encode("utf-8"))
+        commit = binascii.hexlify(commit).decode()
+        reflog = "commit%s: %s" % ("" if parent else " (initial)", message.split("\n", 1)[0])
+        self.git("update-ref", "-m", reflog, "HEAD", commit, parent or "")
+        return commit
+
+class TreeBuilder(object):
+    """
+    The directories of a set of index entries, with the ids of the trees
+    which are known to be up to date (the cache-tree)
+    """
+
+    def __init__(self, repo, entries, trees):
+        self.repo = repo
+        self.entries = entries
+        self.trees = dict(trees)
+        # Directory -> {name: True for subdirectories, False for files}
+        self.dirs = {b"": {}}
+        for path in entries:
+            self._add(path, False)
+
+    def _add(self, path, isdir):
+        parent, _, name = path.rpartition(b"/")
+        children = self.dirs.get(parent)
+        if children is None:
+            children = self.dirs[parent] = {}
+            self._add(parent, True)
+        children[name] = isdir
+
+    def _remove(self, path):
+        parent, _, name = path.rpartition(b"/")
+        children = self.dirs[parent]
+        del children[name]
+        if not children and parent:
+            del self.dirs[parent]
+            self.trees.pop(parent, None)
+            self._remove(parent)
+
+    def _invalidate(self, path):
+        while True:
+            path = path.rpartition(b"/")[0]
+            self.trees.pop(path, None)
+            if not path:
+                break
+
+    def set(self, path, entry):
+        """Set the index entry of path, or remove path if entry is None"""
+        old = self.entries.get(path)
+        if entry is None:
+            if old is None:
+                return
+            del self.entries[path]
+            self._remove(path)
+        else:
+            self.entries[path] = entry
+            if old is not None and old.mode == entry.mode and old.sha == entry.sha:
+                return
+            if old is None:
+                if self.dirs.get(path.rpartition(b"/")[0], {}).get(path.rpartition(b"/")[2]):
+                    raise ValueError("%s is a directory in the index" % path.decode("utf-8", "replace"))
+                self._add(path, False)
+        self._invalidate(path)
+
+    def write_tree(self, path=b""):
+        """Write the tree objects needed for directory path and return its id"""
+        sha = self.trees.get(path)
+        if sha is None:
+            items = []
+            for name, isdir in self.dirs.get(path, {}).items():
+                child = path + b"/" + name if path else name
+                if isdir:
+                    items.append((name + b"/", b"40000", name, self.write_tree(child)))
+                else:
+                    entry = self.entries[child]
+                    items.append((name, ("%o" % entry.mode).encode(), name, entry.sha))
+            items.sort()
+            data = b"".join(mode + b" " + name + b"\0" + sha for key, mode, name, sha in items)
+            sha = self.trees[path] = self.repo.write_object(b"tree", data)
+        return sha
+
+    def cache_tree(self):
+        """Return the TREE index extension describing the known trees"""
+        def node(path, name):
+            children = self.dirs.get(path, {})
+            # Subtrees are ordered by the length of their names first
+            subdirs = sorted((n for n, isdir in children.items() if isdir), key=lambda n: (len(n), n))
+            count = len(children) - len(subdirs)
+            parts = []
+            for subdir in subdirs:
+                data, subcount = node(path + b"/" + subdir if path else subdir, subdir)
+                parts.append(data)
+                count += subcount
+            sha = self.trees.get(path)
+            if sha is None:
+                header = name + ("\0-1 %d\n" % len(subdirs)).encode()
+            else:
+                header = name + ("\0%d %d\n" % (count, len(subdirs))).encode() + sha
+            return header + b"".join(parts), count
+
+        return node(b"", b"")[0]
+
+def _scan(root, top, skip):
+    """Yield the (path, lstat result) of the files at or below top in root"""
+    full = os.path.join(root, top) if top else root
+    try:
+        st = os.lstat(full)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISDIR(st.st_mode):
+        if stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode):
+            yield top, st
+        return
+    todo = [top]
+    while todo:
+        current = todo.pop()
+        dirpath = os.path.join(root, current) if current else root
+        for name in os.listdir(dirpath):
+            if name == b".git" or (not current and name in skip):
+                continue
+            path = current + b"/" + name if current else name
+            st = os.lstat(os.path.join(dirpath, name))
+            if stat.S_ISDIR(st.st_mode):
+                todo.append(path)
+            elif stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode):
+                yield path, st
+
+def _under(paths, top):
+    """Return the paths of the sorted list paths at or below top"""
+    if not top:
+        return paths
+    i = bisect.bisect_left(paths, top)
+    found = [top] if i < len(paths) and paths[i] == top else []
+    return found + paths[bisect.bisect_left(paths, top + b"/"):bisect.bisect_left(paths, top + b"0")]
+
+def commit_changes(repodir, journal, author, message):
+    """
+    Commit the changes made to the work tree of the git repository at
+    repodir since the last commit, in the paths recorded in journal (or in
+    the whole work tree if the journal is missing or asks for it). author
+    is the author of the commits, and message a function returning the
+    commit message for a top level directory, or for the "No changes"
+    commit when called with None. The journal is emptied once the commits
+    are made.
+
+    Returns the top level directories with changes.
+    """
+    repo = Repo(repodir)
+    indexfile = os.path.join(repo.gitdir, "index")
+    head = repo.head()
+    try:
+        index = read_index(indexfile)
+    except ValueError:
+        index = None
+    entries, trees = index or ({}, {})
+    if not head:
+        entries, trees = {}, {}
+    elif trees.get(b"") != head[1]:
+        # The index doesn't match HEAD: start from the files of HEAD, and
+        # only keep the stat data of the index entries for the same blobs
+        indexed = entries
+        entries = repo.tree_entries(head[0])
+        for path, entry in entries.items():
+            old = indexed.get(path)
+            if old and old.mode == entry.mode and old.sha == entry.sha:
+                entries[path] = old
+        trees = {}
+    try:
+        racy = os.stat(indexfile).st_mtime_ns
+    except FileNotFoundError:
+        racy = 0
+
+    tops = read_journal(journal, repodir) if head else None
+    if tops is None:
+        tops = [b""]
+    elif METADATA_REVS not in tops:
+        tops.append(METADATA_REVS)
+
+    # Compare the scanned files with the index
+    root = os.fsencode(repodir)
+    skip = set()
+    if os.path.dirname(os.path.abspath(journal)) == os.path.abspath(repodir):
+        skip.add(os.fsencode(os.path.basename(journal)))
+        repo.exclude(os.path.basename(journal))
+    indexed = sorted(entries)
+    changes = {}
+    scanned = {}
+    for top in tops:
+        for path, st in _scan(root, top, skip):
+            old = entries.get(path)
+            mode = _git_mode(st)
+            new = stat_entry(st, mode, None)
+            if (old and old.mode == mode and old[:6] == new[:6] and old[7:10] == new[7:10] and
+                    old.mtime_s * 1000000000 + old.mtime_ns < racy):
+                sha = old.sha
+            elif mode == 0o120000:
+                sha = repo.write_object(b"blob", os.readlink(os.path.join(root, path)))
+            else:
+                with open(os.path.join(root, path), "rb") as f:
+                    sha = repo.write_object(b"blob", f.read())
+            scanned[path] = new._replace(sha=sha)
+            if not old or old.mode != mode or old.sha != sha:
+                changes[path] = scanned[path]
+        for path in _under(indexed, top):
+            if path not in scanned:
+                changes[path] = None
+
+    groups = collections.defaultdict(list)
+    for path in changes:
+        if path != METADATA_REVS:
+            groups[path.split(b"/", 1)[0]].append(path)
+    changed = sorted(groups)
+    if METADATA_REVS in changes:
+        groups[changed[0] if changed else None].append(METADATA_REVS)
+
+    builder = TreeBuilder(repo, entries, trees)
+    parent = head[0] if head else None
+    for top in changed or [None]:
+        # Removals first, in case a file is replaced by a directory
+        for path in sorted(groups[top], key=lambda p: changes[p] is not None):
+            builder.set(path, changes[path])
+        item = top.decode("utf-8", "surrogateescape") if top else None
+        parent = repo.commit(builder.write_tree(), parent, author, message(item))
+
+    for path, entry in scanned.items():
+        builder.set(path, entry)
+    write_index(indexfile, builder.entries, builder.cache_tree())
+    with open(journal, "w"):
+        pass
+    return [top.decode("utf-8", "surrogateescape") for top in changed]
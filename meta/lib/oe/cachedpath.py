@@ -6,106 +6,168 @@
 
 import os
 import errno
+import collections
 import stat as statmod
 
+class CachedStat(object):
+    """
+    The fields of an os.stat_result the users of CachedPath need, which
+    can be read as attributes or, for those in the stat tuple, by index.
+    For symbolic links 'target' is the CachedStat of the link target, or
+    False if it doesn't exist.
+    """
+    __slots__ = ("st_mode", "st_ino", "st_dev", "st_uid", "st_gid", "st_size", "st_mtime", "target")
+
+    _indexes = {statmod.ST_MODE: "st_mode", statmod.ST_INO: "st_ino", statmod.ST_DEV: "st_dev",
+                statmod.ST_UID: "st_uid", statmod.ST_GID: "st_gid", statmod.ST_SIZE: "st_size"}
+
+    def __init__(self, st):
+        self.st_mode = st.st_mode
+        self.st_ino = st.st_ino
+        self.st_dev = st.st_dev
+        self.st_uid = st.st_uid
+        self.st_gid = st.st_gid
+        self.st_size = st.st_size
+        self.st_mtime = st.st_mtime
+        self.target = None
+
+    def __getitem__(self, index):
+        if index == statmod.ST_MTIME:
+            return int(self.st_mtime)
+        return getattr(self, self._indexes[index])
+
+    def __repr__(self):
+        return "CachedStat(st_mode=%o, st_ino=%d, st_dev=%d, st_size=%d)" % (self.st_mode, self.st_ino, self.st_dev, self.st_size)
+
 class CachedPath(object):
-    def __init__(self):
-        self.statcache = {}
-        self.lstatcache = {}
-        self.normpathcache = {}
+    """
+    Cache of the (l)stat results of paths. Entries are CachedStat records,
+    False for paths which don't exist, or for entries seen by walk() just
+    the file type bits, which answer isdir(), islink() and friends without
+    any system call; stat() and lstat() fill in the rest when needed.
+
+    If maxsize is given the cache holds at most that many paths, dropping
+    the oldest ones first.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        if maxsize:
+            self.cache = collections.OrderedDict()
+        else:
+            self.cache = {}
         return
 
+    def _store(self, path, value):
+        self.cache[path] = value
+        if self.maxsize and len(self.cache) > self.maxsize:
+            # Make room for a few more at once
+            for i in range(len(self.cache) - self.maxsize + max(1, self.maxsize // 16)):
+                self.cache.popitem(last=False)
+
     def updatecache(self, x):
         x = self.normpath(x)
-        if x in self.statcache:
-            del self.statcache[x]
-        if x in self.lstatcache:
-            del self.lstatcache[x]
+        if x in self.cache:
+            del self.cache[x]
+
+    def invalidate(self, top):
+        """
+        Forget top and everything below it, and the targets of all symbolic
+        links since those may point there.
+        """
+        top = self.normpath(top)
+        prefix = top.rstrip(os.sep) + os.sep
+        for path in [path for path, value in self.cache.items()
+                     if path == top or path.startswith(prefix) or
+                        (type(value) is CachedStat and value.target is not None)]:
+            del self.cache[path]
 
     def normpath(self, path):
-        if path in self.normpathcache:
-            return self.normpathcache[path]
-        newpath = os.path.normpath(path)
-        self.normpathcache[path] = newpath
-        return newpath
-
-    def _callstat(self, path):
-        if path in self.statcache:
-            return self.statcache[path]
-        try:
-            st = os.stat(path)
-            self.statcache[path] = st
-            return st
-        except os.error:
-            self.statcache[path] = False
-            return False
+        # Most paths are already normalised
+        if path and "//" not in path and "/." not in path and not path.endswith("/") and not path.startswith("."):
+            return path
+        return os.path.normpath(path)
 
     # We might as well call lstat and then only 
     # call stat as well in the symbolic link case
     # since this turns out to be much more optimal
     # in real world usage of this cache
-    def callstat(self, path):
+    def _lstat(self, path):
+        try:
+            lst = CachedStat(os.lstat(path))
+        except (os.error, AttributeError):
+            self._store(path, False)
+            return False
+        if statmod.S_ISLNK(lst.st_mode):
+            try:
+                lst.target = CachedStat(os.stat(path))
+            except os.error:
+                lst.target = False
+        self._store(path, lst)
+        return lst
+
+    def _mode(self, path, follow):
+        # The mode (possibly just the file type) of path, or None
         path = self.normpath(path)
-        self.calllstat(path)
-        return self.statcache[path]
+        value = self.cache.get(path)
+        if value is None or (value == statmod.S_IFLNK and follow):
+            value = self._lstat(path)
+        if not value:
+            return None
+        if type(value) is int:
+            return value
+        if follow and value.target is not None:
+            return value.target.st_mode if value.target else None
+        return value.st_mode
 
     def calllstat(self, path):
         path = self.normpath(path)
-        if path in self.lstatcache:
-            return self.lstatcache[path]
-        #bb.error("LStatpath:" + path)
-        try:
-            lst = os.lstat(path)
-            self.lstatcache[path] = lst
-            if not statmod.S_ISLNK(lst.st_mode):
-                self.statcache[path] = lst
-            else:
-                self._callstat(path)
-            return lst
-        except (os.error, AttributeError):
-            self.lstatcache[path] = False
-            self.statcache[path] = False
-            return False
+        value = self.cache.get(path)
+        if value is None or type(value) is int:
+            value = self._lstat(path)
+        return value
+
+    def callstat(self, path):
+        lst = self.calllstat(path)
+        if lst and lst.target is not None:
+            return lst.target
+        return lst
 
     # This follows symbolic links, so both islink() and isdir() can be true
     # for the same path ono systems that support symlinks
     def isfile(self, path):
         """Test whether a path is a regular file"""
-        st = self.callstat(path)
-        if not st:
+        mode = self._mode(path, True)
+        if mode is None:
             return False
-        return statmod.S_ISREG(st.st_mode)
+        return statmod.S_ISREG(mode)
 
     # Is a path a directory?
     # This follows symbolic links, so both islink() and isdir()
     # can be true for the same path on systems that support symlinks
     def isdir(self, s):
         """Return true if the pathname refers to an existing directory."""
-        st = self.callstat(s)
-        if not st:
+        mode = self._mode(s, True)
+        if mode is None:
             return False
-        return statmod.S_ISDIR(st.st_mode)
+        return statmod.S_ISDIR(mode)
 
     def islink(self, path):
         """Test whether a path is a symbolic link"""
-        st = self.calllstat(path)
-        if not st:
+        mode = self._mode(path, False)
+        if mode is None:
             return False
-        return statmod.S_ISLNK(st.st_mode)
+        return statmod.S_ISLNK(mode)
 
     # Does a path exist?
     # This is false for dangling symbolic links on systems that support them.
     def exists(self, path):
         """Test whether a path exists.  Returns False for broken symbolic links"""
-        if self.callstat(path):
-            return True
-        return False
+        return self._mode(path, True) is not None
 
     def lexists(self, path):
         """Test whether a path exists.  Returns True for broken symbolic links"""
-        if self.calllstat(path):
-            return True
-        return False
+        return self._mode(path, False) is not None
 
     def stat(self, path):
         return self.callstat(path)
@@ -113,6 +175,26 @@ class CachedPath(object):
     def lstat(self, path):
         return self.calllstat(path)
 
+    def _listdir(self, top):
+        if not hasattr(os, "scandir"):
+            # Python < 3.5, isdir() will lstat the entries
+            return os.listdir(top)
+
+        # The directory entries give the file types, which is all walk()
+        # and most of the users of the cache need
+        names = []
+        for entry in os.scandir(top):
+            path = self.normpath(entry.path)
+            if path not in self.cache:
+                if entry.is_symlink():
+                    self._store(path, statmod.S_IFLNK)
+                elif entry.is_dir(follow_symlinks=False):
+                    self._store(path, statmod.S_IFDIR)
+                elif entry.is_file(follow_symlinks=False):
+                    self._store(path, statmod.S_IFREG)
+            names.append(entry.name)
+        return names
+
     def walk(self, top, topdown=True, onerror=None, followlinks=False):
         # Matches os.walk, not os.path.walk()
 
@@ -122,7 +204,7 @@ class CachedPath(object):
         # minor reason when (say) a thousand readable directories are still
         # left to visit.  That logic is copied here.
         try:
-            names = os.listdir(top)
+            names = self._listdir(top)
         except os.error as err:
             if onerror is not None:
                 onerror(err)
@@ -1,3 +1,92 @@
+import collections
+import fnmatch
+import os
+import re
+import stat
+import struct
+
+# Return type (bits) of is_elf():
+# 0 - not elf
+# 1 - ELF
+# 2 - stripped
+# 4 - executable
+# 8 - shared library
+# 16 - kernel module
+_elf_type_cache = {}
+
+def _elf_type(path):
+    import oe.qa
+
+    elf = oe.qa.ELFFile(path)
+    try:
+        elf.open()
+    except oe.qa.NotELFFileError:
+        return 0
+
+    type = 1
+    try:
+        if elf.isStripped():
+            type |= 2
+        etype = elf.elfType()
+        if etype == oe.qa.ELFFile.ET_EXEC:
+            type |= 4
+        elif etype == oe.qa.ELFFile.ET_DYN:
+            type |= elf.isPIE() and 4 or 8
+        elif etype == oe.qa.ELFFile.ET_REL and ".modinfo" in elf.sectionNames():
+            type |= 16
+    except struct.error:
+        # Truncated headers, file(1) would still call it an ELF
+        pass
+    return type
+
+def is_elf(path):
+    """
+    Classify file 'path' from its ELF and section headers, returning the type
+    bits listed above. Results are cached per (device, inode, mtime, size),
+    so asking again about an unchanged file doesn't read it. Errors accessing
+    the file are raised as OSError.
+    """
+    s = os.stat(path)
+    key = (s.st_dev, s.st_ino, s.st_mtime_ns, s.st_size)
+    type = _elf_type_cache.get(key)
+    if type is None:
+        type = _elf_type(path)
+        _elf_type_cache[key] = type
+    return type
+
+def is_elf_files(paths, nproc=None):
+    """
+    Classify all files in 'paths' with is_elf() from a pool of threads.
+    Returns a dict mapping each path to its type bits, or to the OSError
+    raised when classifying it.
+    """
+    import concurrent.futures
+
+    def classify(path):
+        try:
+            return is_elf(path)
+        except OSError as e:
+            return e
+
+    paths = list(set(paths))
+    if not nproc:
+        nproc = os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=nproc) as executor:
+        return dict(zip(paths, executor.map(classify, paths)))
+
+def strip_flags(file, elftype):
+    # Return the extra strip arguments for a file of the given elftype
+    # kernel module
+    if elftype & 16:
+        return "--strip-debug --remove-section=.comment --remove-section=.note --preserve-dates"
+    # .so and shared library
+    elif ".so" in file and elftype & 8:
+        return "--remove-section=.comment --remove-section=.note --strip-unneeded"
+    # shared or executable:
+    elif elftype & 8 or elftype & 4:
+        return "--remove-section=.comment --remove-section=.note"
+    return ""
+
 def runstrip(arg):
     # Function to strip a single file, called from split_and_strip_files below
     # A working 'file' (one which works on the target architecture)
@@ -18,17 +107,7 @@ def runstrip(arg):
         newmode = origmode | stat.S_IWRITE | stat.S_IREAD
         os.chmod(file, newmode)
 
-    extraflags = ""
-
-    # kernel module    
-    if elftype & 16:
-        extraflags = "--strip-debug --remove-section=.comment --remove-section=.note --preserve-dates"
-    # .so and shared library
-    elif ".so" in file and elftype & 8:
-        extraflags = "--remove-section=.comment --remove-section=.note --strip-unneeded"
-    # shared or executable:
-    elif elftype & 8 or elftype & 4:
-        extraflags = "--remove-section=.comment --remove-section=.note"
+    extraflags = strip_flags(file, elftype)
 
     stripcmd = "'%s' %s '%s'" % (strip, extraflags, file)
     bb.debug(1, "runstrip: %s" % stripcmd)
@@ -43,93 +122,702 @@ def runstrip(arg):
 
     return
 
+def splitdebuginfo(arg):
+    # Function to split a single file into two components, one is the stripped
+    # target system binary, the other contains any debugging information. The
+    # two files are linked to reference each other. Called from
+    # splitdebuginfo_files() below, returns an error message on failure.
+    #
+    # The debug sources of the file are appended to a list specific to the
+    # worker process, named after sourcefile.
+
+    import stat, subprocess
+
+    (file, debugfile, debugsrcdir, sourcefile, objcopy, debugedit) = arg
+
+    # We ignore kernel modules, we don't generate debug info files.
+    if file.find("/lib/modules/") != -1 and file.endswith(".ko"):
+        return None
+
+    newmode = None
+    if not os.access(file, os.W_OK) or os.access(file, os.R_OK):
+        origmode = os.stat(file)[stat.ST_MODE]
+        newmode = origmode | stat.S_IWRITE | stat.S_IREAD
+        os.chmod(file, newmode)
+
+    cmds = []
+    # We need to extract the debug src information here...
+    if debugsrcdir:
+        cmds.append(("debugedit", "'%s' -i -l '%s.%d' '%s'" % (debugedit, sourcefile, os.getpid(), file)))
+    cmds.append(("objcopy", "'%s' --only-keep-debug '%s' '%s'" % (objcopy, file, debugfile)))
+    # Set the debuglink to have the view of the file path on the target
+    cmds.append(("objcopy", "'%s' --add-gnu-debuglink='%s' '%s'" % (objcopy, debugfile, file)))
+
+    bb.utils.mkdirhier(os.path.dirname(debugfile))
+    for (name, cmd) in cmds:
+        try:
+            subprocess.check_output(cmd, stderr=subprocess.STDOUT, shell=True)
+        except subprocess.CalledProcessError as e:
+            output = e.output.decode("utf-8", errors="replace").rstrip()
+            return "%s failed with exit code %s (cmd was %s)%s" % (name, e.returncode, cmd, ":\n%s" % output if output else "")
+
+    if newmode:
+        os.chmod(file, origmode)
+
+    return None
+
+def splitdebuginfo_files(files, debugsrcdir, sourcefile, objcopy, debugedit):
+    """
+    Split the debug information out of 'files', a list of (file, debugfile)
+    pairs, in a pool of worker processes. The debug sources lists written by
+    the workers are merged into 'sourcefile', sorted and without duplicates.
+    Returns the list of error messages.
+    """
+    import glob
+    import oe.utils
+
+    for fragment in glob.glob(glob.escape(sourcefile) + ".*"):
+        os.unlink(fragment)
+
+    errors = oe.utils.multiprocess_exec([(file, debugfile, debugsrcdir, sourcefile, objcopy, debugedit)
+                                         for (file, debugfile) in files], splitdebuginfo)
+
+    sources = set()
+    for fragment in glob.glob(glob.escape(sourcefile) + ".*"):
+        with open(fragment, "rb") as f:
+            sources.update(f.read().split(b"\0"))
+        os.unlink(fragment)
+    sources.discard(b"")
+    if sources:
+        with open(sourcefile, "ab") as f:
+            for source in sorted(sources):
+                f.write(source + b"\0")
+
+    return errors
+
+def _strip_identity(strip):
+    # Identify the strip binary found on PATH by its resolved path, size
+    # and mtime, so that an upgraded binutils doesn't reuse stale results.
+    # Returns None if it can't be found.
+    import shutil
+
+    path = shutil.which(strip)
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return "%s %d %d" % (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+
+def _strip_cache_path(file, extraflags, stripid, cachedir):
+    # The cache key covers the file contents and mode, the strip arguments
+    # and the identity of the strip binary itself (see _strip_identity())
+    import hashlib
+
+    h = hashlib.sha256()
+    h.update(("%s\0%s\0%o\0" % (stripid, extraflags, os.stat(file).st_mode)).encode("utf-8"))
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    return os.path.join(cachedir, digest[:2], digest)
+
+def _replace_from_cache(cachefile, dest):
+    # Atomically replace dest with a copy of cachefile, keeping its mode.
+    # The packaged file is not hardlinked to the cache as later packaging
+    # steps (e.g. fixup_perms) change file attributes in place.
+    import shutil
+
+    tmp = "%s.strip-cache.%d" % (dest, os.getpid())
+    shutil.copyfile(cachefile, tmp)
+    shutil.copymode(dest, tmp)
+    os.rename(tmp, dest)
+
+def runstrip_batch(arg):
+    # Strip a list of (file, elftype) tuples which all need the same strip
+    # arguments with a single strip invocation, called from runstrip_files
+    # below. If cachedir is set, files already stripped in an identical form
+    # before are copied from the cache instead of being stripped again.
+
+    import stat, subprocess, shutil
+
+    (files, extraflags, strip, stripid, cachedir) = arg
+
+    todo = []
+    for (file, elftype) in files:
+        cachefile = None
+        if cachedir:
+            cachefile = _strip_cache_path(file, extraflags, stripid, cachedir)
+            # Files with other hardlinks need to be stripped in place so that
+            # all of the links see the result
+            if os.path.exists(cachefile) and os.stat(file).st_nlink == 1:
+                bb.debug(1, "runstrip: using cached %s for %s" % (cachefile, file))
+                try:
+                    _replace_from_cache(cachefile, file)
+                    continue
+                except OSError as e:
+                    bb.debug(1, "runstrip: unable to use %s: %s" % (cachefile, e))
+        todo.append((file, elftype, cachefile))
+
+    if not todo:
+        return
+
+    modes = {}
+    for (file, _, _) in todo:
+        if not os.access(file, os.W_OK) or os.access(file, os.R_OK):
+            origmode = os.stat(file)[stat.ST_MODE]
+            modes[file] = origmode
+            os.chmod(file, origmode | stat.S_IWRITE | stat.S_IREAD)
+
+    stripcmd = [strip] + extraflags.split() + [file for (file, _, _) in todo]
+    bb.debug(1, "runstrip: %s" % " ".join(stripcmd))
+
+    try:
+        subprocess.check_output(stripcmd, stderr=subprocess.STDOUT)
+        failed = False
+    except subprocess.CalledProcessError:
+        failed = True
+
+    for file in modes:
+        os.chmod(file, modes[file])
+
+    if failed:
+        # Redo the files one by one so that the errors can be attributed
+        # to the files which caused them, and don't cache anything
+        for (file, elftype, _) in todo:
+            runstrip((file, elftype, strip))
+        return
+
+    for (file, _, cachefile) in todo:
+        if not cachefile:
+            continue
+        # Store a private copy, so that later changes to the packaged file
+        # can't affect the cache
+        tmp = "%s.%d" % (cachefile, os.getpid())
+        try:
+            bb.utils.mkdirhier(os.path.dirname(cachefile))
+            shutil.copy2(file, tmp)
+            os.rename(tmp, cachefile)
+        except OSError as e:
+            bb.debug(1, "runstrip: unable to cache %s: %s" % (file, e))
+
+def runstrip_files(sfiles, cachedir=None, batchsize=100):
+    # Strip a list of (file, elftype, strip) tuples as runstrip() would, but
+    # with many files per strip invocation. Files are grouped by the strip
+    # arguments they need and the groups are split into batches of at most
+    # batchsize files which are processed in parallel. Kernel modules keep
+    # their timestamps when stripped so they are never taken from the cache,
+    # nor are files for a strip command which can't be found on PATH.
+    import multiprocessing
+    import oe.utils
+
+    groups = {}
+    for (file, elftype, strip) in sfiles:
+        key = (strip, strip_flags(file, elftype), bool(elftype & 16))
+        groups.setdefault(key, []).append((file, elftype))
+
+    stripids = {}
+    if cachedir:
+        for (strip, _, _) in groups:
+            if strip not in stripids:
+                stripids[strip] = _strip_identity(strip)
+
+    nproc = multiprocessing.cpu_count()
+    batches = []
+    for (strip, extraflags, kernmod), files in groups.items():
+        stripid = stripids.get(strip)
+        # Make sure there are enough batches to keep all CPUs busy
+        size = max(1, min(batchsize, -(-len(files) // nproc)))
+        for i in range(0, len(files), size):
+            batches.append((files[i:i + size], extraflags, strip, stripid,
+                            None if kernmod or not stripid else cachedir))
+
+    oe.utils.multiprocess_exec(batches, runstrip_batch)
+
+_file_translate_map = {
+    "@" : "@at@",
+    " " : "@space@",
+    "\t" : "@tab@",
+    "[" : "@openbrace@",
+    "]" : "@closebrace@",
+    "_" : "@underscore@",
+}
+_file_translate_re = re.compile("[@ \t\\[\\]_]")
 
 def file_translate(file):
-    ft = file.replace("@", "@at@")
-    ft = ft.replace(" ", "@space@")
-    ft = ft.replace("\t", "@tab@")
-    ft = ft.replace("[", "@openbrace@")
-    ft = ft.replace("]", "@closebrace@")
-    ft = ft.replace("_", "@underscore@")
-    return ft
+    return _file_translate_re.sub(lambda m: _file_translate_map[m.group(0)], file)
 
-def filedeprunner(arg):
-    import re, subprocess, shlex
+_filedep_version_re = re.compile(r'[<>=]+ +[^ ]*')
+
+def _filedeps_parse(pipe):
+    # Parse rpmdeps output into a dict mapping each file to a
+    # (provides, requires) tuple of lists
+    deps = {}
+    for line in pipe:
+        f, _, line = line.decode("utf-8").partition(" ")
+        line = line.strip()
+
+        if line.startswith("Requires:"):
+            idx = 1
+        elif line.startswith("Provides:"):
+            idx = 0
+        else:
+            continue
+
+        value = line.split(":", 1)[1].strip()
+        value = _filedep_version_re.sub(r'(\g<0>)', value)
+
+        if value.startswith("rpmlib("):
+            continue
+        if value == "python":
+            continue
+        if f not in deps:
+            deps[f] = ([], [])
+        deps[f][idx].append(value)
+    return deps
+
+def _run_rpmdeps(rpmdeps, files):
+    import subprocess, shlex
+
+    cmd = shlex.split(rpmdeps) + files
+    try:
+        dep_popen = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        deps = _filedeps_parse(dep_popen.stdout)
+        dep_popen.wait()
+    except OSError as e:
+        bb.error("rpmdeps: '%s' command failed, '%s'" % (cmd, e))
+        raise e
+    return deps
 
+def filedeprunner(arg):
     (pkg, pkgfiles, rpmdeps, pkgdest) = arg
     provides = {}
     requires = {}
 
-    r = re.compile(r'[<>=]+ +[^ ]*')
+    deps = _run_rpmdeps(rpmdeps, pkgfiles)
+    for f in deps:
+        file = file_translate(f.replace(pkgdest + "/" + pkg, ""))
+        if deps[f][0]:
+            provides[file] = deps[f][0]
+        if deps[f][1]:
+            requires[file] = deps[f][1]
+
+    return (pkg, provides, requires)
 
-    def process_deps(pipe, pkg, pkgdest, provides, requires):
-        for line in pipe:
-            f = line.decode("utf-8").split(" ", 1)[0].strip()
-            line = line.decode("utf-8").split(" ", 1)[1].strip()
+def _filedeps_cache_path(path, relpath, rpmdeps, cachedir):
+    # The cache key covers the path within the package (some dependency
+    # generators depend on it), the mode and contents of the file (or the
+    # target of a symlink) and the rpmdeps command line
+    import hashlib
 
-            if line.startswith("Requires:"):
-                i = requires
-            elif line.startswith("Provides:"):
-                i = provides
-            else:
-                continue
+    h = hashlib.sha256()
+    st = os.lstat(path)
+    h.update(("%s\0%s\0%o\0" % (rpmdeps, relpath, st.st_mode)).encode("utf-8"))
+    if os.path.islink(path):
+        h.update(os.readlink(path).encode("utf-8"))
+    elif os.path.isfile(path):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+    digest = h.hexdigest()
+    return os.path.join(cachedir, digest[:2], digest)
 
-            file = f.replace(pkgdest + "/" + pkg, "")
-            file = file_translate(file)
-            value = line.split(":", 1)[1].strip()
-            value = r.sub(r'(\g<0>)', value)
+def filedeps_batch(arg):
+    # Collect the dependencies of a list of (pkg, file) tuples, which may
+    # belong to different packages, with a single rpmdeps invocation.
+    # Results found in cachedir (if set) are used instead of scanning the
+    # corresponding files. Returns a list of (pkg, relpath, provides,
+    # requires) tuples in the order of the input files.
+    import json
 
-            if value.startswith("rpmlib("):
-                continue
-            if value == "python":
+    (files, rpmdeps, rpmdepsid, pkgdest, cachedir) = arg
+
+    cached = {}
+    cachefiles = {}
+    scan = []
+    for (pkg, path) in files:
+        relpath = path.replace(pkgdest + "/" + pkg, "")
+        if cachedir:
+            cachefile = _filedeps_cache_path(path, relpath, rpmdepsid, cachedir)
+            try:
+                with open(cachefile, "r") as f:
+                    cached[path] = tuple(json.load(f))
                 continue
-            if file not in i:
-                i[file] = []
-            i[file].append(value)
+            except (OSError, ValueError):
+                cachefiles[path] = cachefile
+        scan.append(path)
 
-        return provides, requires
+    deps = {}
+    if scan:
+        deps = _run_rpmdeps(rpmdeps, scan)
+
+    for path, cachefile in cachefiles.items():
+        tmp = "%s.%d" % (cachefile, os.getpid())
+        try:
+            bb.utils.mkdirhier(os.path.dirname(cachefile))
+            with open(tmp, "w") as f:
+                json.dump(deps.get(path, ([], [])), f)
+            os.rename(tmp, cachefile)
+        except OSError as e:
+            bb.debug(1, "rpmdeps: unable to cache results for %s: %s" % (path, e))
+
+    results = []
+    for (pkg, path) in files:
+        provides, requires = cached.get(path) or deps.get(path, ([], []))
+        if provides or requires:
+            results.append((pkg, file_translate(path.replace(pkgdest + "/" + pkg, "")), provides, requires))
+    return results
+
+def filedeps(pkgfiles, rpmdeps, pkgdest, cachedir=None, batchsize=500):
+    # Collect the per file dependencies of all of the (pkg, file) tuples in
+    # pkgfiles. The files of all packages are processed together in
+    # batches of at most batchsize files, one rpmdeps invocation per batch,
+    # in parallel. Returns a list of (pkg, provides, requires) tuples where
+    # provides and requires map translated file names to dependency lists,
+    # as filedeprunner() does.
+    import multiprocessing
+    import shlex
+    import oe.utils
+
+    rpmdepsid = rpmdeps
+    if cachedir:
+        # Include the identity of the rpmdeps binary in the cache key so
+        # that a new rpmdeps version doesn't use stale results
+        rpmdepscmd = shlex.split(rpmdeps)[0]
+        try:
+            st = os.stat(rpmdepscmd)
+            rpmdepsid = "%s %d %d" % (rpmdeps, st.st_size, st.st_mtime_ns)
+        except OSError:
+            cachedir = None
+
+    nproc = multiprocessing.cpu_count()
+    size = max(1, min(batchsize, -(-len(pkgfiles) // nproc)))
+    batches = []
+    for i in range(0, len(pkgfiles), size):
+        batches.append((pkgfiles[i:i + size], rpmdeps, rpmdepsid, pkgdest, cachedir))
+
+    results = []
+    pkgresults = {}
+    for batch in oe.utils.multiprocess_exec(batches, filedeps_batch):
+        for (pkg, file, provides, requires) in batch:
+            if pkg not in pkgresults:
+                pkgresults[pkg] = ({}, {})
+                results.append((pkg, pkgresults[pkg][0], pkgresults[pkg][1]))
+            if provides:
+                pkgresults[pkg][0][file] = provides
+            if requires:
+                pkgresults[pkg][1][file] = requires
+    return results
+
+
+SHLIB_CACHE_VERSION = 1
+
+def _shlib_cache_path(dir):
+    # The cache lives in a subdirectory so that rewriting it doesn't change
+    # the modification time of the shlibs directory itself
+    return os.path.join(dir, ".cache", "shlib_providers")
+
+def _read_shlib_list(fn):
+    entries = []
+    with open(fn) as fd:
+        for l in fd:
+            s = l.strip().split(":")
+            entries.append((s[0], s[1], s[2]))
+    return entries
+
+def read_shlib_dir(dir):
+    """
+    Return a dictionary mapping package names to the (soname, libdir,
+    pkgver) entries of the <pkg>.list files in the shlibs directory dir.
+
+    The result is kept in a versioned cache file inside dir, stamped with
+    a generation number that increases on every rewrite. The cache is used
+    as is while the directory's modification time is unchanged; otherwise
+    only the .list files whose stamp changed are read again.
+    """
+    import pickle
+    import time
 
     try:
-        dep_popen = subprocess.Popen(shlex.split(rpmdeps) + pkgfiles, stdout=subprocess.PIPE)
-        provides, requires = process_deps(dep_popen.stdout, pkg, pkgdest, provides, requires)
-    except OSError as e:
-        bb.error("rpmdeps: '%s' command failed, '%s'" % (shlex.split(rpmdeps) + pkgfiles, e))
-        raise e
+        dirmtime = os.stat(dir).st_mtime_ns
+    except OSError:
+        return {}
 
-    return (pkg, provides, requires)
+    cachefile = _shlib_cache_path(dir)
+    try:
+        with open(cachefile, "rb") as f:
+            cache = pickle.load(f)
+        if cache.get("version") != SHLIB_CACHE_VERSION:
+            cache = None
+    except Exception:
+        cache = None
+    if cache is None:
+        cache = {"version": SHLIB_CACHE_VERSION, "generation": 0, "dirstamp": None, "lists": {}}
 
+    if cache["dirstamp"] == dirmtime:
+        return dict((fn[:-5], entries) for fn, (stamp, entries) in cache["lists"].items())
 
-def read_shlib_providers(d):
-    import re
+    changed = False
+    lists = {}
+    for file in os.listdir(dir):
+        if not file.endswith(".list"):
+            continue
+        try:
+            st = os.stat(os.path.join(dir, file))
+            stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+            old = cache["lists"].get(file)
+            if old and old[0] == stamp:
+                lists[file] = old
+                continue
+            lists[file] = (stamp, _read_shlib_list(os.path.join(dir, file)))
+            changed = True
+        except (IOError, OSError):
+            # During a build unrelated shlib files may be deleted, so
+            # handle files disappearing between the listdirs and open.
+            continue
+    if len(lists) != len(cache["lists"]):
+        changed = True
+
+    # Timestamps only have the granularity of a clock tick so a very recent
+    # mtime can't be trusted to change again on the next update
+    dirstamp = dirmtime if time.time() * 1e9 - dirmtime > 2e9 else None
+    if changed or dirstamp != cache["dirstamp"]:
+        cache["generation"] += 1
+        cache["dirstamp"] = dirstamp
+        cache["lists"] = lists
+        tmp = "%s.%d" % (cachefile, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+            with open(tmp, "wb") as f:
+                pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, cachefile)
+        except OSError as e:
+            bb.debug(2, "Unable to write shlib provider cache %s: %s" % (cachefile, e))
+
+    return dict((fn[:-5], entries) for fn, (stamp, entries) in lists.items())
 
+def read_shlib_providers(d):
     shlib_provider = {}
     shlibs_dirs = d.getVar('SHLIBSDIRS', True).split()
-    list_re = re.compile('^(.*)\.list$')
     # Go from least to most specific since the last one found wins
     for dir in reversed(shlibs_dirs):
         bb.debug(2, "Reading shlib providers in %s" % (dir))
         if not os.path.exists(dir):
             continue
-        for file in os.listdir(dir):
-            m = list_re.match(file)
-            if m:
-                dep_pkg = m.group(1)
-                try:
-                    fd = open(os.path.join(dir, file))
-                except IOError:
-                    # During a build unrelated shlib files may be deleted, so
-                    # handle files disappearing between the listdirs and open.
-                    continue
-                lines = fd.readlines()
-                fd.close()
-                for l in lines:
-                    s = l.strip().split(":")
-                    if s[0] not in shlib_provider:
-                        shlib_provider[s[0]] = {}
-                    shlib_provider[s[0]][s[1]] = (dep_pkg, s[2])
+        lists = read_shlib_dir(dir)
+        for dep_pkg in sorted(lists):
+            for (soname, libdir, pkgver) in lists[dep_pkg]:
+                if soname not in shlib_provider:
+                    shlib_provider[soname] = {}
+                shlib_provider[soname][libdir] = (dep_pkg, pkgver)
     return shlib_provider
 
 
+def pkgfiles_path(pkgdest, pkg):
+    return os.path.join(pkgdest, pkg + ".files")
+
+def write_pkgfiles(pkgdest, pkgfiles):
+    """
+    Save the files of each package (a dict mapping package names to lists
+    of paths under pkgdest/pkg) next to the package directories, so that
+    later tasks can read them instead of walking PKGDEST again.
+    """
+    import json
+    for pkg, files in pkgfiles.items():
+        pkgroot = os.path.join(pkgdest, pkg)
+        relfiles = [os.path.relpath(f, pkgroot) for f in files]
+        with open(pkgfiles_path(pkgdest, pkg), "w") as f:
+            json.dump(relfiles, f)
+
+def read_pkgfiles(pkgdest, pkg):
+    """
+    Return the list of files of pkg saved by write_pkgfiles(), as paths
+    under pkgdest/pkg, or None if it wasn't saved.
+    """
+    import json
+    try:
+        with open(pkgfiles_path(pkgdest, pkg)) as f:
+            relfiles = json.load(f)
+    except (OSError, ValueError):
+        return None
+    pkgroot = pkgdest + "/" + pkg
+    return [pkgroot + os.sep + f for f in relfiles]
+
+
+class FilesMatcher(object):
+    """
+    Expansion of FILES patterns (relative paths such as "./usr/lib/*.so.*")
+    below root, giving the same results as glob.glob(), os.path.islink(),
+    os.path.isdir() and os.listdir() would. Each directory is read once,
+    with os.scandir() where available, the first time a pattern needs it,
+    so matching the patterns of all the packages of a recipe only lists the
+    tree once. Wildcards are matched with compiled fnmatch expressions.
+    Paths through symbolic links are left to the filesystem.
+    """
+
+    _magic = re.compile("[*?[]")
+
+    # Returned by _type() for paths only the filesystem can answer for
+    _UNKNOWN = -1
+
+    def __init__(self, root="."):
+        self.root = os.path.abspath(root)
+        self.dirs = {}
+        self.types = {}
+        self.parents = {}
+        self.patterns = {}
+
+    def _entries(self, key):
+        # The file types of the entries of the real directory key, by name
+        if key not in self.dirs:
+            entries = collections.OrderedDict()
+            dirpath = os.path.join(self.root, key)
+            try:
+                if hasattr(os, "scandir"):
+                    for entry in os.scandir(dirpath):
+                        if entry.is_symlink():
+                            entries[entry.name] = stat.S_IFLNK
+                        elif entry.is_dir(follow_symlinks=False):
+                            entries[entry.name] = stat.S_IFDIR
+                        else:
+                            entries[entry.name] = stat.S_IFREG
+                else:
+                    # Python < 3.5
+                    for name in os.listdir(dirpath):
+                        mode = os.lstat(os.path.join(dirpath, name)).st_mode
+                        if stat.S_ISLNK(mode) or stat.S_ISDIR(mode):
+                            entries[name] = stat.S_IFMT(mode)
+                        else:
+                            entries[name] = stat.S_IFREG
+            except OSError:
+                entries = None
+            self.dirs[key] = entries
+        return self.dirs[key]
+
+    def _type(self, path):
+        # The file type of path, without following a final symbolic link,
+        # None if it doesn't exist or _UNKNOWN
+        try:
+            return self.types[path]
+        except KeyError:
+            ftype = self.types[path] = self._lookup(path)
+            return ftype
+
+    def _lookup(self, path):
+        if os.path.isabs(path) or ".." in path.split("/"):
+            return self._UNKNOWN
+        key = os.path.normpath(path)
+        if key == ".":
+            return stat.S_IFDIR
+        parts = key.split("/")
+        for i, name in enumerate(parts):
+            entries = self._entries("/".join(parts[:i]) or ".")
+            if entries is None:
+                return self._UNKNOWN
+            ftype = entries.get(name)
+            if ftype is None or i == len(parts) - 1:
+                return ftype
+            if ftype == stat.S_IFLNK:
+                return self._UNKNOWN
+            if ftype != stat.S_IFDIR:
+                return None
+
+    def lexists(self, path):
+        ftype = self._type(path)
+        if ftype == self._UNKNOWN:
+            return os.path.lexists(os.path.join(self.root, path))
+        return ftype is not None
+
+    def islink(self, path):
+        ftype = self._type(path)
+        if ftype == self._UNKNOWN:
+            return os.path.islink(os.path.join(self.root, path))
+        return ftype == stat.S_IFLNK
+
+    def isdir(self, path):
+        ftype = self._type(path)
+        if ftype in (self._UNKNOWN, stat.S_IFLNK):
+            return os.path.isdir(os.path.join(self.root, path))
+        return ftype == stat.S_IFDIR
+
+    def listdir(self, path):
+        if self._type(path) == stat.S_IFDIR:
+            key = os.path.normpath(path)
+            entries = self._entries(key)
+            if entries is not None:
+                return list(entries)
+        return os.listdir(os.path.join(self.root, path))
+
+    def symlink_parent(self, path):
+        """
+        Return the first of the parent directories of path which is a
+        symbolic link, joined with os.path.join() from the components of
+        path, or None.
+        """
+        dirname = path.rpartition("/")[0]
+        if dirname not in self.parents:
+            self.parents[dirname] = None
+            parent = ""
+            for name in path.split("/")[:-1]:
+                parent = os.path.join(parent, name)
+                if name != "." and self.islink(parent):
+                    self.parents[dirname] = parent
+                    break
+        return self.parents[dirname]
+
+    def _match(self, pattern):
+        if pattern not in self.patterns:
+            self.patterns[pattern] = re.compile(fnmatch.translate(pattern)).match
+        return self.patterns[pattern]
+
+    def _glob1(self, dirname, pattern):
+        try:
+            names = self.listdir(dirname or os.curdir)
+        except OSError:
+            return []
+        match = self._match(pattern)
+        hidden = pattern.startswith(".")
+        return [name for name in names if (hidden or not name.startswith(".")) and match(name)]
+
+    def _glob0(self, dirname, basename):
+        if not basename:
+            if self.isdir(dirname):
+                return [basename]
+        elif self.lexists(os.path.join(dirname, basename)):
+            return [basename]
+        return []
+
+    def _iglob(self, pathname):
+        dirname, basename = os.path.split(pathname)
+        if not self._magic.search(pathname):
+            if basename:
+                if self.lexists(pathname):
+                    yield pathname
+            elif self.isdir(dirname):
+                yield pathname
+            return
+        if not dirname:
+            for name in self._glob1(dirname, basename):
+                yield name
+            return
+        if dirname != pathname and self._magic.search(dirname):
+            dirs = self._iglob(dirname)
+        else:
+            dirs = [dirname]
+        if self._magic.search(basename):
+            globber = self._glob1
+        else:
+            globber = self._glob0
+        for dirname in dirs:
+            for name in globber(dirname, basename):
+                yield os.path.join(dirname, name)
+
+    def glob(self, pathname):
+        """Return the paths matching pathname, in glob.glob() order"""
+        return list(self._iglob(pathname))
+
+
 def npm_split_package_dirs(pkgdir):
     """
     Work out the packages fetched and unpacked by BitBake's npm fetcher
@@ -1,5 +1,6 @@
 from abc import ABCMeta, abstractmethod
 import os
+import io
 import glob
 import subprocess
 import shutil
@@ -29,66 +30,104 @@ def create_index(arg):
 
     return None
 
+_opkg_verregex = re.compile(r' \([=<>]* [^ )]*\)')
+
+def _opkg_query_record(pkg, arch, ver, filename, dep, pkgarch):
+    # IPK doesn't include the filename
+    if not filename:
+        filename = "%s_%s_%s.ipk" % (pkg, ver, arch)
+    return {"arch":arch, "ver":ver, "filename":filename, "deps":dep,
+            "pkgarch":pkgarch}
+
 """
-This method parse the output from the package managerand return
-a dictionary with the information of the packages. This is used
-when the packages are in deb or ipk format.
+Generator version of opkg_query(). It consumes the package manager output
+line by line (a string, a list of lines or an open file/pipe) and yields a
+(package name, package info) tuple as soon as each stanza is complete, so
+the whole output never needs to be held in memory at once.
 """
-def opkg_query(cmd_output):
-    verregex = re.compile(' \([=<>]* [^ )]*\)')
-    output = dict()
+def opkg_query_iter(lines):
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+
     pkg = ""
     arch = ""
     ver = ""
     filename = ""
     dep = []
     pkgarch = ""
-    for line in cmd_output.splitlines():
+    for line in lines:
         line = line.rstrip()
-        if ':' in line:
-            if line.startswith("Package: "):
-                pkg = line.split(": ")[1]
-            elif line.startswith("Architecture: "):
-                arch = line.split(": ")[1]
-            elif line.startswith("Version: "):
-                ver = line.split(": ")[1]
-            elif line.startswith("File: ") or line.startswith("Filename:"):
-                filename = line.split(": ")[1]
-                if "/" in filename:
-                    filename = os.path.basename(filename)
-            elif line.startswith("Depends: "):
-                depends = verregex.sub('', line.split(": ")[1])
-                for depend in depends.split(", "):
-                    dep.append(depend)
-            elif line.startswith("Recommends: "):
-                recommends = verregex.sub('', line.split(": ")[1])
-                for recommend in recommends.split(", "):
-                    dep.append("%s [REC]" % recommend)
-            elif line.startswith("PackageArch: "):
-                pkgarch = line.split(": ")[1]
-
-        # When there is a blank line save the package information
-        elif not line:
-            # IPK doesn't include the filename
-            if not filename:
-                filename = "%s_%s_%s.ipk" % (pkg, ver, arch)
+        if not line:
+            # When there is a blank line yield the package information
             if pkg:
-                output[pkg] = {"arch":arch, "ver":ver,
-                        "filename":filename, "deps": dep, "pkgarch":pkgarch }
+                yield pkg, _opkg_query_record(pkg, arch, ver, filename, dep, pkgarch)
             pkg = ""
             arch = ""
             ver = ""
             filename = ""
             dep = []
             pkgarch = ""
+            continue
+
+        key, sep, value = line.partition(": ")
+        if not sep:
+            # Continuation lines, "Key:" lines without a value and
+            # anything else we don't know about are ignored
+            continue
+        if key == "Package":
+            pkg = value
+        elif key == "Architecture":
+            arch = value
+        elif key == "Version":
+            ver = value
+        elif key == "File" or key == "Filename":
+            filename = os.path.basename(value)
+        elif key == "Depends":
+            dep.extend(_opkg_verregex.sub('', value).split(", "))
+        elif key == "Recommends":
+            dep.extend("%s [REC]" % recommend for recommend in
+                       _opkg_verregex.sub('', value).split(", "))
+        elif key == "PackageArch":
+            pkgarch = value
 
     if pkg:
-        if not filename:
-            filename = "%s_%s_%s.ipk" % (pkg, ver, arch)
-        output[pkg] = {"arch":arch, "ver":ver,
-                "filename":filename, "deps": dep }
+        yield pkg, _opkg_query_record(pkg, arch, ver, filename, dep, pkgarch)
+
+"""
+This method parse the output from the package managerand return
+a dictionary with the information of the packages. This is used
+when the packages are in deb or ipk format.
+"""
+def opkg_query(cmd_output):
+    return dict(opkg_query_iter(cmd_output))
+
+_opkg_query_cache = {}
+
+"""
+Memoized variant of opkg_query() for the installed packages of a rootfs.
+The dictionary returned by query_func() (normally built with opkg_query())
+is reused for as long as the package manager status file keeps the same
+inode, size and modification time. A copy is returned so callers can
+modify the result.
+"""
+def opkg_query_cached(status_file, query_func):
+    try:
+        st = os.stat(status_file)
+        key = (st.st_ino, st.st_size, st.st_mtime_ns)
+    except OSError:
+        key = None
+
+    cached = _opkg_query_cache.get(status_file)
+    if key is None or cached is None or cached[0] != key:
+        result = query_func()
+        if key is None:
+            _opkg_query_cache.pop(status_file, None)
+            return result
+        cached = (key, result)
+        _opkg_query_cache[status_file] = cached
 
-    return output
+    return dict((pkg, dict(info, deps=list(info["deps"])))
+                for pkg, info in cached[1].items())
 
 
 class Indexer(object, metaclass=ABCMeta):
@@ -468,7 +507,7 @@ class OpkgPkgsList(PkgsList):
         self.opkg_args = "-f %s -o %s " % (config_file, rootfs_dir)
         self.opkg_args += self.d.getVar("OPKG_ARGS", True)
 
-    def list_pkgs(self, format=None):
+    def _query_status(self):
         cmd = "%s %s status" % (self.opkg_cmd, self.opkg_args)
 
         # opkg returns success even when it printed some
@@ -476,20 +515,33 @@ class OpkgPkgsList(PkgsList):
         # stdout then leads to random failures later on when
         # parsing the output. To avoid this we need to collect both
         # output streams separately and check for empty stderr.
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-        cmd_output, cmd_stderr = p.communicate()
-        cmd_output = cmd_output.decode("utf-8")
-        cmd_stderr = cmd_stderr.decode("utf-8")
+        # stdout is parsed as it is produced, stderr goes to a temporary
+        # file so that a chatty opkg can't block on a full pipe. The
+        # status is UTF-8 whatever the locale of the build host is.
+        with tempfile.TemporaryFile() as stderr_file:
+            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file,
+                                 shell=True)
+            with io.TextIOWrapper(p.stdout, encoding="utf-8") as stdout:
+                output = opkg_query(stdout)
+            p.wait()
+            stderr_file.seek(0)
+            cmd_stderr = stderr_file.read().decode("utf-8")
         if p.returncode or cmd_stderr:
             bb.fatal("Cannot get the installed packages list. Command '%s' "
                      "returned %d and stderr:\n%s" % (cmd, p.returncode, cmd_stderr))
 
-        return opkg_query(cmd_output)
+        return output
+
+    def list_pkgs(self, format=None):
+        status_file = os.path.join(self.rootfs_dir,
+                                   self.d.getVar('OPKGLIBDIR', True).strip('/'),
+                                   'opkg', 'status')
+        return opkg_query_cached(status_file, self._query_status)
 
 
 class DpkgPkgsList(PkgsList):
 
-    def list_pkgs(self):
+    def _query_status(self):
         cmd = [bb.utils.which(os.getenv('PATH'), "dpkg-query"),
                "--admindir=%s/var/lib/dpkg" % self.rootfs_dir,
                "-W"]
@@ -504,6 +556,10 @@ class DpkgPkgsList(PkgsList):
 
         return opkg_query(cmd_output)
 
+    def list_pkgs(self):
+        status_file = os.path.join(self.rootfs_dir, "var/lib/dpkg/status")
+        return opkg_query_cached(status_file, self._query_status)
+
 
 class PackageManager(object, metaclass=ABCMeta):
     """
@@ -1,37 +1,183 @@
 import codecs
+import logging
 import os
 
+logger = logging.getLogger('BitBake.OE.PackageData')
+
 def packaged(pkg, d):
     return os.access(get_subpkgedata_fn(pkg, d) + '.packaged', os.R_OK)
 
-def read_pkgdatafile(fn):
+# Runtime pkgdata files are written either in the text format, one
+# "VAR: value" line per variable with the values escaped with unicode_escape,
+# or in a binary format (see write_pkgdatafile()) starting with
+# BINARY_MAGIC. The readers here accept both.
+BINARY_MAGIC = b"OEPKGDATA"
+BINARY_VERSION = 1
+
+_line_re = None
+
+def _is_files_info(key):
+    return key == 'FILES_INFO' or key.startswith('FILES_INFO_')
+
+def _escape(value):
+    return codecs.getencoder("unicode_escape")(value)[0].decode("latin1")
+
+def _unescape(value):
+    return codecs.getdecoder("unicode_escape")(value)[0]
+
+def _read_text(data, escaped, structured):
+    import collections
+    import json
+    import re
+
+    global _line_re
+    if _line_re is None:
+        _line_re = re.compile(r"^([^:\n]+):[ \t\r\f\v]*(.*)", re.M)
     pkgdata = {}
+    for m in _line_re.finditer(data):
+        key, value = m.group(1), m.group(2)
+        if structured and _is_files_info(key):
+            pkgdata[key] = json.loads(_unescape(value), object_pairs_hook=collections.OrderedDict)
+        elif escaped:
+            pkgdata[key] = value
+        else:
+            pkgdata[key] = _unescape(value)
+    return pkgdata
+
+def _read_binary(data, escaped, structured):
+    import collections
+    import json
+    import struct
 
-    def decode(str):
-        c = codecs.getdecoder("unicode_escape")
-        return c(str)[0]
-
-    if os.access(fn, os.R_OK):
-        import re
-        f = open(fn, 'r')
-        lines = f.readlines()
-        f.close()
-        r = re.compile("([^:]+):\s*(.*)")
-        for l in lines:
-            m = r.match(l)
-            if m:
-                pkgdata[m.group(1)] = decode(m.group(2))
+    def string(pos, fmt):
+        size = struct.unpack_from(fmt, data, pos)[0]
+        pos += struct.calcsize(fmt)
+        return data[pos:pos + size].decode("utf-8", "surrogateescape"), pos + size
 
+    if data[len(BINARY_MAGIC)] != BINARY_VERSION:
+        raise ValueError("Unsupported pkgdata format version %d" % data[len(BINARY_MAGIC)])
+    pkgdata = {}
+    pos = len(BINARY_MAGIC) + 1
+    count = struct.unpack_from("<I", data, pos)[0]
+    pos += 4
+    for i in range(count):
+        kind = data[pos:pos + 1]
+        key, pos = string(pos + 1, "<H")
+        if kind == b"s":
+            value, pos = string(pos, "<I")
+            if escaped:
+                value = _escape(value)
+        elif kind == b"i":
+            value = str(struct.unpack_from("<q", data, pos)[0])
+            pos += 8
+        elif kind == b"f":
+            # Table of files: the paths, NUL separated, then their sizes
+            nfiles = struct.unpack_from("<I", data, pos)[0]
+            paths, pos = string(pos + 4, "<I")
+            sizes = struct.unpack_from("<%dq" % nfiles, data, pos)
+            pos += 8 * nfiles
+            value = collections.OrderedDict(zip(paths.split("\0") if nfiles else [], sizes))
+            if not structured:
+                value = json.dumps(value)
+                if escaped:
+                    value = _escape(value)
+        else:
+            raise ValueError("Unknown pkgdata field type %r" % kind)
+        pkgdata[key] = value
     return pkgdata
 
+def _read(fn, escaped, structured):
+    try:
+        with open(fn, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return {}
+    if data.startswith(BINARY_MAGIC):
+        return _read_binary(data, escaped, structured)
+    return _read_text(data.decode("utf-8", "surrogateescape"), escaped, structured)
+
+def read_pkgdatafile(fn, escaped=False):
+    """
+    Return the variables in the pkgdata file fn as a dictionary of strings,
+    or an empty dictionary if it can't be read. If escaped is True the
+    values are returned as the text format stores them (escaped with
+    unicode_escape), whatever the format of the file.
+    """
+    return _read(fn, escaped, False)
+
+def read_runtime_pkgdata(fn, escaped=False):
+    """
+    Like read_pkgdatafile() but with FILES_INFO returned as an ordered
+    dictionary mapping each path to its size, which binary files store
+    without going through JSON.
+    """
+    return _read(fn, escaped, True)
+
+def write_pkgdatafile(fn, fields, binary=False):
+    """
+    Write the (key, value) pairs in fields to the pkgdata file fn, in the
+    binary format if binary is True. Values are strings, integers or, for
+    FILES_INFO, dictionaries mapping paths to sizes. Empty string values
+    are not written. The file is replaced atomically.
+
+    The binary format is BINARY_MAGIC, a version byte and the number of
+    fields, then for each field its type ("s" string, "i" integer or "f"
+    files), its key and value. Integers are stored as 64 bit numbers and
+    a files table as the number of files, the NUL separated paths and an
+    array of sizes, all little endian.
+    """
+    import json
+    import struct
+
+    def string(value, fmt):
+        value = value.encode("utf-8", "surrogateescape")
+        return struct.pack(fmt, len(value)) + value
+
+    if binary:
+        chunks = [BINARY_MAGIC, bytes([BINARY_VERSION]), b""]
+        count = 0
+        for key, value in fields:
+            if isinstance(value, dict):
+                chunks.append(b"f" + string(key, "<H") + struct.pack("<I", len(value)) +
+                              string("\0".join(value.keys()), "<I") +
+                              struct.pack("<%dq" % len(value), *value.values()))
+            elif isinstance(value, int):
+                chunks.append(b"i" + string(key, "<H") + struct.pack("<q", value))
+            elif value:
+                chunks.append(b"s" + string(key, "<H") + string(value, "<I"))
+            else:
+                continue
+            count += 1
+        chunks[2] = struct.pack("<I", count)
+        data = b"".join(chunks)
+    else:
+        lines = []
+        for key, value in fields:
+            if isinstance(value, dict):
+                value = json.dumps(value)
+            elif isinstance(value, int):
+                value = str(value)
+            if value:
+                lines.append("%s: %s\n" % (key, _escape(value)))
+        data = "".join(lines).encode("utf-8")
+
+    tmpfn = "%s.tmp.%d" % (fn, os.getpid())
+    with open(tmpfn, 'wb') as f:
+        f.write(data)
+    os.rename(tmpfn, fn)
+
 def get_subpkgedata_fn(pkg, d):
     return d.expand('${PKGDATA_DIR}/runtime/%s' % pkg)
 
 def has_subpkgdata(pkg, d):
     return os.access(get_subpkgedata_fn(pkg, d), os.R_OK)
 
-def read_subpkgdata(pkg, d):
-    return read_pkgdatafile(get_subpkgedata_fn(pkg, d))
+def read_subpkgdata(pkg, d, structured=False):
+    """
+    Return the runtime pkgdata of pkg, with FILES_INFO as a dictionary (as
+    read_runtime_pkgdata() returns it) if structured is True.
+    """
+    return pkgdata_index(d).read_runtime(pkg, structured)
 
 def has_pkgdata(pn, d):
     fn = d.expand('${PKGDATA_DIR}/%s' % pn)
@@ -46,7 +192,7 @@ def read_pkgdata(pn, d):
 #
 def read_subpkgdata_dict(pkg, d):
     ret = {}
-    subd = read_pkgdatafile(get_subpkgedata_fn(pkg, d))
+    subd = pkgdata_index(d).read_runtime(pkg)
     for var in subd:
         newvar = var.replace("_" + pkg, "")
         if newvar == var and var + "_" + pkg in subd:
@@ -54,29 +200,404 @@ def read_subpkgdata_dict(pkg, d):
         ret[newvar] = subd[var]
     return ret
 
-def _pkgmap(d):
-    """Return a dictionary mapping package to recipe name."""
-
-    pkgdatadir = d.getVar("PKGDATA_DIR", True)
+def _file_stamp(fn, digest=False):
+    """
+    Return a string identifying the current contents of fn, or None. It
+    includes a digest of the contents if digest is True or if the file was
+    modified too recently to be identified by its stat data alone.
+    """
+    import time
 
-    pkgmap = {}
     try:
-        files = os.listdir(pkgdatadir)
+        st = os.stat(fn)
     except OSError:
-        bb.warn("No files in %s?" % pkgdatadir)
-        files = []
+        return None
+    stamp = "%d:%d:%d" % (st.st_ino, st.st_mtime_ns, st.st_size)
+    # Timestamps only have the granularity of a clock tick, so the file
+    # could still be rewritten without its mtime changing
+    if digest or time.time() * 1e9 - st.st_mtime_ns < 2e9:
+        import hashlib
+        try:
+            with open(fn, 'rb') as f:
+                stamp += ":" + hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            return None
+    return stamp
+
+def _stamp_current(fn, stamp):
+    """Return whether fn is unchanged since _file_stamp() returned stamp"""
+    if stamp is None:
+        return not os.path.exists(fn)
+    return _file_stamp(fn, stamp.count(":") > 2) == stamp
+
+def _files_info(pkgdata):
+    """Return the FILES_INFO dictionary (path -> size) from runtime pkgdata"""
+    import json
+
+    for key in pkgdata:
+        if _is_files_info(key):
+            if isinstance(pkgdata[key], dict):
+                return pkgdata[key]
+            return json.loads(pkgdata[key])
+    return None
+
+def _glob_prefix(pattern):
+    """Return the part of a glob pattern before the first wildcard"""
+    import re
+    return re.split(r'[*?\[]', pattern, 1)[0]
+
+class PkgdataFiles(object):
+    """Queries answered by reading the files in a PKGDATA_DIR directly"""
+
+    def __init__(self, pkgdatadir):
+        self.pkgdatadir = pkgdatadir
 
-    for pn in [f for f in files if not os.path.isdir(os.path.join(pkgdatadir, f))]:
+    def pkgmap(self):
+        pkgmap = {}
         try:
-            pkgdata = read_pkgdatafile(os.path.join(pkgdatadir, pn))
+            files = os.listdir(self.pkgdatadir)
         except OSError:
-            continue
+            logger.warning("No files in %s?" % self.pkgdatadir)
+            files = []
+
+        for pn in [f for f in files if not os.path.isdir(os.path.join(self.pkgdatadir, f))]:
+            try:
+                pkgdata = read_pkgdatafile(os.path.join(self.pkgdatadir, pn))
+            except OSError:
+                continue
+
+            packages = pkgdata.get("PACKAGES") or ""
+            for pkg in packages.split():
+                pkgmap[pkg] = pn
+
+        return pkgmap
+
+    def recipename(self, pkg):
+        return self.pkgmap().get(pkg)
+
+    def read_runtime(self, pkg, structured=False):
+        return _read(os.path.join(self.pkgdatadir, 'runtime', pkg), False, structured)
+
+    def pkg_files(self, pkg):
+        """
+        Return a dictionary mapping the paths shipped by the (recipe-space)
+        package pkg to their size, or None if it has no FILES_INFO
+        """
+        return _files_info(self.read_runtime(pkg, True))
+
+    def find_path(self, pattern):
+        """
+        Return a sorted list of (package, path) tuples for all packaged paths
+        matching pattern (wildcards * ? and [] are allowed)
+        """
+        import fnmatch
+
+        found = []
+        runtimedir = os.path.join(self.pkgdatadir, 'runtime')
+        for root, dirs, files in os.walk(runtimedir):
+            for fn in files:
+                if fn.endswith('.packaged'):
+                    continue
+                pkgfiles = _files_info(read_runtime_pkgdata(os.path.join(root, fn)))
+                for path in pkgfiles or []:
+                    if fnmatch.fnmatchcase(path, pattern):
+                        found.append((fn, path))
+        return sorted(found)
+
+class PkgdataIndex(PkgdataFiles):
+    """
+    Persistent index of a PKGDATA_DIR, stored as an sqlite database in
+    PKGDATA_DIR/.index. It maps every package to the recipe that produced
+    it, every packaged path to its package, and caches the decoded contents
+    of the runtime/<pkg> files, so that lookups do not have to list and
+    parse the whole pkgdata directory.
 
-        packages = pkgdata.get("PACKAGES") or ""
-        for pkg in packages.split():
-            pkgmap[pkg] = pn
+    The index is only written by update(), called when do_packagedata
+    installs or removes a recipe's pkgdata, which also resynchronises
+    incrementally any other recipe or package whose pkgdata file changed.
+    Queries only read the database, and they use it only while the pkgdata
+    files it was built from are unchanged, as told by their stat data (and
+    contents, for files modified within a clock tick of being indexed) and
+    no recipe was added. Otherwise, or if the database cannot be used for
+    any reason, the pkgdata files are read directly instead.
+    """
 
-    return pkgmap
+    VERSION = "4"
+
+    def __init__(self, pkgdatadir):
+        super(PkgdataIndex, self).__init__(pkgdatadir)
+        self.path = os.path.join(pkgdatadir, '.index', 'pkgdata.db')
+        self._conn = None
+        self._writable = False
+
+    def _connect(self, write=False):
+        import sqlite3
+        import urllib.parse
+
+        if self._conn is not None and write and not self._writable:
+            self.close()
+        if self._conn is None and not write:
+            conn = sqlite3.connect("file:%s?mode=ro" % urllib.parse.quote(self.path),
+                                   uri=True, timeout=60)
+            try:
+                row = conn.execute("SELECT value FROM meta WHERE key='version'").fetchone()
+                if not row or row[0] != self.VERSION:
+                    raise sqlite3.DatabaseError("pkgdata index version mismatch")
+            except sqlite3.Error:
+                conn.close()
+                raise
+            self._conn = conn
+        elif self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            row = conn.execute("SELECT value FROM meta WHERE key='version'").fetchone()
+            if not row or row[0] != self.VERSION:
+                with conn:
+                    self._drop_tables(conn)
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.VERSION,))
+            self._create_tables(conn)
+            self._conn = conn
+            self._writable = True
+        return self._conn
+
+    def _drop_tables(self, conn):
+        conn.execute("DROP TABLE IF EXISTS recipes")
+        conn.execute("DROP TABLE IF EXISTS packages")
+        conn.execute("DROP TABLE IF EXISTS runtime")
+        conn.execute("DROP TABLE IF EXISTS files")
+        conn.execute("DELETE FROM meta")
+
+    def _create_tables(self, conn):
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS recipes (pn TEXT PRIMARY KEY, stamp TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS packages (pkg TEXT PRIMARY KEY, pn TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS packages_pn ON packages (pn)")
+            conn.execute("CREATE TABLE IF NOT EXISTS runtime (pkg TEXT PRIMARY KEY, stamp TEXT, data TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT, pkg TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS files_path ON files (path)")
+            conn.execute("CREATE INDEX IF NOT EXISTS files_pkg ON files (pkg)")
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _recipe_files(self):
+        # The names of the recipe pkgdata files in PKGDATA_DIR
+        try:
+            files = os.listdir(self.pkgdatadir)
+        except OSError:
+            return []
+        return [pn for pn in files if not pn.startswith('.') and
+                not os.path.isdir(os.path.join(self.pkgdatadir, pn))]
+
+    def _current(self, runtime=False):
+        """
+        Return the database connection if the index is in step with the
+        recipe pkgdata files in PKGDATA_DIR (and with the runtime/<pkg>
+        files of their packages if runtime is True), or None if the pkgdata
+        files have to be read instead.
+        """
+        conn = self._connect()
+        if not conn.execute("SELECT value FROM meta WHERE key='updated'").fetchone():
+            return None
+        recipes = dict(conn.execute("SELECT pn, stamp FROM recipes"))
+        if set(self._recipe_files()) - set(recipes):
+            return None
+        for pn, stamp in recipes.items():
+            if not _stamp_current(os.path.join(self.pkgdatadir, pn), stamp):
+                return None
+        if runtime:
+            for pkg, stamp in conn.execute("SELECT packages.pkg, runtime.stamp FROM packages "
+                                           "LEFT JOIN runtime ON packages.pkg = runtime.pkg"):
+                if not _stamp_current(os.path.join(self.pkgdatadir, 'runtime', pkg), stamp):
+                    return None
+        return conn
+
+    def _update_recipe(self, conn, pn):
+        stamp = _file_stamp(os.path.join(self.pkgdatadir, pn))
+        oldpkgs = [row[0] for row in
+                   conn.execute("SELECT pkg FROM packages WHERE pn=?", (pn,))]
+        conn.execute("DELETE FROM packages WHERE pn=?", (pn,))
+        if stamp is None:
+            conn.execute("DELETE FROM recipes WHERE pn=?", (pn,))
+            packages = []
+        else:
+            pkgdata = read_pkgdatafile(os.path.join(self.pkgdatadir, pn))
+            packages = (pkgdata.get("PACKAGES") or "").split()
+            conn.executemany("INSERT OR REPLACE INTO packages VALUES (?, ?)",
+                             [(pkg, pn) for pkg in packages])
+            conn.execute("INSERT OR REPLACE INTO recipes VALUES (?, ?)", (pn, stamp))
+
+        for pkg in set(oldpkgs) | set(packages):
+            self._update_runtime(conn, pkg)
+
+    def _update_runtime(self, conn, pkg):
+        import json
+
+        fn = os.path.join(self.pkgdatadir, 'runtime', pkg)
+        stamp = _file_stamp(fn)
+        conn.execute("DELETE FROM files WHERE pkg=?", (pkg,))
+        if stamp is None:
+            conn.execute("DELETE FROM runtime WHERE pkg=?", (pkg,))
+            return
+        pkgdata = read_runtime_pkgdata(fn)
+        conn.execute("INSERT OR REPLACE INTO runtime VALUES (?, ?, ?)", (pkg, stamp, json.dumps(pkgdata)))
+        files = _files_info(pkgdata)
+        if files:
+            conn.executemany("INSERT INTO files VALUES (?, ?)", [(path, pkg) for path in files])
+
+    def update(self, pns=()):
+        """
+        Refresh the index entries of the given recipes (pkgdata file names
+        at the top level of PKGDATA_DIR) and of their runtime packages,
+        then those of any other recipe or runtime package whose pkgdata
+        file changed. Recipes whose pkgdata file no longer exists are
+        dropped.
+        """
+        import time
+
+        conn = self._connect(write=True)
+        known = dict(conn.execute("SELECT pn, stamp FROM recipes"))
+        with conn:
+            for pn in pns:
+                self._update_recipe(conn, pn)
+                known.pop(pn, None)
+            for pn in self._recipe_files():
+                if pn in pns:
+                    continue
+                if pn not in known or not _stamp_current(os.path.join(self.pkgdatadir, pn), known[pn]):
+                    self._update_recipe(conn, pn)
+                known.pop(pn, None)
+            for pn in known:
+                self._update_recipe(conn, pn)
+            # Runtime files rewritten without their recipe's pkgdata file
+            for pkg, stamp in list(conn.execute("SELECT packages.pkg, runtime.stamp FROM packages "
+                                                "LEFT JOIN runtime ON packages.pkg = runtime.pkg")):
+                if not _stamp_current(os.path.join(self.pkgdatadir, 'runtime', pkg), stamp):
+                    self._update_runtime(conn, pkg)
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('updated', ?)", (str(time.time()),))
+
+    def invalidate(self):
+        """Stop using the index until the next update()"""
+        conn = self._connect(write=True)
+        with conn:
+            conn.execute("DELETE FROM meta WHERE key='updated'")
+
+    def pkgmap(self):
+        """Return a dictionary mapping package to recipe name"""
+        import sqlite3
+
+        try:
+            conn = self._current()
+        except sqlite3.Error:
+            conn = None
+        if conn is None:
+            return super(PkgdataIndex, self).pkgmap()
+        return dict(conn.execute("SELECT pkg, pn FROM packages"))
+
+    def recipename(self, pkg):
+        """Return the recipe name for the given package name, or None"""
+        import sqlite3
+
+        try:
+            conn = self._current()
+            if conn is None:
+                return super(PkgdataIndex, self).recipename(pkg)
+            row = conn.execute("SELECT pn FROM packages WHERE pkg=?", (pkg,)).fetchone()
+        except sqlite3.Error:
+            return super(PkgdataIndex, self).recipename(pkg)
+        if row and os.path.exists(os.path.join(self.pkgdatadir, row[0])):
+            return row[0]
+        return None
+
+    def read_runtime(self, pkg, structured=False):
+        """
+        Return the contents of runtime/<pkg> as read_pkgdatafile() would,
+        or read_runtime_pkgdata() if structured is True, using the cached
+        copy in the index if the file did not change.
+        """
+        import collections
+        import json
+        import sqlite3
+
+        fn = os.path.join(self.pkgdatadir, 'runtime', pkg)
+        try:
+            with open(fn, 'rb') as f:
+                # Binary files are quicker to read than the cached copy
+                if f.read(len(BINARY_MAGIC)) == BINARY_MAGIC:
+                    return _read(fn, False, structured)
+        except OSError:
+            return {}
+        try:
+            row = self._connect().execute("SELECT stamp, data FROM runtime WHERE pkg=?", (pkg,)).fetchone()
+        except sqlite3.Error:
+            row = None
+        if not row or not _stamp_current(fn, row[0]):
+            return _read(fn, False, structured)
+        # The index stores the structured form
+        pkgdata = json.loads(row[1], object_pairs_hook=collections.OrderedDict)
+        if not structured:
+            for key, value in pkgdata.items():
+                if isinstance(value, dict):
+                    pkgdata[key] = json.dumps(value)
+        return dict(pkgdata)
+
+    def find_path(self, pattern):
+        import fnmatch
+        import sqlite3
+
+        try:
+            conn = self._current(runtime=True)
+            if conn is None:
+                return super(PkgdataIndex, self).find_path(pattern)
+            prefix = _glob_prefix(pattern)
+            if prefix == pattern:
+                rows = conn.execute("SELECT pkg, path FROM files WHERE path=?", (pattern,))
+            elif prefix:
+                # Paths sharing the literal prefix form a contiguous range
+                # of the path index
+                rows = conn.execute("SELECT pkg, path FROM files WHERE path>=? AND path<?",
+                                    (prefix, prefix + '\U0010ffff'))
+            else:
+                rows = conn.execute("SELECT pkg, path FROM files")
+            return sorted((pkg, path) for pkg, path in rows
+                          if fnmatch.fnmatchcase(path, pattern))
+        except sqlite3.Error:
+            return super(PkgdataIndex, self).find_path(pattern)
+
+def open_pkgdata_index(pkgdatadir):
+    """
+    Return a PkgdataIndex for pkgdatadir, or an object with the same query
+    methods that reads the pkgdata files directly if the index database
+    doesn't exist or cannot be used. Neither writes to PKGDATA_DIR.
+    """
+    import sqlite3
+
+    index = PkgdataIndex(pkgdatadir)
+    try:
+        index._connect()
+    except (sqlite3.Error, OSError):
+        return PkgdataFiles(pkgdatadir)
+    return index
+
+def pkgdata_index(d):
+    """Return the (cached) pkgdata index for PKGDATA_DIR"""
+    # sqlite connections must not be shared with forked task processes
+    key = (d.getVar("PKGDATA_DIR", True), os.getpid())
+    index = _pkgdata_indexes.get(key)
+    if index is None:
+        index = open_pkgdata_index(key[0])
+        _pkgdata_indexes[key] = index
+    return index
+
+_pkgdata_indexes = {}
+
+def _pkgmap(d):
+    """Return a dictionary mapping package to recipe name."""
+
+    return pkgdata_index(d).pkgmap()
 
 def pkgmap(d):
     """Return a dictionary mapping package to recipe name.
@@ -92,4 +613,7 @@ def pkgmap(d):
 def recipename(pkg, d):
     """Return the recipe name for the given binary package name."""
 
-    return pkgmap(d).get(pkg)
+    pkgmap_data = d.getVar("__pkgmap_data", False)
+    if pkgmap_data is not None:
+        return pkgmap_data.get(pkg)
+    return pkgdata_index(d).recipename(pkg)
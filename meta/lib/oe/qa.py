@@ -1,8 +1,13 @@
 import os, struct
+import collections
 
 class NotELFFileError(Exception):
     pass
 
+# The strings of the dynamic section of an ELF file, and the set of the tags
+# present in it
+DynamicInfo = collections.namedtuple("DynamicInfo", "needed soname rpath runpath tags")
+
 class ELFFile:
     EI_NIDENT = 16
 
@@ -27,8 +32,37 @@ class ELFFile:
     ELFDATA2LSB  = 1
     ELFDATA2MSB  = 2
 
+    PT_LOAD = 1
+    PT_DYNAMIC = 2
     PT_INTERP = 3
 
+    # possible values for e_type
+    ET_REL  = 1
+    ET_EXEC = 2
+    ET_DYN  = 3
+
+    SHT_SYMTAB = 2
+
+    DT_NULL    = 0
+    DT_NEEDED  = 1
+    DT_STRTAB  = 5
+    DT_SYMTAB  = 6
+    DT_STRSZ   = 10
+    DT_SONAME  = 14
+    DT_RPATH   = 15
+    DT_TEXTREL = 22
+    DT_RUNPATH = 29
+    DT_SYMTAB_SHNDX = 34
+    DT_GNU_HASH = 0x6ffffef5
+    DT_FLAGS_1 = 0x6ffffffb
+    DF_1_PIE   = 0x08000000
+
+    EM_MIPS = 8
+    EM_MIPS_RS3_LE = 10
+    EF_MIPS_ARCH = 0xf0000000
+    E_MIPS_ARCH_32 = 0x50000000
+    E_MIPS_ARCH_64 = 0x60000000
+
     def my_assert(self, expectation, result):
         if not expectation == result:
             #print "'%x','%x' %s" % (ord(expectation), ord(result), self.name)
@@ -38,6 +72,7 @@ class ELFFile:
         self.name = name
         self.bits = bits
         self.objdump_output = {}
+        self.dynamic_info = None
 
     def open(self):
         if not os.path.isfile(self.name):
@@ -47,6 +82,12 @@ class ELFFile:
             # Read 4k which should cover most of the headers we're after
             self.data = f.read(4096)
 
+        self.parse()
+
+    def parse(self):
+        """
+        Check and decode the identification of the ELF header in self.data.
+        """
         if len(self.data) < ELFFile.EI_NIDENT + 4:
             raise NotELFFileError("%s is not an ELF" % self.name)
 
@@ -80,6 +121,22 @@ class ELFFile:
         else:
             raise NotELFFileError("Unknown self.sex")
 
+    def headerData(self):
+        """
+        Return the part of self.data holding the ELF and program headers,
+        which is all that isDynamic() and friends need.
+        """
+        try:
+            offset = self.getAddr(self.bits == 32 and 0x1C or 0x20)
+            size = self.getShort(self.bits == 32 and 0x2A or 0x36)
+            count = self.getShort(self.bits == 32 and 0x2C or 0x38)
+        except struct.error:
+            return self.data
+        end = max(offset + size * count, self.bits == 32 and 0x34 or 0x40)
+        if end > len(self.data):
+            return self.data
+        return self.data[:end]
+
     def osAbi(self):
         return self.data[ELFFile.EI_OSABI]
 
@@ -101,6 +158,186 @@ class ELFFile:
     def getWord(self, offset):
         return struct.unpack_from(self.sex+"i", self.data, offset)[0]
 
+    def getLong(self, offset):
+        return struct.unpack_from(self.sex+"Q", self.data, offset)[0]
+
+    def getAddr(self, offset):
+        """Read an address or offset sized field of the ELF class."""
+        if self.bits == 32:
+            return struct.unpack_from(self.sex+"I", self.data, offset)[0]
+        return self.getLong(offset)
+
+    def elfType(self):
+        return self.getShort(0x10)
+
+    def readAt(self, offset, size):
+        """Read 'size' bytes at 'offset', from the header data if possible."""
+        if offset + size <= len(self.data):
+            return self.data[offset:offset + size]
+        with open(self.name, "rb") as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def sectionHeaders(self):
+        """
+        Return the section header table as a list of (name offset, type,
+        file offset, size) tuples, reading it at most once.
+        """
+        if hasattr(self, "sections"):
+            return self.sections
+
+        shoff = self.getAddr(self.bits == 32 and 0x20 or 0x28)
+        size = self.getShort(self.bits == 32 and 0x2E or 0x3A)
+        count = self.getShort(self.bits == 32 and 0x30 or 0x3C)
+        if self.bits == 32:
+            fmt = self.sex + "IIIIII"
+        else:
+            fmt = self.sex + "IIQQQQ"
+        fields = struct.calcsize(fmt)
+
+        self.sections = []
+        if not shoff or size < fields:
+            return self.sections
+        if count == 0:
+            # More sections than fit e_shnum, the count is in the sh_size
+            # field of the first section header
+            count = struct.unpack_from(fmt, self.readAt(shoff, fields))[5]
+        table = self.readAt(shoff, size * count)
+        for i in range(0, len(table) // size):
+            name, type, _, _, offset, secsize = struct.unpack_from(fmt, table, i * size)
+            self.sections.append((name, type, offset, secsize))
+        return self.sections
+
+    def sectionNames(self):
+        """Return the names of all sections."""
+        sections = self.sectionHeaders()
+        strndx = self.getShort(self.bits == 32 and 0x32 or 0x3E)
+        if strndx >= len(sections):
+            return []
+        strtab = self.readAt(sections[strndx][2], sections[strndx][3])
+        return [strtab[name:strtab.find(b"\0", name)].decode("utf-8", "replace")
+                for name, _, _, _ in sections]
+
+    def segments(self):
+        """
+        Return the program header table as a list of (type, file offset,
+        virtual address, file size) tuples, reading it at most once.
+        """
+        if hasattr(self, "phdrs"):
+            return self.phdrs
+
+        offset = self.getAddr(self.bits == 32 and 0x1C or 0x20)
+        size = self.getShort(self.bits == 32 and 0x2A or 0x36)
+        count = self.getShort(self.bits == 32 and 0x2C or 0x38)
+        self.phdrs = []
+        if not offset or not size:
+            return self.phdrs
+        table = self.readAt(offset, size * count)
+        for i in range(0, len(table) // size):
+            if self.bits == 32:
+                type, offset, vaddr, _, filesz = struct.unpack_from(self.sex+"IIIII", table, i * size)
+            else:
+                type, _, offset, vaddr, _, filesz = struct.unpack_from(self.sex+"IIQQQQ", table, i * size)
+            self.phdrs.append((type, offset, vaddr, filesz))
+        return self.phdrs
+
+    def programHeaders(self):
+        """
+        Return the program header table as a list of (type, file offset,
+        file size) tuples.
+        """
+        return [(type, offset, filesz) for type, offset, vaddr, filesz in self.segments()]
+
+    def addrToOffset(self, addr):
+        """
+        Return the file offset of the virtual address addr, or None if it
+        isn't in the file part of a loadable segment.
+        """
+        for type, offset, vaddr, filesz in self.segments():
+            if type == ELFFile.PT_LOAD and vaddr <= addr < vaddr + filesz:
+                return offset + addr - vaddr
+        return None
+
+    def dynamicEntries(self):
+        """
+        Return the entries of the dynamic section as a list of (tag, value)
+        tuples, reading them at most once.
+        """
+        if hasattr(self, "dynamic"):
+            return self.dynamic
+
+        self.dynamic = []
+        fmt = self.sex + (self.bits == 32 and "iI" or "qQ")
+        entsize = struct.calcsize(fmt)
+        for type, offset, filesz in self.programHeaders():
+            if type != ELFFile.PT_DYNAMIC:
+                continue
+            data = self.readAt(offset, filesz)
+            for i in range(0, len(data) // entsize):
+                tag, value = struct.unpack_from(fmt, data, i * entsize)
+                if tag == ELFFile.DT_NULL:
+                    break
+                self.dynamic.append((tag, value))
+            break
+        return self.dynamic
+
+    def dynamicInfo(self):
+        """
+        Return the DynamicInfo of the file: the NEEDED, SONAME, RPATH and
+        RUNPATH strings of the dynamic section (as objdump -p shows them)
+        and the set of the dynamic tags present. Raises NotELFFileError if
+        the string table can't be found.
+        """
+        if self.dynamic_info is not None:
+            return self.dynamic_info
+
+        try:
+            self.dynamic_info = self._readDynamicInfo()
+        except struct.error:
+            raise NotELFFileError("%s has a truncated dynamic section" % self.name)
+        return self.dynamic_info
+
+    def _readDynamicInfo(self):
+        entries = self.dynamicEntries()
+        strings = dict((tag, []) for tag in (ELFFile.DT_NEEDED, ELFFile.DT_SONAME, ELFFile.DT_RPATH, ELFFile.DT_RUNPATH))
+        if any(tag in strings for tag, value in entries):
+            values = dict(entries)
+            strtab = values.get(ELFFile.DT_STRTAB)
+            strsz = values.get(ELFFile.DT_STRSZ)
+            offset = self.addrToOffset(strtab) if strtab is not None else None
+            if offset is None or not strsz:
+                raise NotELFFileError("%s has no dynamic string table" % self.name)
+            strtab = self.readAt(offset, strsz)
+            for tag, value in entries:
+                if tag in strings:
+                    end = strtab.find(b"\0", value)
+                    if end == -1:
+                        end = len(strtab)
+                    strings[tag].append(strtab[value:end].decode("utf-8", "surrogateescape"))
+
+        return DynamicInfo(strings[ELFFile.DT_NEEDED], strings[ELFFile.DT_SONAME],
+                           strings[ELFFile.DT_RPATH], strings[ELFFile.DT_RUNPATH],
+                           frozenset(tag for tag, value in entries))
+
+    def flags(self):
+        """Return the processor specific flags (e_flags) of the file."""
+        return struct.unpack_from(self.sex+"I", self.data, self.bits == 32 and 0x24 or 0x30)[0]
+
+    def isMipsArch(self, *archs):
+        """Return True for a MIPS file of one of the EF_MIPS_ARCH values archs."""
+        return (self.machine() in (ELFFile.EM_MIPS, ELFFile.EM_MIPS_RS3_LE) and
+                self.flags() & ELFFile.EF_MIPS_ARCH in archs)
+
+    def isPIE(self):
+        """Return True for a position independent executable."""
+        return any(tag == ELFFile.DT_FLAGS_1 and value & ELFFile.DF_1_PIE
+                   for tag, value in self.dynamicEntries())
+
+    def isStripped(self):
+        """Return True if there is no symbol table, like file(1) does."""
+        return not any(type == ELFFile.SHT_SYMTAB
+                       for _, type, _, _ in self.sectionHeaders())
+
     def isDynamic(self):
         """
         Return True if there is a .interp segment (therefore dynamically
@@ -144,6 +381,145 @@ class ELFFile:
             bb.note("%s %s %s failed: %s" % (objdump, cmd, self.name, e))
             return ""
 
+class QACache:
+    """
+    Cache of per-file QA facts shared between do_package and do_package_qa:
+    the ELF headers and dynamic section of each file and the output of the
+    objdump commands run on it. Entries are keyed on the inode, modification
+    time and size of the file, so hardlinked copies of a file share them and
+    modified files miss.
+    """
+
+    VERSION = 2
+
+    def __init__(self, fn, objdump):
+        import threading
+
+        self.fn = fn
+        self.objdump = objdump
+        self.files = {}
+        self.lock = threading.Lock()
+        try:
+            import pickle
+            with open(fn, "rb") as f:
+                data = pickle.load(f)
+            if data["version"] == QACache.VERSION and data["objdump"] == objdump:
+                self.files = data["files"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            bb.debug(1, "Ignoring QA cache %s: %s" % (fn, e))
+
+    def elf(self, path):
+        """
+        Return an opened ELFFile for path, or None if it isn't an ELF file
+        (or can't be read). Results of run_objdump() on the returned object
+        are recorded in the cache.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+        elf = ELFFile(path)
+        entry = self.files.get(key)
+        if entry:
+            data, elf.objdump_output, elf.dynamic_info = entry
+            if data is None:
+                return None
+            elf.data = data
+            elf.parse()
+            return elf
+
+        try:
+            elf.open()
+        except NotELFFileError:
+            elf = None
+        except IOError:
+            # IOError can happen if the packaging control files disappear
+            return None
+        if elf:
+            try:
+                elf.dynamicInfo()
+            except (IOError, NotELFFileError):
+                pass
+        with self.lock:
+            if elf:
+                self.files[key] = (elf.headerData(), elf.objdump_output, elf.dynamic_info)
+            else:
+                self.files[key] = (None, {}, None)
+        return elf
+
+    def prefetch(self, paths, nproc=None):
+        """
+        Read the ELF headers and dynamic sections of all paths from a pool
+        of threads.
+        """
+        import concurrent.futures
+
+        if not nproc:
+            nproc = os.cpu_count() or 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nproc) as executor:
+            for elf in executor.map(self.elf, paths):
+                pass
+
+    def save(self):
+        import pickle
+
+        os.makedirs(os.path.dirname(self.fn), exist_ok=True)
+        tmp = "%s.%d" % (self.fn, os.getpid())
+        with self.lock:
+            with open(tmp, "wb") as f:
+                pickle.dump({"version": QACache.VERSION, "objdump": self.objdump,
+                             "files": self.files}, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.fn)
+
+def dynamic_info(paths, qacache=None, nproc=None):
+    """
+    Read the dynamic sections of the ELF files among paths from a pool of
+    threads, through qacache if given. Returns a dict mapping each path to
+    its DynamicInfo, or to None if it isn't an ELF file or its dynamic
+    section can't be read.
+    """
+    import concurrent.futures
+
+    def read(path):
+        if qacache:
+            elf = qacache.elf(path)
+        else:
+            elf = ELFFile(path)
+            try:
+                elf.open()
+            except (IOError, NotELFFileError):
+                elf = None
+        if not elf:
+            return None
+        try:
+            return elf.dynamicInfo()
+        except (IOError, NotELFFileError) as e:
+            bb.note("Unable to read the dynamic section of %s: %s" % (path, e))
+            return None
+
+    if not nproc:
+        nproc = os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=nproc) as executor:
+        return dict(zip(paths, executor.map(read, paths)))
+
+_qa_caches = {}
+
+def qa_cache(d):
+    """
+    Return the QA cache of the recipe, or None if PACKAGE_QA_CACHE is empty.
+    """
+    fn = d.getVar("PACKAGE_QA_CACHE", True)
+    if not fn:
+        return None
+    key = (fn, os.getpid())
+    if key not in _qa_caches:
+        _qa_caches[key] = QACache(fn, d.getVar("OBJDUMP", True))
+    return _qa_caches[key]
+
 def elf_machine_to_string(machine):
     """
     Return the name of a given ELF e_machine field or the hex value as a string
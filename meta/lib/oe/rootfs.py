@@ -10,6 +10,82 @@ import subprocess
 import re
 
 
+class LogChecker(object):
+    """
+    Classifies the lines of a log file as excluded, warning or error lines.
+
+    All patterns are combined into one regular expression which is matched
+    once per line, and the offset reached in each log file is remembered, so
+    that checking a growing log again only scans the lines appended since.
+    A line matching one of the excludes is never reported, a line matching
+    both the warning and the error pattern is reported as both.
+    """
+
+    def __init__(self, excludes, warn, error):
+        self.offsets = {}
+        # Each pattern is searched from the start of the line by a lookahead,
+        # so that '^' in the patterns keeps its meaning
+        pattern = '^(?:(?=.*?(?:%s))(?P<_lc_exclude>)' \
+                  '|(?=(?P<_lc_error>.*?(?:%s))?)' \
+                  '(?=(?P<_lc_warn>.*?(?:%s))?))' % \
+                  ('|'.join('(?:%s)' % x for x in excludes), error, warn)
+        try:
+            self._regex = re.compile(pattern)
+        except re.error:
+            # Patterns using global inline flags can't be embedded, fall back
+            # to matching them one by one
+            self._regex = None
+            self._excludes = [re.compile(x) for x in excludes]
+            self._warn = re.compile(warn)
+            self._error = re.compile(error)
+
+    def classify(self, line):
+        """
+        Return a tuple telling whether 'line' is an error line and whether it
+        is a warning line.
+        """
+        if self._regex is not None:
+            m = self._regex.match(line)
+            if m.group('_lc_exclude') is not None:
+                return False, False
+            return (m.group('_lc_error') is not None,
+                    m.group('_lc_warn') is not None)
+
+        for ee in self._excludes:
+            if ee.search(line):
+                return False, False
+        return (self._error.search(line) is not None,
+                self._warn.search(line) is not None)
+
+    def scan(self, log_path):
+        """
+        Scan the part of 'log_path' which has not been scanned yet and return
+        the lists of warning and error lines found in it. A partially written
+        last line is kept back until the rest of it has been written.
+        """
+        warnings = []
+        errors = []
+        with open(log_path, 'rb') as log:
+            offset, tail = self.offsets.get(log_path, (0, b''))
+            if offset > os.fstat(log.fileno()).st_size:
+                # The log was truncated or replaced
+                offset, tail = 0, b''
+            log.seek(offset)
+            for line in log:
+                offset += len(line)
+                if not line.endswith(b'\n'):
+                    tail += line
+                    break
+                line = (tail + line).decode('utf-8', errors='replace')
+                tail = b''
+                error, warn = self.classify(line)
+                if warn:
+                    warnings.append(line)
+                if error:
+                    errors.append(line)
+        self.offsets[log_path] = (offset, tail)
+        return warnings, errors
+
 class Rootfs(object, metaclass=ABCMeta):
     """
     This is an abstract class. Do not instantiate this directly.
@@ -21,6 +97,7 @@ class Rootfs(object, metaclass=ABCMeta):
         self.image_rootfs = self.d.getVar('IMAGE_ROOTFS', True)
         self.deploydir = self.d.getVar('IMGDEPLOYDIR', True)
         self.progress_reporter = progress_reporter
+        self._log_checker = None
 
         self.install_order = Manifest.INSTALL_ORDER
 
@@ -40,47 +117,35 @@ class Rootfs(object, metaclass=ABCMeta):
     def _log_check(self):
         pass
 
-    def _log_check_common(self, type, match):
-        # Ignore any lines containing log_check to avoid recursion, and ignore
-        # lines beginning with a + since sh -x may emit code which isn't
-        # actually executed, but may contain error messages
-        excludes = [ 'log_check', r'^\+' ]
-        if hasattr(self, 'log_check_expected_regexes'):
-            excludes.extend(self.log_check_expected_regexes)
-        excludes = [re.compile(x) for x in excludes]
-        r = re.compile(match)
+    def _log_check_common(self):
+        if self._log_checker is None:
+            # Ignore any lines containing log_check to avoid recursion, and
+            # ignore lines beginning with a + since sh -x may emit code which
+            # isn't actually executed, but may contain error messages
+            excludes = [ 'log_check', r'^\+' ]
+            if hasattr(self, 'log_check_expected_regexes'):
+                excludes.extend(self.log_check_expected_regexes)
+            self._log_checker = LogChecker(excludes,
+                                           '^(warn|Warn|WARNING:)',
+                                           self.log_check_regex)
+
         log_path = self.d.expand("${T}/log.do_rootfs")
-        messages = []
-        with open(log_path, 'r') as log:
-            for line in log:
-                for ee in excludes:
-                    m = ee.search(line)
-                    if m:
-                        break
-                if m:
-                    continue
-
-                m = r.search(line)
-                if m:
-                    messages.append('[log_check] %s' % line)
-        if messages:
+        warnings, errors = self._log_checker.scan(log_path)
+        for type, messages in (('warning', warnings), ('error', errors)):
+            if not messages:
+                continue
             if len(messages) == 1:
                 msg = '1 %s message' % type
             else:
                 msg = '%d %s messages' % (len(messages), type)
             msg = '[log_check] %s: found %s in the logfile:\n%s' % \
-                (self.d.getVar('PN', True), msg, ''.join(messages))
+                (self.d.getVar('PN', True), msg,
+                 ''.join('[log_check] %s' % line for line in messages))
             if type == 'error':
                 bb.fatal(msg)
             else:
                 bb.warn(msg)
 
-    def _log_check_warn(self):
-        self._log_check_common('warning', '^(warn|Warn|WARNING:)')
-
-    def _log_check_error(self):
-        self._log_check_common('error', self.log_check_regex)
-
     def _insert_feed_uris(self):
         if bb.utils.contains("IMAGE_FEATURES", "package-management",
                          True, False, self.d):
@@ -509,8 +574,7 @@ class RpmRootfs(Rootfs):
         pass
 
     def _log_check(self):
-        self._log_check_warn()
-        self._log_check_error()
+        self._log_check_common()
 
     def _handle_intercept_failure(self, registered_pkgs):
         rpm_postinsts_dir = self.image_rootfs + self.d.expand('${sysconfdir}/rpm-postinsts/')
@@ -711,8 +775,7 @@ class DpkgRootfs(DpkgOpkgRootfs):
         self.pm.mark_packages("unpacked", registered_pkgs.split())
 
     def _log_check(self):
-        self._log_check_warn()
-        self._log_check_error()
+        self._log_check_common()
 
     def _cleanup(self):
         pass
@@ -980,8 +1043,7 @@ class OpkgRootfs(DpkgOpkgRootfs):
         self.pm.mark_packages("unpacked", registered_pkgs.split())
 
     def _log_check(self):
-        self._log_check_warn()
-        self._log_check_error()
+        self._log_check_common()
 
     def _cleanup(self):
         self.pm.remove_lists()
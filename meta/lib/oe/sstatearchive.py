@@ -0,0 +1,112 @@
+"""
+Creation of sstate object archives.
+
+The archive format of an sstate object is given by the extension of its
+file name, so objects of different formats can live side by side in the
+same SSTATE_DIR: "tgz" (gzip, compressed with pigz when it is available)
+and "tar.zst" (zstd). Both compressors run in parallel with tar, using
+several threads.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+# Format: (compressor, decompressor) commands, the first one available is used
+FORMATS = {
+    "tgz": ((["pigz", "-p", "%(threads)d"], ["gzip"]),
+            (["pigz", "-dc"], ["gzip", "-dc"])),
+    "tar.zst": ((["zstd", "-q", "-T%(threads)d"],),
+                (["zstd", "-q", "-dc"],)),
+}
+
+def archive_format(path):
+    """Return the format of the archive path from its extension, or None"""
+    for fmt in FORMATS:
+        if path.endswith("." + fmt):
+            return fmt
+    return None
+
+def _command(commands, path, threads):
+    for cmd in commands:
+        if shutil.which(cmd[0], path=path):
+            return [arg % {"threads": threads} for arg in cmd]
+    return None
+
+def compressor(fmt, threads=0, path=None):
+    """
+    Return the command compressing stdin to stdout in format fmt with
+    threads threads (0 for one per CPU), or None if there is no tool for it
+    on path (defaulting to PATH).
+    """
+    return _command(FORMATS[fmt][0], path, threads or os.cpu_count() or 1)
+
+def decompressor(fmt, path=None):
+    """
+    Return the command decompressing fmt from stdin to stdout, or None if
+    there is no tool for it on path (defaulting to PATH).
+    """
+    return _command(FORMATS[fmt][1], path, 1)
+
+def create(archive, topdir, threads=0):
+    """
+    Archive the (non hidden) contents of topdir to archive, in the format
+    given by its extension. The archive is written to a temporary file
+    which is renamed into place once complete. Raises
+    subprocess.CalledProcessError if tar or the compressor fails.
+    """
+    fmt = archive_format(archive)
+    if not fmt:
+        raise ValueError("Unknown sstate archive format for %s" % archive)
+    compress = compressor(fmt, threads)
+    if not compress:
+        raise FileNotFoundError("No compressor found for %s" % archive)
+
+    names = sorted(n for n in os.listdir(topdir) if not n.startswith("."))
+    tarcmd = ["tar", "-cf", "-"] + (names or ["--files-from=/dev/null"])
+    fd, tmpfile = tempfile.mkstemp(prefix=os.path.basename(archive) + ".", dir=os.path.dirname(archive))
+    try:
+        with os.fdopen(fd, "wb") as out:
+            tar = subprocess.Popen(tarcmd, cwd=topdir, stdout=subprocess.PIPE)
+            comp = subprocess.Popen(compress, stdin=tar.stdout, stdout=out)
+            tar.stdout.close()
+            comp.wait()
+            tar.wait()
+        # tar returns 1 if files changed while being archived
+        if tar.returncode not in (0, 1):
+            raise subprocess.CalledProcessError(tar.returncode, tarcmd)
+        if comp.returncode != 0:
+            raise subprocess.CalledProcessError(comp.returncode, compress)
+        os.chmod(tmpfile, 0o664)
+        os.rename(tmpfile, archive)
+    except:
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+        raise
+
+def extract(archive, destdir, path=None):
+    """
+    Unpack archive, in the format given by its extension, into destdir
+    using the decompressor found on path (defaulting to PATH). Raises
+    subprocess.CalledProcessError if either tar or the decompressor fails,
+    so that a corrupt or truncated archive isn't installed.
+    """
+    fmt = archive_format(archive)
+    if not fmt:
+        raise ValueError("Unknown sstate archive format for %s" % archive)
+    decompress = decompressor(fmt, path)
+    if not decompress:
+        raise FileNotFoundError("No decompressor found for %s" % archive)
+
+    tarcmd = ["tar", "-xvf", "-"]
+    with open(archive, "rb") as f:
+        decomp = subprocess.Popen(decompress, stdin=f, stdout=subprocess.PIPE)
+        tar = subprocess.Popen(tarcmd, cwd=destdir, stdin=decomp.stdout)
+        decomp.stdout.close()
+        tar.wait()
+        decomp.wait()
+    if decomp.returncode != 0:
+        raise subprocess.CalledProcessError(decomp.returncode, decompress)
+    if tar.returncode != 0:
+        raise subprocess.CalledProcessError(tar.returncode, tarcmd)
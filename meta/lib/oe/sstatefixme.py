@@ -0,0 +1,177 @@
+"""
+Replacement of hardcoded paths in sstate objects.
+
+When an sstate object is created the build specific paths in the files
+selected by SSTATE_SCAN_CMD are replaced with FIXME tokens, and when it is
+installed the tokens are replaced with the paths of the new build. Files
+are scanned once, through mmap, and rewritten in-process. The files which
+were changed are listed in "fixmepath", and the offsets of the tokens in
+them in "fixmepath.index", so that installing an object doesn't need to
+search for the tokens again.
+"""
+
+import concurrent.futures
+import mmap
+import os
+import re
+
+FIXMEPATH = "fixmepath"
+FIXMEINDEX = "fixmepath.index"
+
+class Replacer(object):
+    """
+    Replacement of the byte strings in 'replacements', a list of (old, new)
+    pairs, in files. Where several of them match at the same place the
+    first one in the list wins, as with sed expressions applied in turn.
+    Only files containing one of the first 'required' old strings (all of
+    them by default) are changed.
+    """
+
+    def __init__(self, replacements, required=None):
+        self.replacements = [(os.fsencode(old), os.fsencode(new)) for (old, new) in replacements if old]
+        self.required = [old for (old, new) in self.replacements[:required]]
+        self.regex = re.compile(b"|".join(b"(" + re.escape(old) + b")" for (old, new) in self.replacements))
+
+    def scan(self, path):
+        """
+        Return the list of (offset, index into replacements) of the
+        strings to replace in path, or None if the file doesn't contain any
+        of the required ones.
+        """
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if not any(data.find(old) != -1 for old in self.required):
+                    return None
+                return [(m.start(), m.lastindex - 1) for m in self.regex.finditer(data)]
+
+    def matches(self, path, offsets):
+        """
+        Return the list of (offset, index into replacements) for the strings
+        recorded at offsets in path, or None if the file doesn't contain
+        one of them at each offset.
+        """
+        found = []
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for offset in offsets:
+                    m = self.regex.match(data, offset)
+                    if not m:
+                        return None
+                    found.append((offset, m.lastindex - 1))
+        return found
+
+    def rewrite(self, path, found):
+        """
+        Replace the strings found (as returned by scan()) in path, writing
+        a new file in its place so that other links to the original file
+        are left alone. Returns the offsets of the new strings in the new
+        file.
+        """
+        newoffsets = []
+        st = os.lstat(path)
+        tmpfile = path + ".fixme.tmp"
+        with open(path, "rb") as f, open(tmpfile, "wb") as out:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                pos = 0
+                written = 0
+                for (offset, index) in found:
+                    old, new = self.replacements[index]
+                    out.write(data[pos:offset])
+                    written += offset - pos
+                    newoffsets.append(written)
+                    out.write(new)
+                    written += len(new)
+                    pos = offset + len(old)
+                out.write(data[pos:])
+        os.chmod(tmpfile, st.st_mode & 0o7777)
+        os.rename(tmpfile, path)
+        return newoffsets
+
+def _threads(count):
+    return max(1, min(count, (os.cpu_count() or 1) * 2, 64))
+
+def hardcode_paths(topdir, paths, replacer):
+    """
+    Replace the build paths of replacer in those of paths (relative to
+    topdir) which contain them, and write the fixmepath list and index of
+    the changed files in topdir. Returns the list of changed files.
+    """
+    def process(path):
+        found = replacer.scan(os.path.join(topdir, path))
+        if not found:
+            return path, None
+        return path, replacer.rewrite(os.path.join(topdir, path), found)
+
+    changed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=_threads(len(paths))) as executor:
+        for path, offsets in executor.map(process, paths):
+            if offsets is not None:
+                changed.append((path, offsets))
+
+    if changed:
+        with open(os.path.join(topdir, FIXMEPATH), "w") as f:
+            f.writelines("%s\n" % path for (path, offsets) in changed)
+        with open(os.path.join(topdir, FIXMEINDEX), "w") as f:
+            f.writelines("%s\t%s\n" % (path, ",".join(str(o) for o in offsets)) for (path, offsets) in changed)
+    return [path for (path, offsets) in changed]
+
+def read_index(topdir):
+    """
+    Return a dict mapping the files listed in the fixmepath of topdir to
+    the offsets of their FIXME tokens, or to None if those weren't
+    recorded (objects created before the index existed).
+    """
+    files = {}
+    fixmefn = os.path.join(topdir, FIXMEPATH)
+    if not os.path.isfile(fixmefn):
+        return files
+    with open(fixmefn) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line:
+                files[line.lstrip("/")] = None
+    try:
+        with open(os.path.join(topdir, FIXMEINDEX)) as f:
+            for line in f:
+                path, _, offsets = line.rstrip("\n").rpartition("\t")
+                if path in files:
+                    files[path] = [int(o) for o in offsets.split(",") if o]
+    except (OSError, ValueError):
+        pass
+    return files
+
+def fixup_paths(topdir, replacer):
+    """
+    Replace the FIXME tokens of replacer in the files listed in the
+    fixmepath of topdir, using the recorded offsets where they are still
+    valid, then remove the fixmepath list and index. Returns the number of
+    files changed.
+    """
+    files = read_index(topdir)
+
+    def process(item):
+        path, offsets = item
+        path = os.path.join(topdir, path)
+        if not os.path.isfile(path) or os.path.islink(path):
+            return False
+        found = None
+        if offsets:
+            found = replacer.matches(path, offsets)
+        if found is None:
+            found = replacer.scan(path)
+        if not found:
+            return False
+        replacer.rewrite(path, found)
+        return True
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=_threads(len(files))) as executor:
+        count = sum(executor.map(process, files.items()))
+
+    for fn in (FIXMEPATH, FIXMEINDEX):
+        if os.path.exists(os.path.join(topdir, fn)):
+            os.remove(os.path.join(topdir, fn))
+    return count
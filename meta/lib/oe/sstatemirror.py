@@ -0,0 +1,348 @@
+"""
+Availability checks for sstate objects on SSTATE_MIRRORS.
+
+Checking a mirror through the fetcher costs a bb.fetch2.Fetch object (and
+for http mirrors a new wget process) per object. The common mirror forms,
+file:// and http(s):// URLs substituting PATH, are instead checked here
+directly: local mirrors by listing their directories, http mirrors with
+HEAD requests sent over a few persistent connections per host. Anything
+else is left to the fetcher. Results for http mirrors are kept for a while
+in a ProbeCache so that consecutive builds don't ask again.
+"""
+
+import bb
+import os
+import threading
+import time
+
+# SSTATE_MIRRORS patterns which simply match any sstate object
+ANY_OBJECT = ("file://.*", "file://.*/.*")
+
+def mirror_url(mirror, sstatefile):
+    """
+    Return the URL of sstatefile (relative to SSTATE_DIR) on the mirror
+    given as a (pattern, replacement) pair from SSTATE_MIRRORS, or None if
+    only the fetcher knows how to map it.
+    """
+    find, replace = mirror
+    if find not in ANY_OBJECT or "PATH" not in replace:
+        return None
+    url = replace.split(";")[0].replace("PATH", sstatefile)
+    if url.startswith(("file://", "http://", "https://")):
+        return url
+    return None
+
+def _uses_proxy(url, d):
+    # Whether the fetcher would go through a proxy for this URL
+    import urllib.parse
+
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme == "file":
+        return False
+    proxy = None
+    for var in (parts.scheme + "_proxy", parts.scheme.upper() + "_PROXY", "all_proxy", "ALL_PROXY"):
+        proxy = d.getVar(var, True)
+        if proxy:
+            break
+    if not proxy:
+        return False
+    noproxy = (d.getVar("no_proxy", True) or d.getVar("NO_PROXY", True) or "").replace(",", " ").split()
+    for entry in noproxy:
+        entry = entry.lstrip(".")
+        if entry == "*" or parts.hostname == entry or parts.hostname.endswith("." + entry):
+            return False
+    return True
+
+class HostStats(object):
+    """Results of the checks made against one host"""
+
+    def __init__(self, host):
+        self.host = host
+        self.found = 0
+        self.missing = 0
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def __str__(self):
+        return "%s: %d found, %d missing, %d errors in %.1fs" % (self.host, self.found, self.missing, self.errors, self.elapsed)
+
+def _check_http_host(scheme, host, urls, connections, timeout, results, stats, progress):
+    import http.client
+    import queue
+    import urllib.parse
+
+    start = time.time()
+    todo = queue.Queue()
+    for url in urls:
+        todo.put(url)
+    lock = threading.Lock()
+
+    def connect():
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, timeout=timeout)
+        return http.client.HTTPConnection(host, timeout=timeout)
+
+    def worker():
+        conn = None
+        while True:
+            try:
+                url = todo.get_nowait()
+            except queue.Empty:
+                break
+            path = urllib.parse.quote(urllib.parse.urlsplit(url).path)
+            result = None
+            # Retry once on a fresh connection, the server may have closed
+            # an idle keep-alive connection
+            for attempt in range(2):
+                try:
+                    if conn is None:
+                        conn = connect()
+                    conn.request("HEAD", path)
+                    response = conn.getresponse()
+                    response.read()
+                    if response.status == 200:
+                        result = True
+                    elif response.status in (404, 410):
+                        result = False
+                    if response.getheader("connection", "").lower() == "close":
+                        conn.close()
+                        conn = None
+                    break
+                except (http.client.HTTPException, OSError):
+                    if conn is not None:
+                        conn.close()
+                        conn = None
+            with lock:
+                results[url] = result
+                if result is True:
+                    stats.found += 1
+                elif result is False:
+                    stats.missing += 1
+                else:
+                    stats.errors += 1
+            if progress:
+                progress(1)
+        if conn is not None:
+            conn.close()
+
+    threads = [threading.Thread(target=worker) for i in range(min(connections, len(urls)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats.elapsed = time.time() - start
+
+def check_urls(urls, connections=8, timeout=30, progress=None, d=None):
+    """
+    Check which of the given file:// and http(s):// URLs exist. HTTP URLs
+    are checked with HEAD requests over up to 'connections' persistent
+    connections per host, all hosts at the same time. Local paths are
+    checked with oe.sstatesig.sstate_objects_exist(), using the datastore d
+    if given.
+
+    Returns a dict mapping each URL to True (exists), False (doesn't exist)
+    or None (couldn't tell), and a dict of HostStats per host ("file" for
+    local mirrors). progress, if given, is called with the number of URLs
+    checked as the checks complete.
+    """
+    import urllib.parse
+    import oe.sstatesig
+
+    results = {}
+    stats = {}
+    byhost = {}
+    local = []
+    for url in set(urls):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme == "file":
+            local.append(url)
+        else:
+            byhost.setdefault((parts.scheme, parts.netloc), []).append(url)
+
+    threads = []
+    for (scheme, host), hosturls in byhost.items():
+        stats[host] = HostStats(host)
+        t = threading.Thread(target=_check_http_host,
+                             args=(scheme, host, hosturls, connections, timeout, results, stats[host], progress))
+        t.start()
+        threads.append(t)
+
+    if local:
+        start = time.time()
+        stats["file"] = HostStats("file")
+        paths = dict((urllib.parse.urlsplit(url).path, url) for url in local)
+        existing = oe.sstatesig.sstate_objects_exist(paths.keys(), d)
+        for path, url in paths.items():
+            results[url] = path in existing
+            if results[url]:
+                stats["file"].found += 1
+            else:
+                stats["file"].missing += 1
+        stats["file"].elapsed = time.time() - start
+        if progress:
+            progress(len(local))
+
+    for t in threads:
+        t.join()
+    return results, stats
+
+class ProbeCache(object):
+    """
+    Persistent (sqlite) record of the results of earlier checks for sstate
+    objects on mirrors, keyed by mirror and object name. Objects found are
+    trusted for found_ttl seconds and objects missing for missing_ttl
+    seconds; a TTL of zero disables caching that kind of result. The
+    database can be shared by concurrent bitbake processes.
+    """
+
+    VERSION = "1"
+
+    def __init__(self, path, found_ttl, missing_ttl):
+        self.path = path
+        self.found_ttl = found_ttl
+        self.missing_ttl = missing_ttl
+        self._conn = None
+
+    def _connect(self):
+        import sqlite3
+
+        if self._conn is None:
+            bb.utils.mkdirhier(os.path.dirname(self.path))
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            with conn:
+                if meta.get("version") != self.VERSION:
+                    conn.execute("DROP TABLE IF EXISTS probes")
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.VERSION,))
+                conn.execute("CREATE TABLE IF NOT EXISTS probes (mirror TEXT, name TEXT, found INTEGER, time REAL, PRIMARY KEY (mirror, name))")
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def lookup(self, mirror, names):
+        """
+        Return a dict mapping those of names with a still valid result for
+        mirror to True (found) or False (missing).
+        """
+        if not self.found_ttl and not self.missing_ttl:
+            return {}
+        conn = self._connect()
+        now = time.time()
+        known = {}
+        for name, found, checked in conn.execute("SELECT name, found, time FROM probes WHERE mirror=?", (mirror,)):
+            if name not in names:
+                continue
+            ttl = self.found_ttl if found else self.missing_ttl
+            if now - ttl < checked <= now:
+                known[name] = bool(found)
+        return known
+
+    def record(self, mirror, results):
+        """
+        Record results, a dict mapping object names to True (found) or False
+        (missing) on mirror, dropping expired entries.
+        """
+        if not self.found_ttl and not self.missing_ttl:
+            return
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?)",
+                             [(mirror, name, int(found), now) for name, found in results.items()])
+            conn.execute("DELETE FROM probes WHERE time < ?", (now - max(self.found_ttl, self.missing_ttl),))
+
+def probe_cache(d):
+    """
+    Return the ProbeCache configured by SSTATE_MIRROR_PROBE_CACHE, or None
+    if it is disabled.
+    """
+    path = d.getVar("SSTATE_MIRROR_PROBE_CACHE", True)
+    if not path:
+        return None
+    return ProbeCache(path, int(d.getVar("SSTATE_MIRROR_FOUND_TTL", True) or 0),
+                      int(d.getVar("SSTATE_MIRROR_MISSING_TTL", True) or 0))
+
+def check_mirrors(sstatefiles, d, progress=None):
+    """
+    Check SSTATE_MIRRORS for the objects in sstatefiles, a dict mapping
+    tasks to sstate object names relative to SSTATE_DIR. Mirrors are
+    tried in order until an object is found.
+
+    Returns the set of tasks whose object was found and the set of tasks
+    which need to be checked through the fetcher instead, either because a
+    mirror can't be checked directly or because the check failed.
+    """
+    import bb.fetch2
+    import sqlite3
+
+    mirrors = bb.fetch2.mirror_from_string(d.getVar("SSTATE_MIRRORS", True))
+    connections = int(d.getVar("SSTATE_MIRROR_CONNECTIONS", True) or 8)
+    timeout = int(d.getVar("SSTATE_MIRROR_TIMEOUT", True) or 30)
+    cache = probe_cache(d)
+
+    found = set()
+    fallback = set()
+    remaining = dict(sstatefiles)
+    try:
+        for mirror in mirrors:
+            if not remaining:
+                break
+            urls = dict((task, mirror_url(mirror, sstatefile)) for task, sstatefile in remaining.items())
+            # All objects map to the same kind of URL on a given mirror
+            sample = next(iter(urls.values()))
+            if not sample or _uses_proxy(sample, d):
+                # Only the fetcher can check this mirror, and it checks all
+                # the mirrors again
+                fallback.update(remaining)
+                break
+
+            # Local mirrors are cheap enough to check every time
+            known = {}
+            if cache and not sample.startswith("file://"):
+                try:
+                    known = cache.lookup(mirror[1], set(remaining.values()))
+                except sqlite3.Error as e:
+                    bb.debug(1, "Unable to use sstate mirror probe cache %s: %s" % (cache.path, e))
+                    cache.close()
+                    cache = None
+            if known and progress:
+                progress(len([task for task in remaining if remaining[task] in known]))
+
+            tocheck = [url for task, url in urls.items() if remaining[task] not in known]
+            results, stats = check_urls(tocheck, connections, timeout, progress, d)
+            for host in sorted(stats):
+                bb.note("SState mirror %s" % stats[host])
+            if known:
+                bb.note("SState mirror %s: %d results from the probe cache" % (mirror[1], len(known)))
+
+            checked = {}
+            for task, url in urls.items():
+                sstatefile = remaining[task]
+                if sstatefile in known:
+                    result = known[sstatefile]
+                else:
+                    result = results.get(url)
+                    if result is not None:
+                        checked[sstatefile] = result
+                if result is None:
+                    fallback.add(task)
+                    del remaining[task]
+                elif result:
+                    found.add(task)
+                    del remaining[task]
+
+            if cache and checked and not sample.startswith("file://"):
+                try:
+                    cache.record(mirror[1], checked)
+                except sqlite3.Error as e:
+                    bb.debug(1, "Unable to update sstate mirror probe cache %s: %s" % (cache.path, e))
+    finally:
+        if cache:
+            cache.close()
+
+    return found, fallback
@@ -1,4 +1,5 @@
 import bb.siggen
+import os
 
 def sstate_rundepfilter(siggen, fn, recipename, task, dep, depname, dataCache):
     # Return True if we should keep the dependency, False to drop it
@@ -247,10 +248,405 @@ bb.siggen.SignatureGeneratorOEBasic = SignatureGeneratorOEBasic
 bb.siggen.SignatureGeneratorOEBasicHash = SignatureGeneratorOEBasicHash
 
 
+class _DirEntry(object):
+    # The parts of os.DirEntry used here, for Python < 3.5
+    def __init__(self, dirname, name):
+        self.name = name
+        self.path = os.path.join(dirname, name)
+
+    def is_dir(self, follow_symlinks=True):
+        if not follow_symlinks and os.path.islink(self.path):
+            return False
+        return os.path.isdir(self.path)
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+    def stat(self):
+        return os.stat(self.path)
+
+def _scandir(path):
+    if hasattr(os, "scandir"):
+        return os.scandir(path)
+    return [_DirEntry(path, name) for name in os.listdir(path)]
+
+def parse_siginfo_name(fn):
+    """
+    Split the name of an sstate siginfo file into a (pn, taskname, hash)
+    tuple, or return None if it isn't one.
+    """
+    if not fn.startswith("sstate:") or not fn.endswith(".siginfo"):
+        return None
+    fields = fn.split(":")
+    if len(fields) < 3:
+        return None
+    hashval, _, task = fields[-1].partition("_")
+    if not task:
+        return None
+    return (fields[1], "do_" + task.split(".", 1)[0], hashval)
+
+class SiginfoIndex(object):
+    """
+    Persistent (sqlite) index of the siginfo files in an SSTATE_DIR, mapping
+    (pn, task, hash) to the path and modification time of each file.
+
+    New files are recorded by add() as sstate objects are written or
+    fetched. refresh() catches up with changes made by anyone else: the
+    directories of the sstate tree are stat'ed in parallel and only those
+    whose modification time changed are listed again, so the whole tree is
+    only walked when the index is first built.
+    """
+
+    VERSION = "1"
+
+    def __init__(self, sstate_dir, path):
+        self.sstate_dir = os.path.normpath(sstate_dir)
+        self.path = path
+        self._conn = None
+
+    def _connect(self):
+        import sqlite3
+
+        if self._conn is None:
+            bb.utils.mkdirhier(os.path.dirname(self.path))
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            with conn:
+                if meta.get("version") != self.VERSION or meta.get("sstate_dir") != self.sstate_dir:
+                    conn.execute("DROP TABLE IF EXISTS dirs")
+                    conn.execute("DROP TABLE IF EXISTS siginfo")
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.VERSION,))
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('sstate_dir', ?)", (self.sstate_dir,))
+                conn.execute("CREATE TABLE IF NOT EXISTS dirs (dir TEXT PRIMARY KEY, mtime INTEGER)")
+                conn.execute("CREATE TABLE IF NOT EXISTS siginfo (dir TEXT, name TEXT, pn TEXT, task TEXT, hash TEXT, mtime REAL, PRIMARY KEY (dir, name))")
+                conn.execute("CREATE INDEX IF NOT EXISTS siginfo_pn_task ON siginfo (pn, task)")
+                conn.execute("CREATE INDEX IF NOT EXISTS siginfo_hash ON siginfo (hash)")
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def add(self, fullpath):
+        """Record a single siginfo file"""
+        dirname, name = os.path.split(os.path.normpath(fullpath))
+        parsed = parse_siginfo_name(name)
+        if not parsed:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO siginfo VALUES (?, ?, ?, ?, ?, ?)",
+                         (dirname, name) + parsed + (os.stat(fullpath).st_mtime,))
+
+    @staticmethod
+    def _scan_dir(path):
+        # List one directory, returning its mtime, the siginfo files it
+        # contains and its subdirectories (or None if it no longer exists)
+        import time
+
+        siginfos = []
+        subdirs = []
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            for entry in _scandir(path):
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.endswith(".siginfo"):
+                    parsed = parse_siginfo_name(entry.name)
+                    if parsed:
+                        try:
+                            siginfos.append((entry.name,) + parsed + (entry.stat().st_mtime,))
+                        except OSError:
+                            continue
+        except OSError:
+            return path, None, [], []
+        # Don't trust an mtime which could still change within the same
+        # clock tick, this directory will simply be scanned again next time
+        if time.time() * 1e9 - mtime < 2e9:
+            mtime = -1
+        return path, mtime, siginfos, subdirs
+
+    def refresh(self, nproc=None, full=False):
+        """
+        Update the index for changes in the sstate tree made since the last
+        refresh (or rescan the whole tree if full is True).
+        """
+        import concurrent.futures
+        import multiprocessing
+
+        conn = self._connect()
+        known = {} if full else dict(conn.execute("SELECT dir, mtime FROM dirs"))
+        nproc = nproc or min(32, multiprocessing.cpu_count() * 4)
+
+        def stat_dir(path):
+            try:
+                return path, os.stat(path).st_mtime_ns
+            except OSError:
+                return path, None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nproc) as executor:
+            tocheck = [self.sstate_dir] if full or not known else list(known)
+            changed = []
+            removed = []
+            for path, mtime in executor.map(stat_dir, tocheck):
+                if mtime is None:
+                    removed.append(path)
+                elif known.get(path) != mtime:
+                    changed.append(path)
+
+            results = []
+            seen = set(known)
+            seen.update(changed)
+            while changed:
+                nextlevel = []
+                for result in executor.map(self._scan_dir, changed):
+                    results.append(result)
+                    for subdir in result[3]:
+                        # Existing subdirectories are checked separately
+                        if subdir not in seen:
+                            seen.add(subdir)
+                            nextlevel.append(subdir)
+                changed = nextlevel
+
+        with conn:
+            if full:
+                conn.execute("DELETE FROM dirs")
+                conn.execute("DELETE FROM siginfo")
+            # Subdirectories of a removed directory are known too, so they
+            # are found to be missing as well
+            for path in removed:
+                conn.execute("DELETE FROM dirs WHERE dir=?", (path,))
+                conn.execute("DELETE FROM siginfo WHERE dir=?", (path,))
+            for path, mtime, siginfos, _ in results:
+                conn.execute("DELETE FROM siginfo WHERE dir=?", (path,))
+                if mtime is None:
+                    conn.execute("DELETE FROM dirs WHERE dir=?", (path,))
+                    continue
+                conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)", (path, mtime))
+                conn.executemany("INSERT OR REPLACE INTO siginfo VALUES (?, ?, ?, ?, ?, ?)",
+                                 [(path,) + s for s in siginfos])
+
+    def rebuild(self, nproc=None):
+        """Rebuild the index from scratch with a parallel scan of the tree"""
+        self.refresh(nproc, full=True)
+
+    def find(self, pn, taskname, hashval=None):
+        """
+        Return a list of (path, mtime) tuples for the siginfo files of the
+        given recipe and task, optionally restricted to one hash.
+        """
+        conn = self._connect()
+        if hashval:
+            rows = conn.execute("SELECT dir, name, mtime FROM siginfo WHERE pn=? AND task=? AND hash=?",
+                                (pn, taskname, hashval))
+        else:
+            rows = conn.execute("SELECT dir, name, mtime FROM siginfo WHERE pn=? AND task=?",
+                                (pn, taskname))
+        return [(os.path.join(dirname, name), mtime) for dirname, name, mtime in rows]
+
+def siginfo_index(d):
+    """
+    Return a SiginfoIndex for SSTATE_DIR as configured by
+    SSTATE_SIGINFO_INDEX, or None if the index is disabled or unusable.
+    """
+    import sqlite3
+
+    path = d.getVar('SSTATE_SIGINFO_INDEX', True)
+    sstate_dir = d.getVar('SSTATE_DIR', True)
+    if not path or not sstate_dir:
+        return None
+    index = SiginfoIndex(sstate_dir, path)
+    try:
+        index._connect()
+    except (sqlite3.Error, OSError) as e:
+        bb.debug(1, "Unable to open sstate siginfo index %s: %s" % (path, e))
+        return None
+    return index
+
+def siginfo_index_add(fullpath, d):
+    """Record a newly written or fetched siginfo file in the index"""
+    import sqlite3
+
+    index = siginfo_index(d)
+    if not index:
+        return
+    try:
+        index.add(fullpath)
+    except (sqlite3.Error, OSError) as e:
+        bb.debug(1, "Unable to add %s to sstate siginfo index: %s" % (fullpath, e))
+    finally:
+        index.close()
+
+def _list_sstate_dir(path):
+    # List the files in one directory of the sstate tree, returning its
+    # mtime (-1 if it could still change within the same clock tick, None
+    # if the directory doesn't exist) and the set of file names
+    import time
+
+    names = set()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        for entry in _scandir(path):
+            try:
+                # Follows symlinks, like os.path.exists() would
+                if entry.is_file():
+                    names.add(entry.name)
+            except OSError:
+                continue
+    except OSError:
+        return path, None, names
+    if time.time() * 1e9 - mtime < 2e9:
+        mtime = -1
+    return path, mtime, names
+
+def _scan_threads(count):
+    import multiprocessing
+    return max(1, min(count, 32, multiprocessing.cpu_count() * 4))
+
+class SstateObjectManifest(object):
+    """
+    Persistent (sqlite) record of the files in the directories of an sstate
+    tree. A directory is only listed again when its modification time has
+    changed, so checking which objects exist costs one stat per directory
+    instead of one per object.
+    """
+
+    VERSION = "1"
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+
+    def _connect(self):
+        import sqlite3
+
+        if self._conn is None:
+            bb.utils.mkdirhier(os.path.dirname(self.path))
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            with conn:
+                if meta.get("version") != self.VERSION:
+                    conn.execute("DROP TABLE IF EXISTS dirs")
+                    conn.execute("DROP TABLE IF EXISTS objects")
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.VERSION,))
+                conn.execute("CREATE TABLE IF NOT EXISTS dirs (dir TEXT PRIMARY KEY, mtime INTEGER)")
+                conn.execute("CREATE TABLE IF NOT EXISTS objects (dir TEXT, name TEXT, PRIMARY KEY (dir, name))")
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def listdirs(self, dirs, nproc=None):
+        """
+        Return a dict mapping each of dirs to the set of files it contains,
+        listing only the directories which changed since the last call.
+        """
+        import concurrent.futures
+
+        conn = self._connect()
+        known = dict(conn.execute("SELECT dir, mtime FROM dirs"))
+
+        def stat_dir(path):
+            try:
+                return path, os.stat(path).st_mtime_ns
+            except OSError:
+                return path, None
+
+        listings = {}
+        changed = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nproc or _scan_threads(len(dirs))) as executor:
+            for path, mtime in executor.map(stat_dir, dirs):
+                if mtime is None:
+                    listings[path] = set()
+                elif mtime != -1 and known.get(path) == mtime:
+                    listings[path] = set(n for (n,) in conn.execute("SELECT name FROM objects WHERE dir=?", (path,)))
+                else:
+                    changed.append(path)
+            results = list(executor.map(_list_sstate_dir, changed))
+
+        with conn:
+            for path, mtime, names in results:
+                listings[path] = names
+                conn.execute("DELETE FROM objects WHERE dir=?", (path,))
+                if mtime is None:
+                    conn.execute("DELETE FROM dirs WHERE dir=?", (path,))
+                    continue
+                conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)", (path, mtime))
+                conn.executemany("INSERT INTO objects VALUES (?, ?)", [(path, n) for n in names])
+        return listings
+
+def sstate_objects_exist(paths, d):
+    """
+    Return the set of the given paths in the sstate tree which exist. The
+    directories involved are listed in parallel, each of them only once,
+    going through the persistent manifest SSTATE_OBJECT_MANIFEST if set.
+    """
+    import sqlite3
+    import concurrent.futures
+
+    bydir = {}
+    for path in paths:
+        dirname, name = os.path.split(path)
+        bydir.setdefault(dirname, set()).add(name)
+    dirs = list(bydir)
+
+    listings = None
+    manifest = d.getVar('SSTATE_OBJECT_MANIFEST', True) if d else None
+    if manifest:
+        m = SstateObjectManifest(manifest)
+        try:
+            listings = m.listdirs(dirs)
+        except (sqlite3.Error, OSError) as e:
+            bb.debug(1, "Unable to use sstate object manifest %s: %s" % (manifest, e))
+        finally:
+            m.close()
+    if listings is None:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=_scan_threads(len(dirs))) as executor:
+            listings = dict((path, names) for path, mtime, names in executor.map(_list_sstate_dir, dirs))
+
+    found = set()
+    for dirname, names in bydir.items():
+        for name in names & listings[dirname]:
+            found.add(os.path.join(dirname, name))
+    return found
+
+def _sstate_siginfo_files(index, sstatedir, filespec, pn, taskname, hashval):
+    """
+    Return a dict mapping the siginfo files under sstatedir matching
+    filespec to their modification time. They are looked up in index, which
+    must be up to date, if given, and found by walking sstatedir otherwise.
+    The paths are normalised, like those in the index.
+    """
+    import fnmatch
+
+    filespec = os.path.normpath(filespec)
+    if index:
+        candidates = [fullpath for fullpath, mtime in index.find(pn, taskname, hashval if hashval != '*' else None)]
+    else:
+        candidates = [os.path.join(root, fn) for root, dirs, files in os.walk(os.path.normpath(sstatedir))
+                      for fn in files]
+
+    found = {}
+    for fullpath in candidates:
+        if fnmatch.fnmatch(fullpath, filespec):
+            # The mtime isn't taken from the index, installing an sstate
+            # object touches its siginfo file without changing the directory
+            try:
+                found[fullpath] = os.stat(fullpath).st_mtime
+            except OSError:
+                continue
+    return found
+
 def find_siginfo(pn, taskname, taskhashlist, d):
     """ Find signature data files for comparison purposes """
 
-    import fnmatch
     import glob
 
     if taskhashlist:
@@ -301,6 +697,14 @@ def find_siginfo(pn, taskname, taskhashlist, d):
         # That didn't work, look in sstate-cache
         hashes = taskhashlist or ['*']
         localdata = bb.data.createCopy(d)
+        index = siginfo_index(d)
+        if index:
+            import sqlite3
+            try:
+                index.refresh()
+            except (sqlite3.Error, OSError) as e:
+                bb.debug(1, "Unable to refresh sstate siginfo index %s: %s" % (index.path, e))
+                index = None
         for hashval in hashes:
             localdata.setVar('PACKAGE_ARCH', '*')
             localdata.setVar('TARGET_VENDOR', '*')
@@ -322,17 +726,11 @@ def find_siginfo(pn, taskname, taskhashlist, d):
             else:
                 sstatedir = d.getVar('SSTATE_DIR', True)
 
-            for root, dirs, files in os.walk(sstatedir):
-                for fn in files:
-                    fullpath = os.path.join(root, fn)
-                    if fnmatch.fnmatch(fullpath, filespec):
-                        if taskhashlist:
-                            hashfiles[hashval] = fullpath
-                        else:
-                            try:
-                                filedates[fullpath] = os.stat(fullpath).st_mtime
-                            except:
-                                continue
+            for fullpath, mtime in _sstate_siginfo_files(index, sstatedir, filespec, pn, taskname, hashval).items():
+                if taskhashlist:
+                    hashfiles[hashval] = fullpath
+                else:
+                    filedates[fullpath] = mtime
 
     if taskhashlist:
         return hashfiles
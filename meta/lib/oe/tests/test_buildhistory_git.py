@@ -0,0 +1,167 @@
+import unittest
+import binascii
+import os
+import shutil
+import subprocess
+import tempfile
+import oe.buildhistory_git
+
+def git(repodir, *args):
+    return subprocess.check_output(("git",) + args, cwd=repodir).decode()
+
+def message(item):
+    return "%s: Build 20161018 of poky 2.2 for machine qemux86 on host\n\ncmd: bitbake world\n\nresult: succeeded\n\nmetadata revisions:\nmeta = master:0123\n" % (item or "No changes")
+
+@unittest.skipUnless(shutil.which("git"), "git is not available")
+class TestBuildhistoryGit(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_buildhistory_git")
+        self.repos = []
+        for name in ("engine", "shell"):
+            repodir = os.path.join(self.tmpdir, name)
+            os.makedirs(repodir)
+            git(repodir, "init", "-q")
+            git(repodir, "config", "user.email", "buildhistory@oe")
+            git(repodir, "config", "user.name", "OpenEmbedded")
+            with open(os.path.join(repodir, ".git", "info", "exclude"), "a") as f:
+                f.write("/.buildhistory-changes\n")
+            self.repos.append(repodir)
+        self.engine, self.shell = self.repos
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def journal(self, repodir):
+        return os.path.join(repodir, ".buildhistory-changes")
+
+    def write(self, path, content, record=True):
+        for repodir in self.repos:
+            fn = os.path.join(repodir, path)
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            with open(fn, "w") as f:
+                f.write(content)
+            if record:
+                oe.buildhistory_git.record_change(self.journal(repodir), os.path.dirname(fn))
+
+    def remove(self, path):
+        for repodir in self.repos:
+            fn = os.path.join(repodir, path)
+            if os.path.isdir(fn):
+                shutil.rmtree(fn)
+            else:
+                os.unlink(fn)
+            oe.buildhistory_git.record_change(self.journal(repodir), os.path.dirname(fn))
+
+    def shell_commit(self):
+        # What buildhistory_commit did with git status, add and commit. The
+        # entries are staged one at a time rather than committed with
+        # "git commit <entry>", which fails when a file became a directory.
+        repodir = self.shell
+        status = [line for line in git(repodir, "status", "--porcelain").splitlines()
+                  if not line.endswith(" metadata-revs")]
+        if status:
+            for entry in sorted(set(line[3:].split("/")[0] for line in status)):
+                git(repodir, "add", "-A", "--", entry, "metadata-revs")
+                git(repodir, "commit", "-q", "-m", message(entry), "--author", "buildhistory <buildhistory@poky>")
+        else:
+            git(repodir, "add", "metadata-revs")
+            git(repodir, "commit", "-q", "--allow-empty", "-m", message(None), "--author", "buildhistory <buildhistory@poky>")
+
+    def build(self, metadata="meta = master:0123\n"):
+        self.write("metadata-revs", metadata, record=False)
+        self.shell_commit()
+        return oe.buildhistory_git.commit_changes(self.engine, self.journal(self.engine),
+                                                  "buildhistory <buildhistory@poky>", message)
+
+    def assertSameHistory(self):
+        self.assertEqual(git(self.engine, "log", "--format=%T%n%an <%ae>%n%B%x00"),
+                         git(self.shell, "log", "--format=%T%n%an <%ae>%n%B%x00"))
+        self.assertEqual(git(self.engine, "status", "--porcelain"), "")
+        # The index is up to date, including the stat data and cache-tree
+        self.assertEqual(git(self.engine, "diff-files"), "")
+        self.assertEqual(git(self.engine, "diff-index", "--cached", "HEAD"), "")
+        self.assertEqual(git(self.engine, "write-tree").strip(), git(self.engine, "rev-parse", "HEAD^{tree}").strip())
+        git(self.engine, "fsck", "--strict", "--no-progress")
+
+    def test_commits(self):
+        self.write("packages/i586-poky-linux/foo/latest", "PV = 1.0\n")
+        self.write("packages/i586-poky-linux/foo/foo/latest", "PKGSIZE = 10\n")
+        self.write("images/qemux86/glibc/core-image-minimal/installed-packages.txt", "foo_1.0-r0_i586.ipk\n")
+        self.write("sdk/poky-glibc/core-image-minimal/sdk-info.txt", "SDKSIZE = 1\n")
+        self.assertEqual(self.build(), ["images", "packages", "sdk"])
+        self.assertSameHistory()
+
+        # Only the packages changed, with a file replaced by a directory
+        self.write("packages/i586-poky-linux/foo/latest", "PV = 1.1\n")
+        self.remove("packages/i586-poky-linux/foo/foo/latest")
+        self.write("packages/i586-poky-linux/foo/foo/latest/x", "y\n")
+        self.write("packages/i586-poky-linux/bar/latest", "PV = 2.0\n")
+        self.assertEqual(self.build("meta = master:4567\n"), ["packages"])
+        self.assertSameHistory()
+
+        # Rewritten, but unchanged
+        self.write("images/qemux86/glibc/core-image-minimal/installed-packages.txt", "foo_1.0-r0_i586.ipk\n")
+        self.assertEqual(self.build("meta = master:4567\n"), [])
+        self.assertSameHistory()
+        self.assertEqual(git(self.engine, "log", "-1", "--format=%s"), "No changes: Build 20161018 of poky 2.2 for machine qemux86 on host\n")
+
+        self.remove("sdk/poky-glibc")
+        self.assertEqual(self.build(), ["sdk"])
+        self.assertSameHistory()
+
+    def test_journal(self):
+        self.write("packages/a/latest", "1\n")
+        self.write("packages/b/latest", "1\n")
+        self.build()
+
+        # Only the recorded directories are looked at
+        self.write("packages/a/latest", "2\n")
+        self.write("packages/b/latest", "2\n", record=False)
+        self.assertEqual(self.build(), ["packages"])
+        self.assertEqual(git(self.engine, "show", "HEAD:packages/b/latest"), "1\n")
+        self.assertEqual(git(self.engine, "show", "HEAD:packages/a/latest"), "2\n")
+        with open(self.journal(self.engine)) as f:
+            self.assertEqual(f.read(), "")
+
+        # Unless the journal asks for everything
+        oe.buildhistory_git.request_full_scan(self.journal(self.engine))
+        self.assertEqual(oe.buildhistory_git.commit_changes(self.engine, self.journal(self.engine),
+                                                            "buildhistory <buildhistory@poky>", message), ["packages"])
+        self.assertEqual(git(self.engine, "show", "HEAD:packages/b/latest"), "2\n")
+        self.assertNotIn(".buildhistory-changes", git(self.engine, "ls-files"))
+
+    def test_index_mismatch(self):
+        self.write("packages/a/latest", "1\n")
+        self.build()
+        os.unlink(os.path.join(self.engine, ".git", "index"))
+
+        # Without an index everything is compared with HEAD
+        self.write("packages/a/latest", "2\n")
+        self.assertEqual(self.build(), ["packages"])
+        self.assertSameHistory()
+
+    def test_cache_tree(self):
+        self.write("packages/a/latest", "1\n")
+        self.write("images/b/info", "1\n")
+        self.build()
+        entries, trees = oe.buildhistory_git.read_index(os.path.join(self.engine, ".git", "index"))
+        self.assertEqual(sorted(entries), [b"images/b/info", b"metadata-revs", b"packages/a/latest"])
+        for path, sha in trees.items():
+            self.assertEqual(binascii.hexlify(sha).decode(), git(self.engine, "rev-parse", "HEAD:%s" % path.decode()).strip())
+        self.assertEqual(len(trees), 5)
+
+    def test_buildhistory_diff(self):
+        try:
+            import git as gitpython
+        except ImportError:
+            self.skipTest("GitPython is not available")
+        import oe.buildhistory_analysis
+
+        self.write("packages/i586-poky-linux/foo/foo/latest", "PV = 1.0\nPR = r0\nRDEPENDS = bar\nPKGSIZE = 1000\nFILELIST = /usr/bin/foo\n")
+        self.build()
+        self.write("packages/i586-poky-linux/foo/foo/latest", "PV = 1.0\nPR = r1\nRDEPENDS = bar baz\nPKGSIZE = 1000\nFILELIST = /usr/bin/foo\n")
+        self.build()
+        changes = [sorted(str(c) for c in oe.buildhistory_analysis.process_changes(repodir, "HEAD^"))
+                   for repodir in self.repos]
+        self.assertEqual(changes[0], changes[1])
+        self.assertTrue(any("RDEPENDS" in c and "baz" in c for c in changes[0]))
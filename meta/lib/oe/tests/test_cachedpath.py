@@ -0,0 +1,78 @@
+import unittest
+import os
+import shutil
+import stat
+import tempfile
+import unittest.mock
+import oe.cachedpath
+
+class TestCachedPath(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_cachedpath")
+        os.makedirs(os.path.join(self.tmpdir, "usr", "lib", ".debug"))
+        with open(os.path.join(self.tmpdir, "usr", "lib", "libfoo.so.1"), "w") as f:
+            f.write("foo")
+        os.symlink("libfoo.so.1", os.path.join(self.tmpdir, "usr", "lib", "libfoo.so"))
+        os.symlink("lib", os.path.join(self.tmpdir, "usr", "lib64"))
+        os.symlink("missing", os.path.join(self.tmpdir, "usr", "broken"))
+        self.paths = [os.path.join(self.tmpdir, p) for p in
+                      ("usr", "usr/lib", "usr/lib/.debug", "usr/lib/libfoo.so.1", "usr/lib/libfoo.so",
+                       "usr/lib64", "usr/broken", "usr/missing", "usr/lib/../lib/./libfoo.so.1")]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check(self, cpath):
+        for path in self.paths:
+            self.assertEqual(cpath.isfile(path), os.path.isfile(path), path)
+            self.assertEqual(cpath.isdir(path), os.path.isdir(path), path)
+            self.assertEqual(cpath.islink(path), os.path.islink(path), path)
+            self.assertEqual(cpath.exists(path), os.path.exists(path), path)
+            self.assertEqual(cpath.lexists(path), os.path.lexists(path), path)
+            if os.path.lexists(path):
+                st = os.lstat(path)
+                self.assertEqual((cpath.lstat(path).st_mode, cpath.lstat(path).st_ino), (st.st_mode, st.st_ino))
+                self.assertEqual(cpath.lstat(path)[stat.ST_MODE], st[stat.ST_MODE])
+            else:
+                self.assertFalse(cpath.lstat(path))
+            if os.path.exists(path):
+                st = os.stat(path)
+                self.assertEqual((cpath.stat(path).st_dev, cpath.stat(path).st_size), (st.st_dev, st.st_size))
+            else:
+                self.assertFalse(cpath.stat(path))
+
+    def test_stat(self):
+        self.check(oe.cachedpath.CachedPath())
+
+    def test_walk(self):
+        cpath = oe.cachedpath.CachedPath()
+        self.assertEqual(list(cpath.walk(self.tmpdir)), list(os.walk(self.tmpdir)))
+        self.assertEqual(list(cpath.walk(self.tmpdir, followlinks=True)), list(os.walk(self.tmpdir, followlinks=True)))
+        self.check(cpath)
+
+    def test_walk_listdir(self):
+        # Python 3.4 has no os.scandir()
+        expected = list(os.walk(self.tmpdir))
+        with unittest.mock.patch.dict(os.__dict__):
+            del os.scandir
+            cpath = oe.cachedpath.CachedPath()
+            self.assertEqual(list(cpath.walk(self.tmpdir)), expected)
+        self.check(cpath)
+
+    def test_bounded(self):
+        cpath = oe.cachedpath.CachedPath(maxsize=4)
+        list(cpath.walk(self.tmpdir))
+        self.assertLessEqual(len(cpath.cache), 4)
+        self.check(cpath)
+        self.assertLessEqual(len(cpath.cache), 4)
+
+    def test_invalidate(self):
+        cpath = oe.cachedpath.CachedPath()
+        list(cpath.walk(self.tmpdir))
+        self.check(cpath)
+        shutil.rmtree(os.path.join(self.tmpdir, "usr", "lib"))
+        os.makedirs(os.path.join(self.tmpdir, "usr", "lib", "libfoo.so.1"))
+        lib = os.path.join(self.tmpdir, "usr", "lib")
+        cpath.invalidate(lib)
+        self.assertFalse([p for p in cpath.cache if p == lib or p.startswith(lib + "/")])
+        self.check(cpath)
@@ -19,3 +19,188 @@ class TestElf(unittest.TestCase):
         self.assertEqual(oe.qa.elf_machine_to_string(0x00), "Unknown (0)")
         self.assertEqual(oe.qa.elf_machine_to_string(0xDEADBEEF), "Unknown (3735928559)")
         self.assertEqual(oe.qa.elf_machine_to_string("foobar"), "Unknown ('foobar')")
+
+def make_elf(bits, sex, dynamic, strtab, machine=0x3E, flags=0):
+    """
+    Return a minimal ELF shared library with one loadable segment holding
+    the dynamic section (a list of (tag, value) pairs) and the string table
+    strtab, mapped at 0x10000.
+    """
+    import struct
+    ehsize, phentsize = (52, 32) if bits == 32 else (64, 56)
+    phoff = ehsize
+    dynoff = phoff + 2 * phentsize
+    entfmt = sex + ("iI" if bits == 32 else "qQ")
+    dynsize = struct.calcsize(entfmt) * (len(dynamic) + 1)
+    stroff = dynoff + dynsize
+    vaddr = 0x10000
+    dynamic = [(tag, vaddr + stroff if tag == oe.qa.ELFFile.DT_STRTAB else value) for tag, value in dynamic]
+    size = stroff + len(strtab)
+
+    ident = b"\x7fELF" + bytes([1 if bits == 32 else 2, 1 if sex == "<" else 2, 1]) + bytes(9)
+    if bits == 32:
+        header = struct.pack(sex + "HHIIIIIHHHHHH", 3, machine, 1, 0, phoff, 0, flags, ehsize, phentsize, 2, 0, 0, 0)
+        phdrs = struct.pack(sex + "IIIIIIII", 1, 0, vaddr, vaddr, size, size, 5, 0x1000)
+        phdrs += struct.pack(sex + "IIIIIIII", 2, dynoff, vaddr + dynoff, vaddr + dynoff, dynsize, dynsize, 6, 4)
+    else:
+        header = struct.pack(sex + "HHIQQQIHHHHHH", 3, machine, 1, 0, phoff, 0, flags, ehsize, phentsize, 2, 0, 0, 0)
+        phdrs = struct.pack(sex + "IIQQQQQQ", 1, 5, 0, vaddr, vaddr, size, size, 0x1000)
+        phdrs += struct.pack(sex + "IIQQQQQQ", 2, 6, dynoff, vaddr + dynoff, vaddr + dynoff, dynsize, dynsize, 8)
+    data = b"".join(struct.pack(entfmt, tag, value) for tag, value in dynamic + [(0, 0)])
+    return ident + header + phdrs + data + strtab
+
+class TestDynamicInfo(unittest.TestCase):
+    strtab = b"\0libc.so.6\0libfoo.so.1\0/opt/lib:$ORIGIN\0/run\0libm.so.6\0"
+
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_elf")
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        import os
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def dynamic(self):
+        E = oe.qa.ELFFile
+        return [(E.DT_NEEDED, 1), (E.DT_NEEDED, 45), (E.DT_SONAME, 11), (E.DT_RPATH, 23),
+                (E.DT_RUNPATH, 40), (E.DT_TEXTREL, 0), (E.DT_STRTAB, 0), (E.DT_STRSZ, len(self.strtab))]
+
+    def test_dynamic_info(self):
+        for bits in (32, 64):
+            for sex in ("<", ">"):
+                elf = oe.qa.ELFFile(self.write("libfoo.so.1", make_elf(bits, sex, self.dynamic(), self.strtab)))
+                elf.open()
+                info = elf.dynamicInfo()
+                self.assertEqual(info.needed, ["libc.so.6", "libm.so.6"])
+                self.assertEqual(info.soname, ["libfoo.so.1"])
+                self.assertEqual(info.rpath, ["/opt/lib:$ORIGIN"])
+                self.assertEqual(info.runpath, ["/run"])
+                self.assertIn(oe.qa.ELFFile.DT_TEXTREL, info.tags)
+                self.assertNotIn(oe.qa.ELFFile.DT_GNU_HASH, info.tags)
+
+    def test_no_strtab(self):
+        dynamic = [entry for entry in self.dynamic() if entry[0] != oe.qa.ELFFile.DT_STRTAB]
+        elf = oe.qa.ELFFile(self.write("broken.so", make_elf(64, "<", dynamic, self.strtab)))
+        elf.open()
+        self.assertRaises(oe.qa.NotELFFileError, elf.dynamicInfo)
+
+    def test_mips_arch(self):
+        elf = oe.qa.ELFFile(self.write("mips", make_elf(32, ">", [], b"", machine=8, flags=0x50001007)))
+        elf.open()
+        self.assertTrue(elf.isMipsArch(oe.qa.ELFFile.E_MIPS_ARCH_32, oe.qa.ELFFile.E_MIPS_ARCH_64))
+        self.assertEqual(elf.dynamicInfo().needed, [])
+
+    def test_dynamic_info_files(self):
+        import os
+        lib = self.write("libfoo.so.1", make_elf(64, "<", self.dynamic(), self.strtab))
+        script = self.write("script", b"#!/bin/sh\n")
+        cache = oe.qa.QACache(os.path.join(self.tmpdir, "cache"), "objdump")
+        for qacache in (None, cache):
+            info = oe.qa.dynamic_info([lib, script], qacache, 2)
+            self.assertEqual(info[lib].soname, ["libfoo.so.1"])
+            self.assertIsNone(info[script])
+        # The dynamic section is kept in the cache
+        cache.save()
+        cache = oe.qa.QACache(os.path.join(self.tmpdir, "cache"), "objdump")
+        elf = cache.elf(lib)
+        self.assertIsNotNone(elf.dynamic_info)
+        self.assertEqual(elf.dynamicInfo().needed, ["libc.so.6", "libm.so.6"])
+
+class TestQACache(unittest.TestCase):
+    def setUp(self):
+        import os, tempfile
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_qacache")
+        self.cachefn = os.path.join(self.tmpdir, "cache", "qa.cache")
+        self.lib = os.path.join(self.tmpdir, "libfoo.so.1")
+        self.write(self.lib, make_elf(64, "<", [], b""))
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, path, data):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def populate(self):
+        """
+        Record a fake objdump result for the library and write the cache out.
+        """
+        cache = oe.qa.QACache(self.cachefn, "objdump")
+        elf = cache.elf(self.lib)
+        self.assertEqual(elf.objdump_output, {})
+        elf.objdump_output["-p"] = "NEEDED libc.so.6\n"
+        cache.save()
+
+    def cached(self, path=None, objdump="objdump"):
+        """
+        Return whether a fresh QACache answers path from the saved cache.
+        """
+        elf = oe.qa.QACache(self.cachefn, objdump).elf(path or self.lib)
+        self.assertIsNotNone(elf)
+        return elf.objdump_output == {"-p": "NEEDED libc.so.6\n"}
+
+    def test_persistence(self):
+        self.populate()
+        self.assertTrue(self.cached())
+
+    def test_hardlink(self):
+        import os
+        self.populate()
+        link = os.path.join(self.tmpdir, "libfoo.so")
+        os.link(self.lib, link)
+        self.assertTrue(self.cached(link))
+
+    def test_mtime(self):
+        import os
+        self.populate()
+        st = os.stat(self.lib)
+        os.utime(self.lib, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        self.assertFalse(self.cached())
+
+    def test_size(self):
+        import os
+        self.populate()
+        st = os.stat(self.lib)
+        with open(self.lib, "ab") as f:
+            f.write(b"\0")
+        os.utime(self.lib, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertEqual(os.stat(self.lib).st_ino, st.st_ino)
+        self.assertFalse(self.cached())
+
+    def test_inode(self):
+        import os, shutil
+        self.populate()
+        st = os.stat(self.lib)
+        # Keep the old inode alive so that the new file can't reuse it
+        os.link(self.lib, self.lib + ".old")
+        shutil.copy2(self.lib, self.lib + ".new")
+        os.rename(self.lib + ".new", self.lib)
+        new = os.stat(self.lib)
+        self.assertEqual((new.st_mtime_ns, new.st_size), (st.st_mtime_ns, st.st_size))
+        self.assertNotEqual(new.st_ino, st.st_ino)
+        self.assertFalse(self.cached())
+
+    def test_objdump(self):
+        self.populate()
+        self.assertFalse(self.cached(objdump="aarch64-poky-linux-objdump"))
+
+    def test_not_elf(self):
+        import os
+        script = os.path.join(self.tmpdir, "script")
+        self.write(script, b"#!/bin/sh\n")
+        cache = oe.qa.QACache(self.cachefn, "objdump")
+        self.assertIsNone(cache.elf(script))
+        cache.save()
+        # The negative result is kept in the cache too
+        st = os.stat(script)
+        cache = oe.qa.QACache(self.cachefn, "objdump")
+        self.assertEqual(cache.files[(st.st_ino, st.st_mtime_ns, st.st_size)], (None, {}, None))
+        self.assertIsNone(cache.elf(script))
@@ -0,0 +1,339 @@
+import unittest
+import oe, oe.package
+import tempfile
+import os
+import shutil
+
+class TestFileTranslate(unittest.TestCase):
+    def test_translate(self):
+        self.assertEqual(oe.package.file_translate("/usr/bin/foo"), "/usr/bin/foo")
+        self.assertEqual(oe.package.file_translate("/a_b [c]\t@d"),
+                         "/a@underscore@b@space@@openbrace@c@closebrace@@tab@@at@d")
+
+class TestShlibDir(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_shlibs")
+        self.write_list("foo", ["libfoo.so.1:/usr/lib:1.0"])
+        self.write_list("bar", ["libbar.so.2:/usr/lib:2.0", "libbaz.so.3:/lib:2.0"])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_list(self, pkg, lines):
+        with open(os.path.join(self.tmpdir, pkg + ".list"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def test_read(self):
+        expected = {
+            "foo": [("libfoo.so.1", "/usr/lib", "1.0")],
+            "bar": [("libbar.so.2", "/usr/lib", "2.0"), ("libbaz.so.3", "/lib", "2.0")],
+        }
+        self.assertEqual(oe.package.read_shlib_dir(self.tmpdir), expected)
+        # Second read is answered from the cache
+        self.assertEqual(oe.package.read_shlib_dir(self.tmpdir), expected)
+
+    def test_update(self):
+        oe.package.read_shlib_dir(self.tmpdir)
+        os.unlink(os.path.join(self.tmpdir, "foo.list"))
+        self.write_list("bar", ["libbar.so.3:/usr/lib:3.0"])
+        self.assertEqual(oe.package.read_shlib_dir(self.tmpdir),
+                         {"bar": [("libbar.so.3", "/usr/lib", "3.0")]})
+
+class TestIsElf(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_iself")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_not_elf(self):
+        fn = os.path.join(self.tmpdir, "script")
+        with open(fn, "w") as f:
+            f.write("#!/bin/sh\n")
+        self.assertEqual(oe.package.is_elf(fn), 0)
+
+    def test_elf(self):
+        import sys
+        path = os.path.realpath(sys.executable)
+        types = oe.package.is_elf_files([path, self.tmpdir])
+        self.assertTrue(types[path] & 1)
+        self.assertEqual(types[self.tmpdir], 0)
+
+@unittest.skipUnless(shutil.which("gcc") and shutil.which("objcopy"), "gcc and objcopy are needed")
+class TestSplitDebugInfo(unittest.TestCase):
+    def setUp(self):
+        import subprocess
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_splitdebuginfo")
+        src = os.path.join(self.tmpdir, "foo.c")
+        with open(src, "w") as f:
+            f.write("int main(void) { return 0; }\n")
+        self.file = os.path.join(self.tmpdir, "usr/bin/foo")
+        os.makedirs(os.path.dirname(self.file))
+        subprocess.check_call(["gcc", "-g", "-o", self.file, src])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_split(self):
+        import oe.qa
+        debugfile = os.path.join(self.tmpdir, "usr/bin/.debug/foo")
+        sourcefile = os.path.join(self.tmpdir, "debugsources.list")
+        errors = oe.package.splitdebuginfo_files([(self.file, debugfile)], "", sourcefile, "objcopy", "debugedit")
+        self.assertEqual(errors, [])
+        elf = oe.qa.ELFFile(debugfile)
+        elf.open()
+        self.assertIn(".debug_info", elf.sectionNames())
+        elf = oe.qa.ELFFile(self.file)
+        elf.open()
+        self.assertIn(".gnu_debuglink", elf.sectionNames())
+
+    def test_error(self):
+        debugfile = os.path.join(self.tmpdir, "usr/bin/.debug/foo")
+        sourcefile = os.path.join(self.tmpdir, "debugsources.list")
+        errors = oe.package.splitdebuginfo_files([(self.file, debugfile)], "", sourcefile, "false", "debugedit")
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith("objcopy failed with exit code 1"))
+
+@unittest.skipUnless(shutil.which("gcc") and shutil.which("strip"), "gcc and strip are needed")
+class TestStripCache(unittest.TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_stripcache")
+        self.cachedir = os.path.join(self.tmpdir, "cache")
+        # A private strip binary whose identity the test can change
+        self.strip = os.path.join(self.tmpdir, "bin", "strip")
+        os.makedirs(os.path.dirname(self.strip))
+        shutil.copy2(shutil.which("strip"), self.strip)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def build(self):
+        import subprocess
+        src = os.path.join(self.tmpdir, "foo.c")
+        with open(src, "w") as f:
+            f.write("int main(void) { return 0; }\n")
+        fn = os.path.join(self.tmpdir, "foo")
+        subprocess.check_call(["gcc", "-g", "-o", fn, src])
+        return fn
+
+    def cached(self):
+        return sorted(f for root, dirs, files in os.walk(self.cachedir) for f in files)
+
+    def strip_file(self):
+        fn = self.build()
+        oe.package.runstrip_files([(fn, oe.package.is_elf(fn), self.strip)], self.cachedir)
+        self.assertTrue(oe.package.is_elf(fn) & 2)
+
+    def test_strip_identity(self):
+        self.strip_file()
+        self.assertEqual(len(self.cached()), 1)
+        # Same file, same strip: answered from the cache
+        self.strip_file()
+        self.assertEqual(len(self.cached()), 1)
+
+        # An upgraded strip doesn't reuse the results of the old one
+        st = os.stat(self.strip)
+        os.utime(self.strip, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.strip_file()
+        self.assertEqual(len(self.cached()), 2)
+
+    def test_missing_strip(self):
+        self.assertIsNone(oe.package._strip_identity(os.path.join(self.tmpdir, "nonexistent-strip")))
+
+class TestFileDeps(unittest.TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_filedeps")
+        self.cachedir = os.path.join(self.tmpdir, "cache")
+        self.pkgdest = os.path.join(self.tmpdir, "packages-split")
+        self.log = os.path.join(self.tmpdir, "rpmdeps.log")
+        # A stand-in for rpmdeps --alldeps that prints the same kind of
+        # output and logs the files it was asked to scan
+        self.rpmdeps = os.path.join(self.tmpdir, "bin", "rpmdeps")
+        os.makedirs(os.path.dirname(self.rpmdeps))
+        with open(self.rpmdeps, "w") as f:
+            f.write("""#!/bin/sh
+for f in "$@"; do
+    case "$f" in
+    --*) continue ;;
+    esac
+    echo "$f" >> %s
+    case "$f" in
+    *.so.*)
+        echo "$f Provides: libfoo.so.1()(64bit)"
+        echo "$f Requires: libc.so.6(GLIBC_2.4)(64bit)"
+        echo "$f Requires: rpmlib(PayloadFilesHavePrefix) <= 4.0-1"
+        ;;
+    *.sh)
+        echo "$f Requires: /bin/sh"
+        ;;
+    *.pc)
+        echo "$f Provides: pkgconfig(foo) = 1.0"
+        echo "$f Requires: python"
+        ;;
+    esac
+done
+""" % self.log)
+        os.chmod(self.rpmdeps, 0o755)
+
+        self.files = []
+        for pkg, path in [("foo", "/usr/lib/libfoo.so.1"),
+                          ("foo", "/usr/bin/run_foo.sh"),
+                          ("foo", "/etc/foo.conf"),
+                          ("foo-dev", "/usr/lib/pkgconfig/foo.pc")]:
+            fn = self.pkgdest + "/" + pkg + path
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            with open(fn, "w") as f:
+                f.write(path + "\n")
+            self.files.append((pkg, fn))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def filedeps(self, cachedir=None, batchsize=500):
+        open(self.log, "w").close()
+        deps = oe.package.filedeps(self.files, self.rpmdeps + " --alldeps", self.pkgdest,
+                                   cachedir, batchsize)
+        with open(self.log) as f:
+            scanned = sorted(os.path.relpath(l.strip(), self.pkgdest) for l in f)
+        return deps, scanned
+
+    expected = [
+        ("foo", {"/usr/lib/libfoo.so.1": ["libfoo.so.1()(64bit)"]},
+                {"/usr/lib/libfoo.so.1": ["libc.so.6(GLIBC_2.4)(64bit)"],
+                 "/usr/bin/run@underscore@foo.sh": ["/bin/sh"]}),
+        ("foo-dev", {"/usr/lib/pkgconfig/foo.pc": ["pkgconfig(foo) (= 1.0)"]}, {}),
+    ]
+
+    def test_parse(self):
+        deps, scanned = self.filedeps()
+        self.assertEqual(deps, self.expected)
+        self.assertEqual(len(scanned), 4)
+
+    def test_batches(self):
+        deps, scanned = self.filedeps(batchsize=1)
+        self.assertEqual(deps, self.expected)
+        self.assertEqual(len(scanned), 4)
+
+    def test_cache(self):
+        deps, scanned = self.filedeps(self.cachedir)
+        self.assertEqual(deps, self.expected)
+        self.assertEqual(len(scanned), 4)
+
+        # Everything is answered from the cache, including the file
+        # without any dependencies
+        deps, scanned = self.filedeps(self.cachedir)
+        self.assertEqual(deps, self.expected)
+        self.assertEqual(scanned, [])
+
+        # Only a file whose contents changed is scanned again
+        with open(self.files[1][1], "a") as f:
+            f.write("exit 0\n")
+        deps, scanned = self.filedeps(self.cachedir)
+        self.assertEqual(deps, self.expected)
+        self.assertEqual(scanned, ["foo/usr/bin/run_foo.sh"])
+
+        # A file moved within its package is a different cache entry
+        fn = self.files[2][1]
+        os.rename(fn, fn + ".new")
+        self.files[2] = ("foo", fn + ".new")
+        deps, scanned = self.filedeps(self.cachedir)
+        self.assertEqual(scanned, ["foo/etc/foo.conf.new"])
+
+        # A new rpmdeps doesn't reuse the results of the old one
+        st = os.stat(self.rpmdeps)
+        os.utime(self.rpmdeps, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        deps, scanned = self.filedeps(self.cachedir)
+        self.assertEqual(deps, self.expected)
+        self.assertEqual(len(scanned), 4)
+
+    def test_bad_cache_entry(self):
+        self.filedeps(self.cachedir)
+        for root, dirs, files in os.walk(self.cachedir):
+            for f in files:
+                with open(os.path.join(root, f), "w") as fd:
+                    fd.write("{")
+        deps, scanned = self.filedeps(self.cachedir)
+        self.assertEqual(deps, self.expected)
+        self.assertEqual(len(scanned), 4)
+
+class TestPkgFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_pkgfiles")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        files = [self.tmpdir + "/foo/usr/bin/foo", self.tmpdir + "/foo/etc/foo conf"]
+        oe.package.write_pkgfiles(self.tmpdir, {"foo": files, "foo-dev": []})
+        self.assertEqual(oe.package.read_pkgfiles(self.tmpdir, "foo"), files)
+        self.assertEqual(oe.package.read_pkgfiles(self.tmpdir, "foo-dev"), [])
+        self.assertIsNone(oe.package.read_pkgfiles(self.tmpdir, "foo-doc"))
+
+class TestFilesMatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_filesmatcher")
+        for path in ["usr/bin/foo", "usr/bin/.hidden", "usr/lib/libfoo.so.1", "usr/lib/libfoo.a",
+                     "usr/share/doc/foo/README", "etc/foo.conf"]:
+            path = os.path.join(self.tmpdir, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "w").close()
+        os.symlink("libfoo.so.1", os.path.join(self.tmpdir, "usr/lib/libfoo.so"))
+        os.symlink("lib", os.path.join(self.tmpdir, "usr/lib64"))
+        os.symlink("missing", os.path.join(self.tmpdir, "usr/bin/dangling"))
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test_glob(self):
+        import glob
+        matcher = oe.package.FilesMatcher()
+        for pattern in ["./usr/bin/*", "./usr/bin/.*", "./usr/lib/lib*.so.*", "./usr/*/lib*.so",
+                        "./usr/lib64/*.a", "./usr/lib64/libfoo.a", "./usr/bin/dangling",
+                        "./usr/share/doc", "./usr/share/doc/", "./usr/bin/foo/*", "./usr/*/", "./usr/li[bx]",
+                        "./usr/lib/../bin/f?o", "./nonexistent", "./usr//bin/foo", "./etc/*.conf"]:
+            self.assertEqual(matcher.glob(pattern), glob.glob(pattern), pattern)
+
+    def test_paths(self):
+        matcher = oe.package.FilesMatcher()
+        for path in ["./usr", "./usr/lib64", "./usr/lib64/libfoo.so", "./usr/lib/libfoo.so",
+                     "./usr/bin/dangling", "./usr/bin/foo", "./usr/bin/foo/bar", "./missing", "."]:
+            self.assertEqual(matcher.lexists(path), os.path.lexists(path), path)
+            self.assertEqual(matcher.islink(path), os.path.islink(path), path)
+            self.assertEqual(matcher.isdir(path), os.path.isdir(path), path)
+        self.assertEqual(matcher.listdir("./usr/lib64"), os.listdir("./usr/lib64"))
+        self.assertEqual(matcher.listdir("./usr/bin"), os.listdir("./usr/bin"))
+
+    def test_no_scandir(self):
+        # Python 3.4 has no os.scandir()
+        import unittest.mock
+        matcher = oe.package.FilesMatcher()
+        patterns = ["./usr/bin/*", "./usr/*/lib*.so", "./usr/lib64/*.a", "./usr/*/"]
+        expected = [matcher.glob(pattern) for pattern in patterns]
+        with unittest.mock.patch.dict(os.__dict__):
+            del os.scandir
+            matcher = oe.package.FilesMatcher()
+            self.assertEqual([matcher.glob(pattern) for pattern in patterns], expected)
+            self.assertTrue(matcher.islink("./usr/bin/dangling"))
+            self.assertTrue(matcher.isdir("./usr/share/doc"))
+
+    def test_symlink_parent(self):
+        matcher = oe.package.FilesMatcher()
+        self.assertEqual(matcher.symlink_parent("./usr/lib64/libfoo.a"), "./usr/lib64")
+        self.assertEqual(matcher.symlink_parent("./usr/lib/libfoo.a"), None)
+        self.assertEqual(matcher.symlink_parent("./usr/lib64"), None)
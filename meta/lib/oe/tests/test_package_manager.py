@@ -0,0 +1,188 @@
+import unittest
+import os
+import re
+import shutil
+import tempfile
+import oe
+
+STATUS = """Package: foo
+Version: 1.0-r0
+Depends: libc6 (>= 2.24), bar
+Recommends: foo-doc (= 1.0-r0)
+Status: install user installed
+Architecture: core2-64
+Description: The foo program
+ Continuation: not a field
+
+Package: bar
+Version: 2.0-r1
+Depends:
+Status: install ok installed
+Architecture: all
+Filename: ./all/bar_2.0-r1_all.ipk
+
+Package: libc6
+Version: 2.24-r0
+Architecture: core2-64
+PackageArch: core2-64
+"""
+
+def old_opkg_query(cmd_output):
+    # opkg_query() as it was before it was rewritten as a generator
+    verregex = re.compile(r' \([=<>]* [^ )]*\)')
+    output = dict()
+    pkg = ""
+    arch = ""
+    ver = ""
+    filename = ""
+    dep = []
+    pkgarch = ""
+    for line in cmd_output.splitlines():
+        line = line.rstrip()
+        if ':' in line:
+            if line.startswith("Package: "):
+                pkg = line.split(": ")[1]
+            elif line.startswith("Architecture: "):
+                arch = line.split(": ")[1]
+            elif line.startswith("Version: "):
+                ver = line.split(": ")[1]
+            elif line.startswith("File: ") or line.startswith("Filename:"):
+                filename = line.split(": ")[1]
+                if "/" in filename:
+                    filename = os.path.basename(filename)
+            elif line.startswith("Depends: "):
+                depends = verregex.sub('', line.split(": ")[1])
+                for depend in depends.split(", "):
+                    dep.append(depend)
+            elif line.startswith("Recommends: "):
+                recommends = verregex.sub('', line.split(": ")[1])
+                for recommend in recommends.split(", "):
+                    dep.append("%s [REC]" % recommend)
+            elif line.startswith("PackageArch: "):
+                pkgarch = line.split(": ")[1]
+
+        # When there is a blank line save the package information
+        elif not line:
+            # IPK doesn't include the filename
+            if not filename:
+                filename = "%s_%s_%s.ipk" % (pkg, ver, arch)
+            if pkg:
+                output[pkg] = {"arch":arch, "ver":ver,
+                        "filename":filename, "deps": dep, "pkgarch":pkgarch }
+            pkg = ""
+            arch = ""
+            ver = ""
+            filename = ""
+            dep = []
+            pkgarch = ""
+
+    if pkg:
+        if not filename:
+            filename = "%s_%s_%s.ipk" % (pkg, ver, arch)
+        output[pkg] = {"arch":arch, "ver":ver,
+                "filename":filename, "deps": dep }
+
+    return output
+
+class TestOpkgQuery(unittest.TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        import oe.package_manager
+
+    def test_query(self):
+        expected = old_opkg_query(STATUS + "\n")
+        self.assertEqual(oe.package_manager.opkg_query(STATUS + "\n"), expected)
+        self.assertEqual(expected["foo"]["deps"], ["libc6", "bar", "foo-doc [REC]"])
+        self.assertEqual(expected["bar"]["deps"], [])
+        self.assertEqual(expected["bar"]["filename"], "bar_2.0-r1_all.ipk")
+        self.assertEqual(expected["libc6"]["pkgarch"], "core2-64")
+
+    def test_iter(self):
+        # Lines are consumed as they come, and the last stanza doesn't need
+        # a blank line after it (the old parser left out its pkgarch)
+        records = list(oe.package_manager.opkg_query_iter(iter(STATUS.splitlines(True))))
+        self.assertEqual([pkg for pkg, info in records], ["foo", "bar", "libc6"])
+        expected = old_opkg_query(STATUS)
+        expected["libc6"]["pkgarch"] = "core2-64"
+        self.assertEqual(dict(records), expected)
+
+class TestOpkgQueryCached(unittest.TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        import oe.package_manager
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_opkg_query")
+        self.status_file = os.path.join(self.tmpdir, "status")
+        self.write(STATUS)
+        self.calls = 0
+
+    def tearDown(self):
+        oe.package_manager._opkg_query_cache.pop(self.status_file, None)
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, status):
+        with open(self.status_file, "w") as f:
+            f.write(status)
+
+    def query(self):
+        self.calls += 1
+        with open(self.status_file) as f:
+            return oe.package_manager.opkg_query(f.read())
+
+    def test_cached(self):
+        result = oe.package_manager.opkg_query_cached(self.status_file, self.query)
+        self.assertEqual(sorted(result), ["bar", "foo", "libc6"])
+        # Callers may modify what they get back
+        result["foo"]["deps"].append("baz")
+        del result["bar"]
+        result = oe.package_manager.opkg_query_cached(self.status_file, self.query)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(result["foo"]["deps"], ["libc6", "bar", "foo-doc [REC]"])
+        self.assertIn("bar", result)
+
+    def test_invalidated(self):
+        oe.package_manager.opkg_query_cached(self.status_file, self.query)
+        self.write(STATUS.replace("Package: bar", "Package: baz"))
+        # Same size, so make sure the modification time differs as well
+        st = os.stat(self.status_file)
+        os.utime(self.status_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        result = oe.package_manager.opkg_query_cached(self.status_file, self.query)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(sorted(result), ["baz", "foo", "libc6"])
+
+    def test_missing(self):
+        os.unlink(self.status_file)
+        self.query = lambda: {}
+        self.assertEqual(oe.package_manager.opkg_query_cached(self.status_file, self.query), {})
+        self.assertNotIn(self.status_file, oe.package_manager._opkg_query_cache)
+
+class TestOpkgStatus(unittest.TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_opkg_status")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_utf8(self):
+        # The status is decoded as UTF-8 even in an ASCII locale, which is
+        # only chosen at startup, hence the separate interpreter
+        import subprocess, sys
+        with open(os.path.join(self.tmpdir, "status"), "wb") as f:
+            f.write("Package: grüße\nVersion: 1.0\nArchitecture: all\n\n".encode("utf-8"))
+        env = dict(os.environ, LC_ALL="C", PYTHONUTF8="0", PYTHONCOERCECLOCALE="0",
+                   PYTHONPATH=os.pathsep.join(sys.path))
+        script = ("import oe.package_manager\n"
+                  "pkgs = object.__new__(oe.package_manager.OpkgPkgsList)\n"
+                  "pkgs.opkg_cmd, pkgs.opkg_args = 'cat', ''\n"
+                  "print(ascii(sorted(pkgs._query_status())))\n")
+        output = subprocess.check_output([sys.executable, "-c", script], cwd=self.tmpdir, env=env)
+        self.assertEqual(output.decode().strip(), ascii(["grüße"]))
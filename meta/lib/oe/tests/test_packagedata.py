@@ -0,0 +1,250 @@
+import unittest
+import oe, oe.packagedata
+import tempfile
+import os
+import shutil
+
+class TestPkgdataIndex(unittest.TestCase):
+    RECIPES = {
+        "foo": ["foo", "foo-dev", "libfoo1"],
+        "bar": ["bar", "bar-doc"],
+    }
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_pkgdata")
+        os.mkdir(os.path.join(self.tmpdir, "runtime"))
+        for pn, packages in self.RECIPES.items():
+            self.write_recipe(pn, packages)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_recipe(self, pn, packages):
+        with open(os.path.join(self.tmpdir, pn), "w") as f:
+            f.write("PACKAGES: %s\n" % " ".join(packages))
+        for pkg in packages:
+            with open(os.path.join(self.tmpdir, "runtime", pkg), "w") as f:
+                f.write("PN: %s\nPKG_%s: %s\nDESCRIPTION: a\\nb\n" % (pn, pkg, pkg.replace("foo", "baz")))
+
+    def expected_pkgmap(self):
+        return dict((pkg, pn) for pn, packages in self.RECIPES.items() for pkg in packages)
+
+    def test_pkgmap(self):
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        index.update()
+        self.assertEqual(index.pkgmap(), self.expected_pkgmap())
+        self.assertEqual(index.pkgmap(), oe.packagedata.PkgdataFiles(self.tmpdir).pkgmap())
+        self.assertEqual(index.recipename("libfoo1"), "foo")
+        self.assertIsNone(index.recipename("nonexistent"))
+
+    def test_missing_dir(self):
+        # Warns without bb, as oe-pkgdata-util uses it
+        files = oe.packagedata.PkgdataFiles(os.path.join(self.tmpdir, "nonexistent"))
+        with self.assertLogs("BitBake.OE.PackageData", "WARNING"):
+            self.assertEqual(files.pkgmap(), {})
+
+    def test_update(self):
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        index.update()
+
+        self.write_recipe("foo", ["foo", "foo-dbg"])
+        os.unlink(os.path.join(self.tmpdir, "bar"))
+        index.update(["foo", "bar"])
+
+        self.assertEqual(index.pkgmap(), {"foo": "foo", "foo-dbg": "foo"})
+        self.assertIsNone(index.recipename("bar-doc"))
+
+    def test_resync(self):
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        index.update()
+
+        # Changes made behind the back of the index are seen through the
+        # files until the next update
+        self.write_recipe("qux", ["qux"])
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        self.assertEqual(index.recipename("qux"), "qux")
+        self.assertIsNone(index._current())
+
+        index.update(["foo"])
+        self.assertIsNotNone(index._current())
+        self.assertEqual(index.recipename("qux"), "qux")
+        self.assertEqual(index.pkgmap(), dict(self.expected_pkgmap(), qux="qux"))
+
+    def test_rewrite_same_tick(self):
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        index.update()
+
+        # Rewritten in place, with the same size and mtime, as a coarse
+        # timestamp filesystem could leave it
+        fn = os.path.join(self.tmpdir, "bar")
+        st = os.stat(fn)
+        with open(fn, "w") as f:
+            f.write("PACKAGES: bar bax-doc\n")
+        os.utime(fn, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertEqual(os.stat(fn).st_size, st.st_size)
+        self.assertIsNone(index._current())
+        self.assertEqual(index.recipename("bax-doc"), "bar")
+
+        index.update()
+        self.assertIsNotNone(index._current())
+        self.assertEqual(index.recipename("bax-doc"), "bar")
+
+    def test_rewrite_runtime(self):
+        # Files older than a clock tick are identified by their stat data
+        for fn in ["foo", "bar", "runtime/foo"]:
+            os.utime(os.path.join(self.tmpdir, fn), (0, 0))
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        index.update()
+        self.assertEqual(index.find_path("/usr/bin/foo"), [])
+
+        with open(os.path.join(self.tmpdir, "runtime", "foo"), "a") as f:
+            f.write('FILES_INFO: {"/usr/bin/foo": 30}\n')
+        self.assertIsNotNone(index._current())
+        self.assertIsNone(index._current(runtime=True))
+        self.assertEqual(index.find_path("/usr/bin/foo"), [("foo", "/usr/bin/foo")])
+
+        # Picked up by the next update although the recipe didn't change
+        index.update(["bar"])
+        self.assertIsNotNone(index._current(runtime=True))
+        self.assertEqual(index.find_path("/usr/bin/foo"), [("foo", "/usr/bin/foo")])
+
+    def test_readonly(self):
+        # Queries never create or write the index
+        index = oe.packagedata.open_pkgdata_index(self.tmpdir)
+        self.assertIsInstance(index, oe.packagedata.PkgdataFiles)
+        self.assertEqual(index.pkgmap(), self.expected_pkgmap())
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, ".index")))
+
+        oe.packagedata.PkgdataIndex(self.tmpdir).update()
+        dbfile = os.path.join(self.tmpdir, ".index", "pkgdata.db")
+        mtime = os.stat(dbfile).st_mtime_ns
+        self.write_recipe("qux", ["qux"])
+        index = oe.packagedata.open_pkgdata_index(self.tmpdir)
+        self.assertIsInstance(index, oe.packagedata.PkgdataIndex)
+        self.assertEqual(index.recipename("qux"), "qux")
+        self.assertEqual(index.recipename("libfoo1"), "foo")
+        index.find_path("/usr/*")
+        index.read_runtime("foo")
+        self.assertEqual(os.stat(dbfile).st_mtime_ns, mtime)
+
+    def test_read_runtime(self):
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        index.update(["foo"])
+        expected = oe.packagedata.read_pkgdatafile(os.path.join(self.tmpdir, "runtime", "libfoo1"))
+        self.assertEqual(expected["DESCRIPTION"], "a\nb")
+        self.assertEqual(index.read_runtime("libfoo1"), expected)
+        self.assertEqual(index.read_runtime("nonexistent"), {})
+
+    def test_find_path(self):
+        with open(os.path.join(self.tmpdir, "runtime", "libfoo1"), "a") as f:
+            f.write('FILES_INFO: {"/usr/lib/libfoo.so.1": 10, "/usr/lib/libfoo.so.1.0": 20}\n')
+        with open(os.path.join(self.tmpdir, "runtime", "foo"), "a") as f:
+            f.write('FILES_INFO: {"/usr/bin/foo": 30, "/usr/libexec/foo": 40}\n')
+
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        index.update(["foo"])
+        files = oe.packagedata.PkgdataFiles(self.tmpdir)
+        for pattern in ["/usr/bin/foo", "/usr/lib/*", "/usr/lib*", "*foo*", "/usr/lib/libfoo.so.[0-9]", "/nonexistent"]:
+            self.assertEqual(index.find_path(pattern), files.find_path(pattern))
+        self.assertEqual(index.find_path("/usr/lib/*"),
+                         [("libfoo1", "/usr/lib/libfoo.so.1"), ("libfoo1", "/usr/lib/libfoo.so.1.0")])
+        self.assertEqual(index.pkg_files("foo"), {"/usr/bin/foo": 30, "/usr/libexec/foo": 40})
+        self.assertIsNone(index.pkg_files("bar"))
+
+class TestPkgdataFormats(unittest.TestCase):
+    FIELDS = [
+        ("PN", "foo"),
+        ("PKGV", "1.0"),
+        ("DESCRIPTION", "multi\nline é \\ text"),
+        ("RDEPENDS_foo", "bar (>= 1.0) baz"),
+        ("RPROVIDES", ""),
+        ("pkg_postinst_foo", "#!/bin/sh\nif [ -n \"$D\" ]; then\n\texit 1\nfi\n"),
+        ("FILES_INFO", {"/usr/bin/foo": 30, "/usr/share/föö": 0}),
+        ("PKGSIZE_foo", 30),
+    ]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_pkgdata")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, binary):
+        fn = os.path.join(self.tmpdir, "binary" if binary else "text")
+        oe.packagedata.write_pkgdatafile(fn, self.FIELDS, binary)
+        return fn
+
+    def test_text_format(self):
+        fn = self.write(False)
+        with open(fn) as f:
+            lines = f.read().splitlines()
+        self.assertIn("PN: foo", lines)
+        self.assertIn("PKGSIZE_foo: 30", lines)
+        self.assertIn('FILES_INFO: {"/usr/bin/foo": 30, "/usr/share/f\\\\u00f6\\\\u00f6": 0}', lines)
+        self.assertNotIn("RPROVIDES", [l.split(":")[0] for l in lines])
+        self.assertEqual(os.listdir(self.tmpdir), ["text"])
+
+    def test_read(self):
+        expected = {
+            "PN": "foo",
+            "PKGV": "1.0",
+            "DESCRIPTION": "multi\nline é \\ text",
+            "RDEPENDS_foo": "bar (>= 1.0) baz",
+            "pkg_postinst_foo": "#!/bin/sh\nif [ -n \"$D\" ]; then\n\texit 1\nfi\n",
+            "FILES_INFO": {"/usr/bin/foo": 30, "/usr/share/föö": 0},
+            "PKGSIZE_foo": "30",
+        }
+        for binary in (False, True):
+            fn = self.write(binary)
+            pkgdata = oe.packagedata.read_runtime_pkgdata(fn)
+            self.assertEqual(pkgdata, expected)
+            self.assertEqual(list(pkgdata["FILES_INFO"]), ["/usr/bin/foo", "/usr/share/föö"])
+
+    def test_formats_match(self):
+        text = self.write(False)
+        binary = self.write(True)
+        with open(binary, "rb") as f:
+            self.assertTrue(f.read().startswith(oe.packagedata.BINARY_MAGIC))
+        for escaped in (False, True):
+            self.assertEqual(oe.packagedata.read_pkgdatafile(binary, escaped),
+                             oe.packagedata.read_pkgdatafile(text, escaped))
+            self.assertEqual(oe.packagedata.read_runtime_pkgdata(binary, escaped),
+                             oe.packagedata.read_runtime_pkgdata(text, escaped))
+
+    def test_escaped(self):
+        fn = self.write(True)
+        pkgdata = oe.packagedata.read_pkgdatafile(fn, escaped=True)
+        self.assertEqual(pkgdata["DESCRIPTION"], "multi\\nline \\xe9 \\\\ text")
+        with open(self.write(False)) as f:
+            self.assertIn("DESCRIPTION: %s" % pkgdata["DESCRIPTION"], f.read().splitlines())
+
+    def test_index(self):
+        os.mkdir(os.path.join(self.tmpdir, "runtime"))
+        with open(os.path.join(self.tmpdir, "foo"), "w") as f:
+            f.write("PACKAGES: foo\n")
+        oe.packagedata.write_pkgdatafile(os.path.join(self.tmpdir, "runtime", "foo"), self.FIELDS, True)
+
+        index = oe.packagedata.PkgdataIndex(self.tmpdir)
+        index.update()
+        self.assertEqual(index.find_path("/usr/bin/*"), [("foo", "/usr/bin/foo")])
+        self.assertEqual(index.pkg_files("foo"), {"/usr/bin/foo": 30, "/usr/share/föö": 0})
+        self.assertEqual(index.read_runtime("foo")["PKGV"], "1.0")
+
+    def test_index_read_runtime(self):
+        os.mkdir(os.path.join(self.tmpdir, "runtime"))
+        with open(os.path.join(self.tmpdir, "foo"), "w") as f:
+            f.write("PACKAGES: foo bar\n")
+        fns = {}
+        for pkg, binary in (("foo", False), ("bar", True)):
+            fns[pkg] = os.path.join(self.tmpdir, "runtime", pkg)
+            oe.packagedata.write_pkgdatafile(fns[pkg], self.FIELDS, binary)
+
+        # The same from the index as from the files, whatever their format
+        for index in (oe.packagedata.PkgdataFiles(self.tmpdir), oe.packagedata.PkgdataIndex(self.tmpdir)):
+            if isinstance(index, oe.packagedata.PkgdataIndex):
+                index.update()
+            for pkg, fn in fns.items():
+                self.assertEqual(index.read_runtime(pkg), oe.packagedata.read_pkgdatafile(fn))
+                structured = index.read_runtime(pkg, True)
+                self.assertEqual(structured, oe.packagedata.read_runtime_pkgdata(fn))
+                self.assertEqual(list(structured["FILES_INFO"]), ["/usr/bin/foo", "/usr/share/föö"])
@@ -0,0 +1,52 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+class TestLogChecker(unittest.TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        import oe.rootfs
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_logchecker")
+        self.log = os.path.join(self.tmpdir, "log.do_rootfs")
+        open(self.log, "w").close()
+        self.checker = oe.rootfs.LogChecker(['log_check', r'^\+'],
+                                            '^(warn|Warn|WARNING:)',
+                                            r'(exit 1|Collected errors)')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def append(self, data):
+        with open(self.log, "a") as f:
+            f.write(data)
+
+    def test_scan(self):
+        self.append("NOTE: foo\n+ exit 1\nWARNING: bar\nCollected errors:\n")
+        self.assertEqual(self.checker.scan(self.log),
+                         (["WARNING: bar\n"], ["Collected errors:\n"]))
+        # Only what was appended since is scanned again
+        self.append("Warn: baz exit 1\n")
+        self.assertEqual(self.checker.scan(self.log),
+                         (["Warn: baz exit 1\n"], ["Warn: baz exit 1\n"]))
+        self.assertEqual(self.checker.scan(self.log), ([], []))
+
+    def test_partial_line(self):
+        # A line already matching before it is complete is reported once
+        self.append("NOTE: foo\nCollected errors")
+        self.assertEqual(self.checker.scan(self.log), ([], []))
+        self.append(":\nNOTE: ")
+        self.assertEqual(self.checker.scan(self.log), ([], ["Collected errors:\n"]))
+        self.append("bar exit 1\n")
+        self.assertEqual(self.checker.scan(self.log), ([], ["NOTE: bar exit 1\n"]))
+        self.assertEqual(self.checker.scan(self.log), ([], []))
+
+    def test_truncated(self):
+        self.append("NOTE: foo\nNOTE: bar\nexit 1")
+        self.checker.scan(self.log)
+        with open(self.log, "w") as f:
+            f.write("exit 1\n")
+        self.assertEqual(self.checker.scan(self.log), ([], ["exit 1\n"]))
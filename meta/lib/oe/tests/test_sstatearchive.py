@@ -0,0 +1,71 @@
+import unittest
+import os
+import shutil
+import subprocess
+import tempfile
+import oe.sstatearchive
+
+class TestSstateArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_sstatearchive")
+        self.srcdir = os.path.join(self.tmpdir, "src")
+        os.makedirs(os.path.join(self.srcdir, "sysroot", "usr", "lib"))
+        with open(os.path.join(self.srcdir, "sysroot", "usr", "lib", "libfoo.so"), "wb") as f:
+            f.write(os.urandom(4096) + b"\0" * 65536)
+        os.symlink("libfoo.so", os.path.join(self.srcdir, "sysroot", "usr", "lib", "libfoo.so.1"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def roundtrip(self, fmt):
+        archive = os.path.join(self.tmpdir, "sstate:foo::1.0:r0::3:abcdef_populate_sysroot." + fmt)
+        oe.sstatearchive.create(archive, self.srcdir, threads=2)
+        self.assertEqual(oe.sstatearchive.archive_format(archive), fmt)
+        self.assertEqual(os.stat(archive).st_mode & 0o777, 0o664)
+        self.assertEqual(os.listdir(self.tmpdir).count(os.path.basename(archive)), 1)
+        self.assertEqual(len(os.listdir(self.tmpdir)), 2)
+
+        destdir = os.path.join(self.tmpdir, "dest")
+        os.makedirs(destdir)
+        oe.sstatearchive.extract(archive, destdir)
+        subprocess.check_call(["diff", "-r", "--no-dereference", self.srcdir, destdir])
+
+    def test_tgz(self):
+        self.roundtrip("tgz")
+
+    @unittest.skipUnless(shutil.which("zstd"), "zstd not available")
+    def test_zstd(self):
+        self.roundtrip("tar.zst")
+
+    def corrupt(self, fmt):
+        archive = os.path.join(self.tmpdir, "foo_package." + fmt)
+        oe.sstatearchive.create(archive, self.srcdir)
+        # Damage the end of the stream, past the data tar needs
+        with open(archive, "r+b") as f:
+            f.seek(-6, os.SEEK_END)
+            byte = f.read(1)
+            f.seek(-6, os.SEEK_END)
+            f.write(bytes([byte[0] ^ 0xff]))
+        destdir = os.path.join(self.tmpdir, "dest")
+        os.makedirs(destdir)
+        with self.assertRaises(subprocess.CalledProcessError):
+            oe.sstatearchive.extract(archive, destdir)
+
+    def test_corrupt_tgz(self):
+        self.corrupt("tgz")
+
+    @unittest.skipUnless(shutil.which("zstd"), "zstd not available")
+    def test_corrupt_zstd(self):
+        self.corrupt("tar.zst")
+
+    def test_empty(self):
+        emptydir = os.path.join(self.tmpdir, "empty")
+        os.makedirs(emptydir)
+        archive = os.path.join(self.tmpdir, "empty.tgz")
+        oe.sstatearchive.create(archive, emptydir)
+        self.assertEqual(subprocess.check_output(["tar", "-tzf", archive]), b"")
+
+    def test_unknown_format(self):
+        self.assertIsNone(oe.sstatearchive.archive_format("foo_package.tar.xz"))
+        with self.assertRaises(ValueError):
+            oe.sstatearchive.create(os.path.join(self.tmpdir, "foo_package.tar.xz"), self.srcdir)
@@ -0,0 +1,81 @@
+import unittest
+import os
+import shutil
+import tempfile
+import oe.sstatefixme
+
+class TestSstateFixme(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_sstatefixme")
+        self.builddir = os.path.join(self.tmpdir, "build")
+        os.makedirs(os.path.join(self.builddir, "sysroot", "usr", "lib"))
+        self.files = {
+            "sysroot/usr/lib/libfoo.la": b"libdir='/old/sysroots/machine/usr/lib'\ndependency_libs=' /old/sysroots/machine/usr/lib/libbar.la /old/sysroots/x86_64-linux/lib'\n",
+            "sysroot/usr/lib/foo-config": b"#!/bin/sh\necho /old/sysroots/x86_64-linux/usr/include /old/pseudo\n",
+            "sysroot/usr/lib/other_config": b"nothing to see\n",
+            "sysroot/usr/lib/extra_config": b"only /old/pseudo\n",
+            "sysroot/usr/lib/empty-config": b"",
+        }
+        for path, data in self.files.items():
+            with open(os.path.join(self.builddir, path), "wb") as f:
+                f.write(data)
+        os.chmod(os.path.join(self.builddir, "sysroot/usr/lib/foo-config"), 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, topdir, path):
+        with open(os.path.join(topdir, path), "rb") as f:
+            return f.read()
+
+    def replacements(self, target, staging, pseudo):
+        # As for a cross recipe, with an EXTRA_STAGING_FIXMES variable
+        return [(target, "FIXMESTAGINGDIRTARGET"), (staging, "FIXMESTAGINGDIR"), (pseudo, "FIXME_PSEUDO")]
+
+    def hardcode(self):
+        replacer = oe.sstatefixme.Replacer(self.replacements("/old/sysroots/machine", "/old/sysroots", "/old/pseudo"), 2)
+        linked = os.path.join(self.tmpdir, "linked.la")
+        os.link(os.path.join(self.builddir, "sysroot/usr/lib/libfoo.la"), linked)
+        changed = oe.sstatefixme.hardcode_paths(self.builddir, sorted(self.files), replacer)
+        # Other links to the files are left alone
+        self.assertEqual(self.read(self.tmpdir, "linked.la"), self.files["sysroot/usr/lib/libfoo.la"])
+        return changed
+
+    def test_hardcode(self):
+        changed = self.hardcode()
+        self.assertEqual(changed, ["sysroot/usr/lib/foo-config", "sysroot/usr/lib/libfoo.la"])
+        self.assertEqual(self.read(self.builddir, "sysroot/usr/lib/libfoo.la"),
+                         b"libdir='FIXMESTAGINGDIRTARGET/usr/lib'\ndependency_libs=' FIXMESTAGINGDIRTARGET/usr/lib/libbar.la FIXMESTAGINGDIR/x86_64-linux/lib'\n")
+        self.assertEqual(self.read(self.builddir, "sysroot/usr/lib/foo-config"),
+                         b"#!/bin/sh\necho FIXMESTAGINGDIR/x86_64-linux/usr/include FIXME_PSEUDO\n")
+        self.assertEqual(os.stat(os.path.join(self.builddir, "sysroot/usr/lib/foo-config")).st_mode & 0o777, 0o755)
+        # Files with only the extra paths aren't changed, as with sed
+        self.assertEqual(self.read(self.builddir, "sysroot/usr/lib/extra_config"), b"only /old/pseudo\n")
+        self.assertEqual(self.read(self.builddir, "fixmepath"), b"sysroot/usr/lib/foo-config\nsysroot/usr/lib/libfoo.la\n")
+        index = oe.sstatefixme.read_index(self.builddir)
+        self.assertEqual(index["sysroot/usr/lib/foo-config"], [15, 56])
+
+    def fixup(self):
+        new = self.replacements("/new/sysroots/machine", "/new/sysroots", "/new/pseudo")
+        replacer = oe.sstatefixme.Replacer(sorted(((n, o) for (o, n) in new), key=lambda r: -len(r[0])))
+        self.assertEqual(oe.sstatefixme.fixup_paths(self.builddir, replacer), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.builddir, "fixmepath")))
+        self.assertFalse(os.path.exists(os.path.join(self.builddir, "fixmepath.index")))
+        for path in ("sysroot/usr/lib/libfoo.la", "sysroot/usr/lib/foo-config"):
+            self.assertEqual(self.read(self.builddir, path), self.files[path].replace(b"/old/", b"/new/"))
+
+    def test_roundtrip(self):
+        self.hardcode()
+        self.fixup()
+
+    def test_without_index(self):
+        # Objects created before the index existed only have fixmepath
+        self.hardcode()
+        os.remove(os.path.join(self.builddir, "fixmepath.index"))
+        self.fixup()
+
+    def test_stale_index(self):
+        self.hardcode()
+        with open(os.path.join(self.builddir, "fixmepath.index"), "w") as f:
+            f.write("sysroot/usr/lib/foo-config\t1,2\nsysroot/usr/lib/libfoo.la\t0\n")
+        self.fixup()
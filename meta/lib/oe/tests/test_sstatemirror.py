@@ -0,0 +1,119 @@
+import unittest
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import oe
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+class TestMirrorUrl(unittest.TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        import oe.sstatemirror
+
+    def test_mirror_url(self):
+        self.assertEqual(oe.sstatemirror.mirror_url(("file://.*", "http://example.com/sstate/PATH;downloadfilename=PATH"), "ab/sstate:foo.tgz"),
+                         "http://example.com/sstate/ab/sstate:foo.tgz")
+        self.assertEqual(oe.sstatemirror.mirror_url(("file://.*", "file:///srv/sstate/PATH"), "ab/foo.tgz"),
+                         "file:///srv/sstate/ab/foo.tgz")
+        self.assertIsNone(oe.sstatemirror.mirror_url(("file://.*", "ftp://example.com/PATH"), "ab/foo.tgz"))
+        self.assertIsNone(oe.sstatemirror.mirror_url(("file://.*/foo.*", "http://example.com/PATH"), "ab/foo.tgz"))
+
+class TestCheckUrls(unittest.TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        import oe.sstatemirror
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_sstatemirror")
+        os.makedirs(os.path.join(self.tmpdir, "ab"))
+        for name in ("present1.tgz", "present2.tgz"):
+            open(os.path.join(self.tmpdir, "ab", name), "w").close()
+
+        tmpdir = self.tmpdir
+        class Handler(QuietHandler):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, directory=tmpdir, **kwargs)
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.base = "http://127.0.0.1:%d/" % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmpdir)
+
+    def test_http(self):
+        urls = [self.base + "ab/present1.tgz", self.base + "ab/present2.tgz",
+                self.base + "ab/missing.tgz", self.base + "cd/missing.tgz"]
+        results, stats = oe.sstatemirror.check_urls(urls, connections=2)
+        self.assertEqual(results, {urls[0]: True, urls[1]: True, urls[2]: False, urls[3]: False})
+        host = "127.0.0.1:%d" % self.server.server_address[1]
+        self.assertEqual((stats[host].found, stats[host].missing, stats[host].errors), (2, 2, 0))
+
+    def test_file(self):
+        urls = ["file://" + os.path.join(self.tmpdir, "ab", "present1.tgz"),
+                "file://" + os.path.join(self.tmpdir, "ab", "missing.tgz")]
+        checked = []
+        results, stats = oe.sstatemirror.check_urls(urls, progress=checked.append)
+        self.assertEqual(results, {urls[0]: True, urls[1]: False})
+        self.assertEqual(sum(checked), 2)
+
+    def test_unreachable(self):
+        import socket
+        # Nothing listens on a port which was bound and closed again
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        url = "http://127.0.0.1:%d/ab/present1.tgz" % port
+        results, stats = oe.sstatemirror.check_urls([url], timeout=5)
+        self.assertIsNone(results[url])
+
+class TestProbeCache(unittest.TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        import oe.sstatemirror
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_sstatemirror")
+        self.path = os.path.join(self.tmpdir, "probes.sqlite3")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_ttl(self):
+        cache = oe.sstatemirror.ProbeCache(self.path, 100, 10)
+        cache.record("http://mirror/PATH", {"a.tgz": True, "b.tgz": False})
+        cache.close()
+
+        cache = oe.sstatemirror.ProbeCache(self.path, 100, 10)
+        self.assertEqual(cache.lookup("http://mirror/PATH", {"a.tgz", "b.tgz", "c.tgz"}),
+                         {"a.tgz": True, "b.tgz": False})
+        self.assertEqual(cache.lookup("http://other/PATH", {"a.tgz"}), {})
+
+        # Misses expire before hits
+        conn = cache._connect()
+        with conn:
+            conn.execute("UPDATE probes SET time = time - 50")
+        self.assertEqual(cache.lookup("http://mirror/PATH", {"a.tgz", "b.tgz"}), {"a.tgz": True})
+        cache.close()
+
+    def test_disabled(self):
+        cache = oe.sstatemirror.ProbeCache(self.path, 0, 0)
+        cache.record("http://mirror/PATH", {"a.tgz": True})
+        self.assertEqual(cache.lookup("http://mirror/PATH", {"a.tgz"}), {})
+        self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,107 @@
+import unittest
+import os
+import shutil
+import tempfile
+import unittest.mock
+import oe
+
+class TestSiginfoIndex(unittest.TestCase):
+    NAME = "sstate:foo:core2-64-poky-linux:1.0:r0:core2-64:3:ab0123_package.tgz.siginfo"
+
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        import oe.sstatesig
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_sstatesig")
+        self.sstate_dir = os.path.join(self.tmpdir, "sstate-cache")
+        self.siginfo = self.write(self.NAME)
+        self.index = oe.sstatesig.SiginfoIndex(self.sstate_dir, os.path.join(self.tmpdir, "index.db"))
+        self.index.refresh()
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name):
+        fn = os.path.join(self.sstate_dir, name.split(":")[-1][:2], name)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        open(fn, "w").close()
+        return fn
+
+    def find(self, sstate_dir, hashval="ab0123", index=True):
+        filespec = "%s/%s/sstate:foo:*:*:*:*:3:%s_package.*.siginfo" % (sstate_dir, hashval[:2], hashval)
+        return oe.sstatesig._sstate_siginfo_files(self.index if index else None, sstate_dir, filespec,
+                                                  "foo", "do_package", hashval)
+
+    def test_find(self):
+        self.assertEqual(self.index.find("foo", "do_package", "ab0123"),
+                         [(self.siginfo, os.stat(self.siginfo).st_mtime)])
+        self.assertEqual(list(self.find(self.sstate_dir)), [self.siginfo])
+        self.assertEqual(list(self.find(self.sstate_dir, index=False)), [self.siginfo])
+        self.assertEqual(self.find(self.sstate_dir, "cd4567"), {})
+
+    def test_unnormalised_sstate_dir(self):
+        # SSTATE_DIR as the user may have written it
+        for sstate_dir in (self.sstate_dir + "/", os.path.join(self.tmpdir, "x", "..", "sstate-cache")):
+            self.assertEqual(list(self.find(sstate_dir)), [self.siginfo])
+            self.assertEqual(list(self.find(sstate_dir, index=False)), [self.siginfo])
+
+    def test_refresh(self):
+        # The index is trusted once refreshed, the tree isn't walked
+        siginfo = self.write(self.NAME.replace("ab0123", "cd4567"))
+        self.assertEqual(self.find(self.sstate_dir, "cd4567"), {})
+        self.assertEqual(list(self.find(self.sstate_dir, "cd4567", index=False)), [siginfo])
+        self.index.refresh()
+        self.assertEqual(list(self.find(self.sstate_dir, "cd4567")), [siginfo])
+
+    def test_mtime(self):
+        # Touching a siginfo file doesn't change its directory, the mtime
+        # returned is the file's current one
+        st = os.stat(self.siginfo)
+        os.utime(self.siginfo, (st.st_atime + 100, st.st_mtime + 100))
+        self.assertEqual(self.find(self.sstate_dir), {self.siginfo: st.st_mtime + 100})
+
+    def test_no_scandir(self):
+        # Python 3.4 has no os.scandir()
+        index = oe.sstatesig.SiginfoIndex(self.sstate_dir, os.path.join(self.tmpdir, "index2.db"))
+        try:
+            with unittest.mock.patch.dict(os.__dict__):
+                del os.scandir
+                index.refresh()
+            self.assertEqual(index.find("foo", "do_package", "ab0123"),
+                             [(self.siginfo, os.stat(self.siginfo).st_mtime)])
+        finally:
+            index.close()
+
+class TestSstateObjectsExist(unittest.TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        import oe.sstatesig
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_sstateobjects")
+        os.makedirs(os.path.join(self.tmpdir, "ab", "cd"))
+        self.present = os.path.join(self.tmpdir, "ab", "sstate:foo:ab01_package.tgz")
+        open(self.present, "w").close()
+        self.link = os.path.join(self.tmpdir, "ab", "sstate:bar:ab02_package.tgz")
+        os.symlink(self.present, self.link)
+        os.symlink("missing", os.path.join(self.tmpdir, "ab", "sstate:baz:ab03_package.tgz"))
+        self.paths = [os.path.join(self.tmpdir, "ab", name) for name in
+                      ("sstate:foo:ab01_package.tgz", "sstate:bar:ab02_package.tgz",
+                       "sstate:baz:ab03_package.tgz", "cd", "sstate:qux:ab04_package.tgz")]
+        self.paths.append(os.path.join(self.tmpdir, "ef", "sstate:foo:ef01_package.tgz"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_exist(self):
+        expected = set(path for path in self.paths if os.path.isfile(path))
+        self.assertEqual(expected, {self.present, self.link})
+        self.assertEqual(oe.sstatesig.sstate_objects_exist(self.paths, None), expected)
+        # Python 3.4 has no os.scandir()
+        with unittest.mock.patch.dict(os.__dict__):
+            del os.scandir
+            self.assertEqual(oe.sstatesig.sstate_objects_exist(self.paths, None), expected)
@@ -90,6 +90,45 @@ class SStateTests(SStateBase):
         self.run_test_cleansstate_task(['binutils-cross-'+ targetarch, 'binutils-native', 'glibc-initial'], distro_specific=True, distro_nonspecific=False, temp_sstate_location=True)
 
 
+    # Test creating and restoring sstate objects in each archive format
+    def test_sstate_pkg_formats(self):
+        import time
+        if not shutil.which('zstd'):
+            self.skipTest('zstd is not available on this host')
+        target = 'binutils-native'
+        self.config_sstate(temp_sstate_location=True)
+
+        def sstate_objects(fmt):
+            objects = []
+            for root, dirs, files in os.walk(self.sstate_path):
+                objects.extend(os.path.join(root, f) for f in files if re.search(target + '.*?\.%s$' % re.escape(fmt), f))
+            return objects
+
+        for fmt in ['tgz', 'tar.zst']:
+            config = 'SSTATE_PKG_FORMAT = "%s"' % fmt
+            self.append_config(config)
+            bitbake('-ccleansstate ' + target)
+            start = time.time()
+            bitbake(target)
+            created = time.time() - start
+            objects = sstate_objects(fmt)
+            self.assertTrue(objects, msg="Could not find sstate %s files for %s" % (fmt, target))
+
+            bitbake('-cclean ' + target)
+            start = time.time()
+            result = bitbake(target)
+            restored = time.time() - start
+            self.assertTrue(re.search(target + '.*do_populate_sysroot_setscene', result.output), msg="%s wasn't restored from sstate: %s" % (target, result.output))
+            self.log.info("%s: %d objects, %d bytes, build %.1fs, restore from sstate %.1fs" % (fmt, len(objects), sum(os.path.getsize(o) for o in objects), created, restored))
+            self.remove_config(config)
+
+        # The tar.zst objects are used when creating tgz ones
+        self.append_config('SSTATE_PKG_FORMAT = "tgz"')
+        bitbake('-cclean ' + target)
+        result = bitbake(target)
+        self.assertTrue(re.search(target + '.*do_populate_sysroot_setscene', result.output), msg="%s wasn't restored from tar.zst sstate: %s" % (target, result.output))
+        self.assertFalse(sstate_objects('tgz'), msg="tgz sstate objects were created although tar.zst ones were available")
+
     # Test rebuilding of distro-specific sstate files
     def run_test_rebuild_distro_specific_sstate(self, targets, temp_sstate_location=True):
         self.config_sstate(temp_sstate_location)
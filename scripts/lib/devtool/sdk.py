@@ -57,13 +57,17 @@ def get_sstate_objects(update_dict, sstate_dir):
     """Return a list containing sstate objects which are to be installed"""
     sstate_objects = []
     for k in update_dict:
-        files = set()
         hashval = update_dict[k]
-        p = sstate_dir + '/' + hashval[:2] + '/*' + hashval + '*.tgz'
-        files |= set(glob.glob(p))
-        p = sstate_dir + '/*/' + hashval[:2] + '/*' + hashval + '*.tgz'
-        files |= set(glob.glob(p))
-        files = list(files)
+        # The object may be there in any of the sstate archive formats
+        for ext in ['.tgz', '.tar.zst']:
+            files = set()
+            p = sstate_dir + '/' + hashval[:2] + '/*' + hashval + '*' + ext
+            files |= set(glob.glob(p))
+            p = sstate_dir + '/*/' + hashval[:2] + '/*' + hashval + '*' + ext
+            files |= set(glob.glob(p))
+            files = list(files)
+            if files:
+                break
         if len(files) == 1:
             sstate_objects.extend(files)
         elif len(files) > 1:
@@ -28,6 +28,7 @@ logger = logging.getLogger('devtool')
 
 def search(args, config, basepath, workspace):
     """Entry point for the devtool 'search' subcommand"""
+    import oe.packagedata
 
     tinfoil = setup_tinfoil(config_only=False, basepath=basepath)
     try:
@@ -57,16 +58,12 @@ def search(args, config, basepath, workspace):
                         match = True
                         break
                     if os.path.exists(os.path.join(pkgdata_dir, 'runtime', pkg + '.packaged')):
-                        with open(os.path.join(pkgdata_dir, 'runtime', pkg), 'r') as f:
-                            for line in f:
-                                if ': ' in line:
-                                    splitline = line.split(':', 1)
-                                    key = splitline[0]
-                                    value = splitline[1].strip()
-                                if key in ['PKG_%s' % pkg, 'DESCRIPTION', 'FILES_INFO'] or key.startswith('FILERPROVIDES_'):
-                                    if keyword_rc.search(value):
-                                        match = True
-                                        break
+                        pkgdata = oe.packagedata.read_pkgdatafile(os.path.join(pkgdata_dir, 'runtime', pkg), escaped=True)
+                        for key, value in pkgdata.items():
+                            if key in ['PKG_%s' % pkg, 'DESCRIPTION', 'FILES_INFO'] or key.startswith('FILERPROVIDES_'):
+                                if keyword_rc.search(value.strip()):
+                                    match = True
+                                    break
 
             if match:
                 rd = parse_recipe(config, tinfoil, fn, True)
@@ -46,7 +46,7 @@ class InvalidTargetFileError(Exception):
 
 def find_target_file(targetpath, d, pkglist=None):
     """Find the recipe installing the specified target path, optionally limited to a select list of packages"""
-    import json
+    import oe.packagedata
 
     pkgdata_dir = d.getVar('PKGDATA_DIR', True)
 
@@ -77,24 +77,19 @@ def find_target_file(targetpath, d, pkglist=None):
             pkgdatafile = os.path.join(root, fn)
             if pkglist and not os.path.exists(pkgdatafile):
                 continue
-            with open(pkgdatafile, 'r') as f:
-                pn = ''
-                # This does assume that PN comes before other values, but that's a fairly safe assumption
-                for line in f:
-                    if line.startswith('PN:'):
-                        pn = line.split(':', 1)[1].strip()
-                    elif line.startswith('FILES_INFO:'):
-                        val = line.split(':', 1)[1].strip()
-                        dictval = json.loads(val)
-                        for fullpth in dictval.keys():
-                            if fnmatch.fnmatchcase(fullpth, targetpath):
-                                recipes[targetpath].append(pn)
-                    elif line.startswith('pkg_preinst_') or line.startswith('pkg_postinst_'):
-                        scriptval = line.split(':', 1)[1].strip().encode('utf-8').decode('unicode_escape')
-                        if 'update-alternatives --install %s ' % targetpath in scriptval:
-                            recipes[targetpath].append('?%s' % pn)
-                        elif targetpath_re.search(scriptval):
-                            recipes[targetpath].append('!%s' % pn)
+            pkgdata = oe.packagedata.read_runtime_pkgdata(pkgdatafile)
+            pn = pkgdata.get('PN', '').strip()
+            for key, val in pkgdata.items():
+                if key == 'FILES_INFO':
+                    for fullpth in val.keys():
+                        if fnmatch.fnmatchcase(fullpth, targetpath):
+                            recipes[targetpath].append(pn)
+                elif key.startswith('pkg_preinst_') or key.startswith('pkg_postinst_'):
+                    scriptval = val.strip()
+                    if 'update-alternatives --install %s ' % targetpath in scriptval:
+                        recipes[targetpath].append('?%s' % pn)
+                    elif targetpath_re.search(scriptval):
+                        recipes[targetpath].append('!%s' % pn)
     return recipes
 
 def _get_recipe_file(cooker, pn):
@@ -21,7 +21,6 @@ import argparse
 import glob
 import fnmatch
 import re
-import json
 import logging
 import scriptutils
 from urllib.parse import urlparse, urldefrag, urlsplit
@@ -51,6 +50,7 @@ class RecipeHandler(object):
     def load_libmap(d):
         '''Load library->recipe mapping'''
         import oe.package
+        import oe.packagedata
 
         if RecipeHandler.recipelibmap:
             return
@@ -75,17 +75,13 @@ class RecipeHandler(object):
         # Now turn it into a library->recipe mapping
         pkgdata_dir = d.getVar('PKGDATA_DIR', True)
         for libname, pkg in pkglibmap.items():
-            try:
-                with open(os.path.join(pkgdata_dir, 'runtime', pkg)) as f:
-                    for line in f:
-                        if line.startswith('PN:'):
-                            RecipeHandler.recipelibmap[libname] = line.split(':', 1)[-1].strip()
-                            break
-            except IOError as ioe:
-                if ioe.errno == 2:
-                    logger.warn('unable to find a pkgdata file for package %s' % pkg)
-                else:
-                    raise
+            pkgdatafile = os.path.join(pkgdata_dir, 'runtime', pkg)
+            if not os.path.exists(pkgdatafile):
+                logger.warn('unable to find a pkgdata file for package %s' % pkg)
+                continue
+            pn = oe.packagedata.read_pkgdatafile(pkgdatafile).get('PN')
+            if pn is not None:
+                RecipeHandler.recipelibmap[libname] = pn.strip()
 
         # Some overrides - these should be mapped to the virtual
         RecipeHandler.recipelibmap['GL'] = 'virtual/libgl'
@@ -95,33 +91,29 @@ class RecipeHandler(object):
     @staticmethod
     def load_devel_filemap(d):
         '''Build up development file->recipe mapping'''
+        import oe.packagedata
+
         if RecipeHandler.recipeheadermap:
             return
         pkgdata_dir = d.getVar('PKGDATA_DIR', True)
         includedir = d.getVar('includedir', True)
         cmakedir = os.path.join(d.getVar('libdir', True), 'cmake')
         for pkg in glob.glob(os.path.join(pkgdata_dir, 'runtime', '*-dev')):
-            with open(os.path.join(pkgdata_dir, 'runtime', pkg)) as f:
-                pn = None
-                headers = []
-                cmakefiles = []
-                for line in f:
-                    if line.startswith('PN:'):
-                        pn = line.split(':', 1)[-1].strip()
-                    elif line.startswith('FILES_INFO:'):
-                        val = line.split(':', 1)[1].strip()
-                        dictval = json.loads(val)
-                        for fullpth in sorted(dictval):
-                            if fullpth.startswith(includedir) and fullpth.endswith('.h'):
-                                headers.append(os.path.relpath(fullpth, includedir))
-                            elif fullpth.startswith(cmakedir) and fullpth.endswith('.cmake'):
-                                cmakefiles.append(os.path.relpath(fullpth, cmakedir))
-                if pn and headers:
-                    for header in headers:
-                        RecipeHandler.recipeheadermap[header] = pn
-                if pn and cmakefiles:
-                    for fn in cmakefiles:
-                        RecipeHandler.recipecmakefilemap[fn] = pn
+            pkgdata = oe.packagedata.read_runtime_pkgdata(os.path.join(pkgdata_dir, 'runtime', pkg))
+            pn = (pkgdata.get('PN') or '').strip() or None
+            headers = []
+            cmakefiles = []
+            for fullpth in sorted(pkgdata.get('FILES_INFO') or {}):
+                if fullpth.startswith(includedir) and fullpth.endswith('.h'):
+                    headers.append(os.path.relpath(fullpth, includedir))
+                elif fullpth.startswith(cmakedir) and fullpth.endswith('.cmake'):
+                    cmakefiles.append(os.path.relpath(fullpth, cmakedir))
+            if pn and headers:
+                for header in headers:
+                    RecipeHandler.recipeheadermap[header] = pn
+            if pn and cmakefiles:
+                for fn in cmakefiles:
+                    RecipeHandler.recipecmakefilemap[fn] = pn
 
     @staticmethod
     def load_binmap(d):
@@ -983,6 +975,8 @@ def split_pkg_licenses(licvalues, packages, outlines, fallback_licenses=None, pn
     return outlicenses
 
 def read_pkgconfig_provides(d):
+    import oe.packagedata
+
     pkgdatadir = d.getVar('PKGDATA_DIR', True)
     pkgmap = {}
     for fn in glob.glob(os.path.join(pkgdatadir, 'shlibs2', '*.pclist')):
@@ -993,10 +987,9 @@ def read_pkgconfig_provides(d):
     for pc, pkg in pkgmap.items():
         pkgdatafile = os.path.join(pkgdatadir, 'runtime', pkg)
         if os.path.exists(pkgdatafile):
-            with open(pkgdatafile, 'r') as f:
-                for line in f:
-                    if line.startswith('PN: '):
-                        recipemap[pc] = line.split(':', 1)[1].strip()
+            pn = oe.packagedata.read_pkgdatafile(pkgdatafile).get('PN')
+            if pn is not None:
+                recipemap[pc] = pn.strip()
     return recipemap
 
 def convert_debian(debpath):
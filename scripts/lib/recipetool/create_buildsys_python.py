@@ -531,6 +531,8 @@ class PythonRecipeHandler(RecipeHandler):
         return deps
 
     def parse_pkgdata_for_python_packages(self):
+        import oe.packagedata
+
         suffixes = [t[0] for t in imp.get_suffixes()]
         pkgdata_dir = tinfoil.config_data.getVar('PKGDATA_DIR', True)
 
@@ -544,15 +546,9 @@ class PythonRecipeHandler(RecipeHandler):
                        os.path.dirname(python_sitedir) + os.sep]
         packages = {}
         for pkgdatafile in glob.glob('{}/runtime/*'.format(pkgdata_dir)):
-            files_info = None
-            with open(pkgdatafile, 'r') as f:
-                for line in f.readlines():
-                    field, value = line.split(': ', 1)
-                    if field == 'FILES_INFO':
-                        files_info = ast.literal_eval(value)
-                        break
-                else:
-                    continue
+            files_info = oe.packagedata.read_runtime_pkgdata(pkgdatafile).get('FILES_INFO')
+            if files_info is None:
+                continue
 
             for fn in files_info:
                 for suffix in suffixes:
@@ -25,7 +25,9 @@ and returns an instance of the class.
 import os
 import struct
 import array
+import bisect
 import fcntl
+import errno
 import tempfile
 import logging
 
@@ -185,9 +187,9 @@ def _lseek(file_obj, offset, whence):
     except OSError as err:
         # The 'lseek' system call returns the ENXIO if there is no data or
         # hole starting from the specified offset.
-        if err.errno == os.errno.ENXIO:
+        if err.errno == errno.ENXIO:
             return -1
-        elif err.errno == os.errno.EINVAL:
+        elif err.errno == errno.EINVAL:
             raise ErrorNotSupp("the kernel or file-system does not support "
                                "\"SEEK_HOLE\" and \"SEEK_DATA\"")
         else:
@@ -323,18 +325,25 @@ _FIEMAP_IOCTL = 0xC020660B
 # This FIEMAP ioctl flag which instructs the kernel to sync the file before
 # reading the block map
 _FIEMAP_FLAG_SYNC = 0x00000001
+# This 'struct fiemap_extent' flag marks the last extent of the file
+_FIEMAP_EXTENT_LAST = 0x00000001
 # Size of the buffer for 'struct fiemap_extent' elements which will be used
 # when invoking the FIEMAP ioctl. The larger is the buffer, the less times the
 # FIEMAP ioctl will be invoked.
-_FIEMAP_BUFFER_SIZE = 256 * 1024
+_FIEMAP_BUFFER_SIZE = 1024 * 1024
 
 class FilemapFiemap(_FilemapBase):
     """
     This class provides API to the FIEMAP ioctl. Namely, it allows to iterate
     over all mapped blocks and over all holes.
 
-    This class synchronizes the image file every time it invokes the FIEMAP
-    ioctl in order to work-around early FIEMAP implementation kernel bugs.
+    The whole extent list of the image file is fetched once, when the instance
+    is created, and kept in two sorted arrays of first and last block numbers
+    of the mapped ranges. All queries are answered from these arrays by binary
+    search, so the block map reflects the state of the file at creation time.
+
+    The image file is synchronized when the FIEMAP ioctl is invoked in order
+    to work-around early FIEMAP implementation kernel bugs.
     """
 
     def __init__(self, image, log=None):
@@ -359,8 +368,11 @@ class FilemapFiemap(_FilemapBase):
         # Allocate a mutable buffer for the FIEMAP ioctl
         self._buf = array.array('B', [0] * self._buf_size)
 
-        # Check if the FIEMAP ioctl is supported
-        self.block_is_mapped(0)
+        # Fetch the block map, this also checks if the FIEMAP ioctl is
+        # supported
+        self._firsts = array.array('Q')
+        self._lasts = array.array('Q')
+        self._load_extents()
 
     def _invoke_fiemap(self, block, count):
         """
@@ -390,12 +402,12 @@ class FilemapFiemap(_FilemapBase):
         except IOError as err:
             # Note, the FIEMAP ioctl is supported by the Linux kernel starting
             # from version 2.6.28 (year 2008).
-            if err.errno == os.errno.EOPNOTSUPP:
+            if err.errno == errno.EOPNOTSUPP:
                 errstr = "FilemapFiemap: the FIEMAP ioctl is not supported " \
                          "by the file-system"
                 self._log.debug(errstr)
                 raise ErrorNotSupp(errstr)
-            if err.errno == os.errno.ENOTTY:
+            if err.errno == errno.ENOTTY:
                 errstr = "FilemapFiemap: the FIEMAP ioctl is not supported " \
                          "by the kernel"
                 self._log.debug(errstr)
@@ -405,97 +417,96 @@ class FilemapFiemap(_FilemapBase):
 
         return struct.unpack(_FIEMAP_FORMAT, self._buf[:_FIEMAP_SIZE])
 
-    def block_is_mapped(self, block):
-        """Refer the '_FilemapBase' class for the documentation."""
-        struct_fiemap = self._invoke_fiemap(block, 1)
-
-        # The 3rd element of 'struct_fiemap' is the 'fm_mapped_extents' field.
-        # If it contains zero, the block is not mapped, otherwise it is
-        # mapped.
-        result = bool(struct_fiemap[3])
-        self._log.debug("FilemapFiemap: block_is_mapped(%d) returns %s"
-                        % (block, result))
-        return result
-
-    def block_is_unmapped(self, block):
-        """Refer the '_FilemapBase' class for the documentation."""
-        return not self.block_is_mapped(block)
-
-    def _unpack_fiemap_extent(self, index):
+    def _iter_fiemap_extents(self, count):
         """
-        Unpack a 'struct fiemap_extent' structure object number 'index' from
-        the internal 'self._buf' buffer.
+        Unpack the first 'count' 'struct fiemap_extent' structures from the
+        internal 'self._buf' buffer.
         """
 
-        offset = _FIEMAP_SIZE + _FIEMAP_EXTENT_SIZE * index
-        return struct.unpack(_FIEMAP_EXTENT_FORMAT,
-                             self._buf[offset : offset + _FIEMAP_EXTENT_SIZE])
+        end = _FIEMAP_SIZE + _FIEMAP_EXTENT_SIZE * count
+        return struct.iter_unpack(_FIEMAP_EXTENT_FORMAT,
+                                  self._buf[_FIEMAP_SIZE:end].tobytes())
 
-    def _do_get_mapped_ranges(self, start, count):
+    def _load_extents(self):
         """
-        Implements most the functionality for the  'get_mapped_ranges()'
-        generator: invokes the FIEMAP ioctl, walks through the mapped extents
-        and yields mapped block ranges. However, the ranges may be consecutive
-        (e.g., (1, 100), (100, 200)) and 'get_mapped_ranges()' simply merges
-        them.
+        Fetch all mapped extents of the image file, filling as many extents
+        per FIEMAP ioctl as the buffer holds, and store them as merged block
+        ranges in 'self._firsts' and 'self._lasts'.
         """
 
-        block = start
-        while block < start + count:
-            struct_fiemap = self._invoke_fiemap(block, count)
+        firsts = self._firsts
+        lasts = self._lasts
+        block = 0
+        while True:
+            struct_fiemap = self._invoke_fiemap(block,
+                                                max(self.blocks_cnt - block, 1))
 
+            # The 3rd element of 'struct_fiemap' is the 'fm_mapped_extents'
+            # field
             mapped_extents = struct_fiemap[3]
             if mapped_extents == 0:
-                # No more mapped blocks
-                return
-
-            extent = 0
-            while extent < mapped_extents:
-                fiemap_extent = self._unpack_fiemap_extent(extent)
-
-                # Start of the extent
-                extent_start = fiemap_extent[0]
-                # Starting block number of the extent
-                extent_block = extent_start // self.block_size
-                # Length of the extent
-                extent_len = fiemap_extent[2]
-                # Count of blocks in the extent
-                extent_count = extent_len // self.block_size
+                break
+
+            for fiemap_extent in self._iter_fiemap_extents(mapped_extents):
+                extent_start, extent_len = fiemap_extent[0], fiemap_extent[2]
 
                 # Extent length and offset have to be block-aligned
                 assert extent_start % self.block_size == 0
                 assert extent_len % self.block_size == 0
 
-                if extent_block > start + count - 1:
-                    return
+                first = extent_start // self.block_size
+                last = min(first + extent_len // self.block_size,
+                           self.blocks_cnt) - 1
+                if last < first:
+                    continue
+
+                if lasts and lasts[-1] + 1 >= first:
+                    lasts[-1] = max(lasts[-1], last)
+                else:
+                    firsts.append(first)
+                    lasts.append(last)
+
+            # The 6th element of 'fiemap_extent' is the 'fe_flags' field
+            if fiemap_extent[5] & _FIEMAP_EXTENT_LAST or not lasts or \
+               lasts[-1] < block or lasts[-1] + 1 >= self.blocks_cnt:
+                break
+            block = lasts[-1] + 1
+
+        self._log.debug("FilemapFiemap: %d mapped ranges" % len(firsts))
+
+    def block_is_mapped(self, block):
+        """Refer the '_FilemapBase' class for the documentation."""
+        index = bisect.bisect_left(self._lasts, block)
+        result = index < len(self._lasts) and self._firsts[index] <= block
+        self._log.debug("FilemapFiemap: block_is_mapped(%d) returns %s"
+                        % (block, result))
+        return result
 
-                first = max(extent_block, block)
-                last = min(extent_block + extent_count, start + count) - 1
-                yield (first, last)
+    def block_is_unmapped(self, block):
+        """Refer the '_FilemapBase' class for the documentation."""
+        return not self.block_is_mapped(block)
 
-                extent += 1
+    def _do_get_mapped_ranges(self, start, count):
+        """
+        Yield the mapped block ranges which intersect the area of 'count'
+        blocks starting from block 'start', clipped to that area.
+        """
 
-            block = extent_block + extent_count
+        end = start + count - 1
+        index = bisect.bisect_left(self._lasts, start)
+        while index < len(self._lasts) and self._firsts[index] <= end:
+            yield (max(self._firsts[index], start),
+                   min(self._lasts[index], end))
+            index += 1
 
     def get_mapped_ranges(self, start, count):
         """Refer the '_FilemapBase' class for the documentation."""
         self._log.debug("FilemapFiemap: get_mapped_ranges(%d,  %d(%d))"
                         % (start, count, start + count - 1))
-        iterator = self._do_get_mapped_ranges(start, count)
-        first_prev, last_prev = next(iterator)
-
-        for first, last in iterator:
-            if last_prev == first - 1:
-                last_prev = last
-            else:
-                self._log.debug("FilemapFiemap: yielding range (%d, %d)"
-                                % (first_prev, last_prev))
-                yield (first_prev, last_prev)
-                first_prev, last_prev = first, last
-
-        self._log.debug("FilemapFiemap: yielding range (%d, %d)"
-                        % (first_prev, last_prev))
-        yield (first_prev, last_prev)
+        for first, last in self._do_get_mapped_ranges(start, count):
+            self._log.debug("FilemapFiemap: yielding range (%d, %d)"
+                            % (first, last))
+            yield (first, last)
 
     def get_unmapped_ranges(self, start, count):
         """Refer the '_FilemapBase' class for the documentation."""
@@ -530,32 +541,132 @@ def filemap(image, log=None):
     except ErrorNotSupp:
         return FilemapSeek(image, log)
 
-def sparse_copy(src_fname, dst_fname, offset=0, skip=0):
-    """Efficiently copy sparse file to or into another file."""
+# The FICLONERANGE ioctl number and the format of 'struct file_clone_range'
+_FICLONERANGE_IOCTL = 0x4020940D
+_FILE_CLONE_RANGE_FORMAT = "=qQQQ"
+
+# Default amount of bytes moved per copy system call
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Copy methods tried by 'sparse_copy()', in order of preference
+COPY_APIS = ("reflink", "copy_file_range", "sendfile", "readwrite")
+
+class _RangeCopier(object):
+    """
+    Copy byte ranges from one file descriptor to another using the cheapest
+    mechanism the kernel and the file-systems support: cloning the extents
+    with the FICLONERANGE ioctl (btrfs, xfs), copying them in the kernel with
+    'copy_file_range()' or 'sendfile()', or reading and writing them through
+    user space. Methods which turn out to be unsupported are dropped, so that
+    they are not retried for every range.
+    """
+
+    # Errors meaning "this method cannot be used for these files"
+    _UNSUPPORTED = (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.ENOSYS,
+                    errno.EBADF, errno.EPERM, errno.EINVAL)
+
+    def __init__(self, src_fd, dst_fd, chunk_size=None, api=None, log=None):
+        self._src_fd = src_fd
+        self._dst_fd = dst_fd
+        self._chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        self._log = log or logging.getLogger(__name__)
+
+        apis = list(api or COPY_APIS)
+        for name in apis:
+            if name not in COPY_APIS:
+                raise Error("unknown copy method '%s'" % name)
+        if "copy_file_range" in apis and not hasattr(os, "copy_file_range"):
+            apis.remove("copy_file_range")
+        if "sendfile" in apis and not hasattr(os, "sendfile"):
+            apis.remove("sendfile")
+        # The plain read/write loop always works, so it is the last resort
+        if "readwrite" not in apis:
+            apis.append("readwrite")
+        self._apis = apis
+
+    def _disable(self, name, err):
+        """Stop using copy method 'name' because of error 'err'."""
+        if name in self._apis:
+            self._log.debug("sparse_copy: disabling %s: %s" % (name, err))
+            self._apis.remove(name)
+
+    def _reflink(self, src_off, dst_off, length):
+        """Share the extents of the range between both files."""
+        arg = struct.pack(_FILE_CLONE_RANGE_FORMAT, self._src_fd, src_off,
+                          length, dst_off)
+        fcntl.ioctl(self._dst_fd, _FICLONERANGE_IOCTL, arg)
+        return length
+
+    def _copy_file_range(self, src_off, dst_off, length):
+        return os.copy_file_range(self._src_fd, self._dst_fd,
+                                  min(length, self._chunk_size),
+                                  src_off, dst_off)
+
+    def _sendfile(self, src_off, dst_off, length):
+        # sendfile() writes at the current position of the output file
+        os.lseek(self._dst_fd, dst_off, os.SEEK_SET)
+        return os.sendfile(self._dst_fd, self._src_fd, src_off,
+                           min(length, self._chunk_size))
+
+    def _readwrite(self, src_off, dst_off, length):
+        chunk = os.pread(self._src_fd, min(length, self._chunk_size), src_off)
+        if chunk:
+            os.pwrite(self._dst_fd, chunk, dst_off)
+        return len(chunk)
+
+    def copy(self, src_off, dst_off, length):
+        """
+        Copy 'length' bytes at offset 'src_off' of the source file to offset
+        'dst_off' of the destination file. Copying stops early at the end of
+        the source file.
+        """
+
+        index = 0
+        while length > 0:
+            name = self._apis[index]
+            try:
+                done = getattr(self, "_" + name)(src_off, dst_off, length)
+            except (IOError, OSError) as err:
+                if name == "readwrite":
+                    raise
+                if name == "reflink" and err.errno == errno.EINVAL:
+                    # The range is not aligned to the file-system block size,
+                    # so copy it with the next method but keep cloning the
+                    # other ranges
+                    index += 1
+                    continue
+                if err.errno in self._UNSUPPORTED:
+                    self._disable(name, err)
+                    continue
+                raise
+            if done == 0:
+                break
+            src_off += done
+            dst_off += done
+            length -= done
+
+def sparse_copy(src_fname, dst_fname, offset=0, skip=0, chunk_size=None,
+                api=None):
+    """
+    Efficiently copy sparse file to or into another file. Only the mapped
+    ranges of the source file are copied, using the methods listed in 'api'
+    (by default all of 'COPY_APIS', in that order) and moving at most
+    'chunk_size' bytes per system call.
+    """
     fmap = filemap(src_fname)
     try:
         dst_file = open(dst_fname, 'r+b')
     except IOError:
         dst_file = open(dst_fname, 'wb')
 
-    for first, last in fmap.get_mapped_ranges(0, fmap.blocks_cnt):
-        start = first * fmap.block_size
-        end = (last + 1) * fmap.block_size
-
-        if start < skip < end:
-            start = skip
-
-        fmap._f_image.seek(start, os.SEEK_SET)
-        dst_file.seek(offset + start, os.SEEK_SET)
+    with dst_file:
+        copier = _RangeCopier(fmap._f_image.fileno(), dst_file.fileno(),
+                              chunk_size, api)
+        for first, last in fmap.get_mapped_ranges(0, fmap.blocks_cnt):
+            start = first * fmap.block_size
+            end = min((last + 1) * fmap.block_size, fmap.image_size)
 
-        chunk_size = 1024 * 1024
-        to_read = end - start
-        read = 0
+            if start < skip < end:
+                start = skip
 
-        while read < to_read:
-            if read + chunk_size > to_read:
-                chunk_size = to_read - read
-            chunk = fmap._f_image.read(chunk_size)
-            dst_file.write(chunk)
-            read += chunk_size
-    dst_file.close()
+            copier.copy(start, offset + start, end - start)
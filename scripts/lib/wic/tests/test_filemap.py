@@ -0,0 +1,235 @@
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from wic import filemap
+
+class FilemapTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="wic-test_filemap")
+        self.src = os.path.join(self.tmpdir, "src.img")
+        self.dst = os.path.join(self.tmpdir, "dst.img")
+        with open(self.src, "wb") as f:
+            self.block_size = filemap.get_block_size(f)
+        try:
+            filemap.FilemapFiemap(self.src)
+        except filemap.ErrorNotSupp:
+            shutil.rmtree(self.tmpdir)
+            self.skipTest("FIEMAP is not supported in %s" % self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_sparse(self, blocks, nblocks):
+        """
+        Create the source image with 'nblocks' blocks of which only the
+        blocks in 'blocks' are written, each with its own block number.
+        """
+        fd = os.open(self.src, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        try:
+            for block in blocks:
+                os.pwrite(fd, block.to_bytes(8, "little") * (self.block_size // 8),
+                          block * self.block_size)
+            os.ftruncate(fd, nblocks * self.block_size)
+        finally:
+            os.close(fd)
+
+    def ranges(self, blocks):
+        """Merge the sorted block numbers in 'blocks' into (first, last) ranges."""
+        ranges = []
+        for block in blocks:
+            if ranges and ranges[-1][1] + 1 == block:
+                ranges[-1] = (ranges[-1][0], block)
+            else:
+                ranges.append((block, block))
+        return ranges
+
+class TestFilemapFiemap(FilemapTestCase):
+    blocks = [0, 1, 3, 6, 7, 8, 10, 14, 15, 20, 22]
+
+    def check_map(self, blocks, nblocks):
+        fmap = filemap.FilemapFiemap(self.src)
+        self.assertEqual(fmap.blocks_cnt, nblocks)
+        mapped = self.ranges(blocks)
+        unmapped = self.ranges(sorted(set(range(nblocks)) - set(blocks)))
+        self.assertEqual(list(fmap.get_mapped_ranges(0, nblocks)), mapped)
+        self.assertEqual(list(fmap.get_unmapped_ranges(0, nblocks)), unmapped)
+        for block in (0, 1, nblocks // 2, nblocks - 2, nblocks - 1):
+            self.assertEqual(fmap.block_is_mapped(block), block in blocks)
+            self.assertEqual(fmap.block_is_unmapped(block), block not in blocks)
+        return fmap
+
+    def test_small_buffer(self):
+        # Room for three extents per ioctl, so that the extents and the holes
+        # between them are fetched across several buffer refills
+        self.make_sparse(self.blocks, 25)
+        size = filemap._FIEMAP_SIZE + 3 * filemap._FIEMAP_EXTENT_SIZE
+        with mock.patch.object(filemap, "_FIEMAP_BUFFER_SIZE", size):
+            fmap = self.check_map(self.blocks, 25)
+        self.assertEqual(fmap._fiemap_extent_cnt, 3)
+
+        # Queries are clipped to the requested area
+        self.assertEqual(list(fmap.get_mapped_ranges(7, 8)), [(7, 8), (10, 10), (14, 14)])
+        self.assertEqual(list(fmap.get_unmapped_ranges(7, 8)), [(9, 9), (11, 13)])
+
+    def test_buffer_boundary(self):
+        # One more extent than the default 1 MiB buffer holds, with a hole
+        # after every block
+        fmap = filemap.FilemapFiemap(self.src)
+        nextents = fmap._fiemap_extent_cnt + 1
+        blocks = list(range(0, 2 * nextents, 2))
+        self.make_sparse(blocks, 2 * nextents + 1)
+        self.check_map(blocks, 2 * nextents + 1)
+
+    def test_empty(self):
+        self.make_sparse([], 16)
+        self.check_map([], 16)
+
+    def test_full(self):
+        self.make_sparse(range(16), 16)
+        self.check_map(list(range(16)), 16)
+
+class TestSparseCopy(FilemapTestCase):
+    blocks = [0, 1, 3, 6, 7, 8, 10, 14, 15, 20, 22]
+
+    def setUp(self):
+        super().setUp()
+        self.make_sparse(self.blocks, 25)
+        with open(self.src, "rb") as f:
+            self.data = f.read()
+
+    def check_copy(self, offset=0, **kwargs):
+        filemap.sparse_copy(self.src, self.dst, offset=offset, **kwargs)
+        with open(self.dst, "rb") as f:
+            f.seek(offset)
+            # The trailing hole of the source isn't copied
+            end = (self.blocks[-1] + 1) * self.block_size
+            self.assertEqual(f.read(), self.data[:end])
+        # Only the mapped ranges were written, shifted by the offset
+        fmap = filemap.FilemapFiemap(self.dst)
+        shift = offset // self.block_size
+        self.assertEqual(list(fmap.get_mapped_ranges(shift, fmap.blocks_cnt - shift)),
+                         [(first + shift, last + shift) for first, last in self.ranges(self.blocks)])
+
+    def test_copy(self):
+        self.check_copy()
+
+    def test_offset(self):
+        self.check_copy(offset=4 * self.block_size)
+
+    def test_chunk_size(self):
+        for api in filemap.COPY_APIS:
+            with self.subTest(api=api):
+                self.check_copy(chunk_size=self.block_size // 2, api=[api])
+                os.unlink(self.dst)
+
+    def test_unknown_api(self):
+        with self.assertRaises(filemap.Error):
+            filemap.sparse_copy(self.src, self.dst, api=["splice"])
+
+class TestRangeCopier(FilemapTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = os.urandom(3 * self.block_size + 100)
+        with open(self.src, "wb") as f:
+            f.write(self.data)
+        self.src_fd = os.open(self.src, os.O_RDONLY)
+        self.dst_fd = os.open(self.dst, os.O_RDWR | os.O_CREAT)
+
+    def tearDown(self):
+        os.close(self.src_fd)
+        os.close(self.dst_fd)
+        super().tearDown()
+
+    def copier(self, **kwargs):
+        return filemap._RangeCopier(self.src_fd, self.dst_fd, **kwargs)
+
+    def check(self, copier, src_off=0, dst_off=0, length=None):
+        if length is None:
+            length = len(self.data) - src_off
+        copier.copy(src_off, dst_off, length)
+        self.assertEqual(os.pread(self.dst_fd, length, dst_off),
+                         self.data[src_off:src_off + length])
+
+    def unsupported(self, *args):
+        raise OSError(errno.EOPNOTSUPP, os.strerror(errno.EOPNOTSUPP))
+
+    def test_fallbacks(self):
+        # Every in-kernel method is dropped after its first failure, until
+        # only the read/write loop is left
+        copier = self.copier()
+        calls = []
+        def fail(name):
+            def method(*args):
+                calls.append(name)
+                self.unsupported()
+            return method
+        with mock.patch.object(copier, "_reflink", fail("reflink")), \
+             mock.patch.object(copier, "_copy_file_range", fail("copy_file_range")), \
+             mock.patch.object(copier, "_sendfile", fail("sendfile")):
+            self.check(copier)
+            self.assertEqual(copier._apis, ["readwrite"])
+            self.check(copier, self.block_size, 0, self.block_size)
+        self.assertEqual(calls, ["reflink", "copy_file_range", "sendfile"])
+
+    def test_fallback_order(self):
+        for api in filemap.COPY_APIS[1:]:
+            with self.subTest(api=api):
+                copier = self.copier()
+                if api not in copier._apis:
+                    continue
+                patches = [mock.patch.object(copier, "_" + name, self.unsupported)
+                           for name in filemap.COPY_APIS[:filemap.COPY_APIS.index(api)]]
+                for p in patches:
+                    p.start()
+                try:
+                    with mock.patch.object(copier, "_" + api, wraps=getattr(copier, "_" + api)) as method:
+                        self.check(copier, dst_off=self.block_size)
+                finally:
+                    for p in patches:
+                        p.stop()
+                self.assertTrue(method.called)
+                self.assertEqual(copier._apis[0], api)
+
+    def test_reflink_unaligned(self):
+        # An unaligned range is copied by the next method, but reflink is
+        # still tried for the following ranges
+        copier = self.copier()
+        def einval(*args):
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+        with mock.patch.object(copier, "_reflink", einval):
+            self.check(copier, 100, 0, self.block_size)
+        self.assertEqual(copier._apis[0], "reflink")
+
+    def test_missing_syscalls(self):
+        with mock.patch.dict(os.__dict__):
+            os.__dict__.pop("copy_file_range", None)
+            os.__dict__.pop("sendfile", None)
+            copier = self.copier(api=["copy_file_range", "sendfile"])
+            self.assertEqual(copier._apis, ["readwrite"])
+            self.check(copier)
+
+    def test_error(self):
+        # Errors other than "not supported" are not hidden by a fallback
+        copier = self.copier(api=["sendfile"])
+        def eio(*args):
+            raise OSError(errno.EIO, os.strerror(errno.EIO))
+        with mock.patch.object(copier, "_sendfile", eio):
+            with self.assertRaises(OSError):
+                copier.copy(0, 0, self.block_size)
+        self.assertIn("sendfile", copier._apis)
+
+    def test_short_source(self):
+        # Copying stops at the end of the source file
+        copier = self.copier(api=["readwrite"])
+        copier.copy(0, 0, len(self.data) + self.block_size)
+        self.assertEqual(os.fstat(self.dst_fd).st_size, len(self.data))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -19,6 +19,7 @@
 # Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from wic import msger
 from wic.utils.errors import ImageError
 from wic.utils.oe.misc import exec_cmd, exec_native_cmd
@@ -350,23 +351,34 @@ class Image():
             if os.path.isfile(image):
                 os.remove(image)
 
-    def assemble(self, image_file):
+    def assemble(self, image_file, jobs=None):
         msger.debug("Installing partitions")
 
-        for part in self.partitions:
-            source = part['source_file']
-            if source:
+        parts = [part for part in self.partitions if part['source_file']]
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+
+        # Partitions occupy disjoint areas of the image, so their contents
+        # can be copied in concurrently
+        with ThreadPoolExecutor(max(1, min(jobs, len(parts)))) as executor:
+            copies = [executor.submit(sparse_copy, part['source_file'],
+                                      image_file,
+                                      part['start'] * self.sector_size)
+                      for part in parts]
+            for part, copy in zip(parts, copies):
                 # install source_file contents into a partition
-                sparse_copy(source, image_file, part['start'] * self.sector_size)
+                copy.result()
+                source = part['source_file']
 
                 msger.debug("Installed %s in partition %d, sectors %d-%d, "
                             "size %d sectors" % \
                             (source, part['num'], part['start'],
                              part['start'] + part['size'] - 1, part['size']))
 
-                partimage = image_file + '.p%d' % part['num']
-                os.rename(source, partimage)
-                self.partimages.append(partimage)
+        for part in parts:
+            partimage = image_file + '.p%d' % part['num']
+            os.rename(part['source_file'], partimage)
+            self.partimages.append(partimage)
 
     def create(self):
         for dev in self.disks: